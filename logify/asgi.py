@@ -0,0 +1,26 @@
+"""
+ASGI config for logify project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Webhook requests are validated on the event loop and
+only valid requests are run by Django, in a bounded thread pool; see
+:mod:`webhooks.libs.asgi`.
+
+Run it with any ASGI server, for example::
+
+    uvicorn logify.asgi:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logify.settings")
+
+wsgi_application = get_wsgi_application()
+
+from webhooks.libs import worker
+from webhooks.libs.asgi import WebhookASGIHandler
+
+worker.start()
+application = WebhookASGIHandler(wsgi_application)
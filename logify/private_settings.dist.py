@@ -20,6 +20,19 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/1.8/topics/cache/
+# Webhook lookups are cached here (see OBJECT_CACHE_ALIAS). locmem is
+# private to each process; use memcached to share entries between them:
+# 'BACKEND': 'django.core.cache.backends.memcached.PyLibMCCache',
+# 'LOCATION': '127.0.0.1:11211',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Shopify Shared Secret
 # This is the shared secret for your ap in Shopify.
 SHARED_SECRET ='PUT YOUR SHARED SECRET HERE'
@@ -8,6 +8,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.7/ref/settings/
 """
 
+import os
+
 # ###########################################
 # Import private settings (such as passwords)
 from logify.private_settings import *
@@ -58,3 +60,111 @@ USE_I18N = True
 USE_L10N = True
 
 USE_TZ = True
+
+# Webhook processing
+# The number of threads that run Django code under the ASGI entry point
+# (logify/asgi.py). Requests beyond twice this number wait on the event
+# loop without holding a thread.
+ASGI_THREAD_POOL_SIZE = 8
+
+# Requests with larger bodies are refused with 413 before the body is
+# read. WEBHOOK_MAX_BODY_SIZES overrides the limit per X-Shopify-Topic.
+WEBHOOK_MAX_BODY_SIZE = 512 * 2 ** 10
+WEBHOOK_MAX_BODY_SIZES = {
+    'orders/create': 4 * 2 ** 20,
+    'orders/updated': 4 * 2 ** 20,
+    'orders/paid': 4 * 2 ** 20,
+    'orders/cancelled': 4 * 2 ** 20,
+    'orders/fulfilled': 4 * 2 ** 20,
+    'products/create': 8 * 2 ** 20,
+    'products/update': 8 * 2 ** 20,
+    'carts/create': 2 * 2 ** 20,
+    'carts/update': 2 * 2 ** 20,
+    'checkouts/create': 2 * 2 ** 20,
+    'checkouts/update': 2 * 2 ** 20,
+    'refunds/create': 2 * 2 ** 20,
+}
+
+# Admission control (webhooks/libs/admission.py). Each shop has a token
+# bucket of (requests per second, burst) ADMISSION_SHOP_BUCKET, and one
+# per topic of ADMISSION_TOPIC_BUCKET unless ADMISSION_TOPIC_BUCKETS
+# overrides it. Beyond its budget a shop gets 429; beyond
+# ADMISSION_MAX_IN_FLIGHT concurrent webhook requests, everyone gets 503.
+# The budgets and counts live in the ADMISSION_CACHE_ALIAS cache; with the
+# default locmem backend they are per process, so point it at a cache
+# shared by the workers, such as memcached, for site-wide limits.
+ADMISSION_ENABLED = True
+ADMISSION_CACHE_ALIAS = 'default'
+ADMISSION_SHOP_BUCKET = (50, 500)
+ADMISSION_TOPIC_BUCKET = (20, 200)
+ADMISSION_TOPIC_BUCKETS = {
+    'carts/update': (40, 400),
+    'checkouts/update': (40, 400),
+}
+ADMISSION_MAX_IN_FLIGHT = 200
+
+# Cart and checkout states are buffered in memory and written in bulk
+# every WRITE_BEHIND_FLUSH_INTERVAL seconds (0 disables the timer), when
+# a buffer holds WRITE_BEHIND_MAX_SIZE keys, and at exit. A buffer that
+# cannot be flushed holds no more keys than that; webhooks for new keys
+# get a 503.
+WRITE_BEHIND_FLUSH_INTERVAL = 5
+WRITE_BEHIND_MAX_SIZE = 10000
+
+# Open checkouts with no order ABANDONED_CHECKOUT_DELAY seconds after
+# their last update are marked abandoned. The timers are checked every
+# ABANDONED_CHECKOUT_TICK seconds (0 disables the ticker).
+ABANDONED_CHECKOUT_DELAY = 6 * 60 * 60
+ABANDONED_CHECKOUT_TICK = 1
+
+# Standalone ingress (manage.py serve_ingress / consume_spool)
+INGRESS_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+# The ingress answers 503 while the spool holds this many bytes.
+INGRESS_SPOOL_MAX_BYTES = 2 ** 30
+INGRESS_SPOOL_SEGMENT_BYTES = 64 * 2 ** 20
+# Seconds after which a spool segment is handed to the consumers.
+INGRESS_SPOOL_SEGMENT_AGE = 1.0
+
+# Customer and shop lookups by the webhook views are cached in a
+# per-process LRU of OBJECT_CACHE_LOCAL_SIZE entries kept for
+# OBJECT_CACHE_LOCAL_TTL seconds, backed by the OBJECT_CACHE_ALIAS entry
+# of CACHES for OBJECT_CACHE_TIMEOUT seconds.
+OBJECT_CACHE_ALIAS = 'default'
+OBJECT_CACHE_TIMEOUT = 600
+OBJECT_CACHE_LOCAL_SIZE = 10000
+OBJECT_CACHE_LOCAL_TTL = 5
+
+# Changelog of the webhook writes (/webhooks/changes, manage.py
+# tail_changelog). Records are served once CHANGELOG_SETTLE seconds old,
+# so that writes still committing with lower offsets are not skipped.
+# Long polls check for records every CHANGELOG_POLL_INTERVAL seconds for
+# up to CHANGELOG_MAX_WAIT seconds, and return up to CHANGELOG_PAGE_SIZE
+# records.
+CHANGELOG_SETTLE = 1.0
+CHANGELOG_POLL_INTERVAL = 0.5
+CHANGELOG_MAX_WAIT = 30
+CHANGELOG_PAGE_SIZE = 500
+
+# Profiling of the webhook requests (manage.py profile_report). A
+# fraction PROFILE_SAMPLE_RATE of the requests (0 disables sampling) are
+# profiled into PROFILE_DIR, as is any request with an X-Logify-Profile
+# header equal to PROFILE_SECRET, which belongs in private_settings.
+PROFILE_SAMPLE_RATE = 0
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Stage tracing of the webhook requests. Requests taking at least
+# TRACE_SLOW_THRESHOLD seconds are stored with their stages and their
+# payload, redacted and cut to TRACE_PAYLOAD_MAX characters; the latest
+# TRACE_SLOW_EVENTS are kept. When TRACE_ZIPKIN_URL is set (such as
+# 'http://localhost:9411/api/v2/spans'), spans are posted to it every
+# TRACE_EXPORT_INTERVAL seconds, queueing at most TRACE_EXPORT_QUEUE.
+TRACE_ENABLED = True
+TRACE_SLOW_THRESHOLD = 0.5
+TRACE_SLOW_EVENTS = 1000
+TRACE_PAYLOAD_MAX = 16 * 2 ** 10
+TRACE_ZIPKIN_URL = None
+TRACE_EXPORT_INTERVAL = 1.0
+TRACE_EXPORT_QUEUE = 10000
+
+# Clients allowed to read /webhooks/metrics and /webhooks/changes
+INTERNAL_IPS = ('127.0.0.1', '::1')
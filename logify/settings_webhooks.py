@@ -0,0 +1,21 @@
+"""
+Django settings for the webhook ingress of the logify project.
+
+Webhook requests are stateless, exempt from CSRF and authenticated by
+their HMAC, so the session, CSRF, authentication, message and
+clickjacking middleware do nothing for them but cost time on every
+request. These settings keep only the common middleware and route only
+the webhook URLs. Serve them with logify/wsgi_webhooks.py and point
+``/webhooks/`` at that application; everything else (the admin) keeps
+using logify/wsgi.py and the full middleware stack.
+"""
+
+from logify.settings import *
+
+MIDDLEWARE_CLASSES = (
+    'django.middleware.common.CommonMiddleware',
+)
+
+ROOT_URLCONF = 'logify.urls_webhooks'
+
+WSGI_APPLICATION = 'logify.wsgi_webhooks.application'
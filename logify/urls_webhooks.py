@@ -0,0 +1,11 @@
+"""
+URLconf for the webhook-only deployment (see logify/wsgi_webhooks.py).
+
+Only the webhook views are routed; the admin is served by the regular
+URLconf in logify/urls.py.
+"""
+from django.conf.urls import include, url
+
+urlpatterns = [
+    url(r'^webhooks/', include('webhooks.urls')),
+]
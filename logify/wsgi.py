@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logify.settings")
 
 application = get_wsgi_application()
+
+from webhooks.libs import worker
+
+worker.start()
@@ -0,0 +1,22 @@
+"""
+WSGI config for the webhook ingress of the logify project.
+
+It exposes the WSGI callable as a module-level variable named
+``application``. This application only serves ``/webhooks/`` and runs
+with the reduced middleware stack in logify/settings_webhooks.py.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/1.8/howto/deployment/wsgi/
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "logify.settings_webhooks")
+
+application = get_wsgi_application()
+
+from webhooks.libs import worker
+
+worker.start()
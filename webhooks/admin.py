@@ -1,4 +1,191 @@
+'''
+Admin for the stored Shopify objects.
+
+The customer tables are expected to grow to millions of rows, so the
+changelists avoid the queries whose cost grows with the table:
+
+* the row count comes from :class:`EstimatedCountPaginator` rather than
+  ``COUNT(*)``, and the unfiltered total is not shown;
+* search terms are matched exactly against indexed columns instead of
+  ``LIKE '%term%'`` over several text columns;
+* tags and addresses are prefetched for the displayed page only, and
+  edited through raw ID widgets rather than select boxes listing every
+  row;
+* list filters offer fixed choices rather than the distinct values of
+  the column, which Django would read with ``SELECT DISTINCT``.
+'''
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+
 from webhooks import models
 
-admin.site.register(models.Customer)
\ No newline at end of file
+
+def table_estimate(model, using):
+    '''
+    Return the number of rows in the table of `model` as estimated by the
+    database, or `None` if the backend has no cheap estimate.
+    '''
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class '
+                           'WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute('SELECT table_rows FROM information_schema.tables '
+                           'WHERE table_schema = DATABASE() '
+                           'AND table_name = %s', [table])
+        elif connection.vendor == 'sqlite':
+            # The largest rowid, found through the primary key; an upper
+            # bound as long as rows are only appended.
+            cursor.execute('SELECT MAX(_rowid_) FROM %s' %
+                           connection.ops.quote_name(table))
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def unfiltered(queryset):
+    '''
+    Tell whether `queryset` selects the same rows as the default manager
+    of its model. Tombstoned rows hidden by the manager are then part
+    of the estimate of :func:`table_estimate` until they are purged.
+    '''
+    base = queryset.model._default_manager.db_manager(queryset.db).all()
+    return where_sql(queryset) == where_sql(base)
+
+
+def where_sql(queryset):
+    query = queryset.query
+    return query.get_compiler(queryset.db).compile(query.where)
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    A paginator that counts cheaply. An unfiltered queryset is counted
+    from the database's own estimate of the table size. A filtered one,
+    or a table with fewer than :attr:`limit` rows, is counted exactly,
+    but never beyond :attr:`limit` rows, so counting takes bounded time.
+    '''
+    limit = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            queryset = self.object_list
+            estimate = None
+            if unfiltered(queryset):
+                estimate = table_estimate(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.limit:
+                self._count = estimate
+            else:
+                self._count = queryset.order_by()[:self.limit].count()
+        return self._count
+    count = property(_get_count)
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-id',)
+
+    #: Search terms made of digits are looked up in this column.
+    search_id_field = 'shopify_id'
+
+    def get_search_results(self, request, queryset, search_term):
+        '''
+        Match the search term exactly: digits against
+        :attr:`search_id_field`, anything else against
+        :meth:`search_lookups`. Every lookup must use an index.
+        '''
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit() and self.search_id_field:
+            return queryset.filter(**{self.search_id_field: int(term)}), False
+        return queryset.filter(**self.search_lookups(term)), False
+
+    def search_lookups(self, term):
+        return {}
+
+
+class StateFilter(admin.SimpleListFilter):
+    '''
+    Filter customers by the account states Shopify sends.
+    '''
+    title = 'state'
+    parameter_name = 'state'
+
+    def lookups(self, request, model_admin):
+        return [(state, state)
+                for state in ('enabled', 'disabled', 'invited', 'declined')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(state=self.value())
+        return queryset
+
+
+class CustomerAdmin(ScalableAdmin):
+    list_display = ('shopify_id', 'first_name', 'last_name', 'email', 'state',
+                    'orders_count', 'total_spent', 'tag_names')
+    list_filter = (StateFilter, 'accepts_marketing')
+    search_fields = ('=shopify_id', '=email', '=last_name')
+    raw_id_fields = ('tags', 'addresses', 'canonical')
+    readonly_fields = ('email_hash',)
+
+    def get_queryset(self, request):
+        return (super().get_queryset(request)
+                .prefetch_related('tags', 'addresses'))
+
+    def search_lookups(self, term):
+        if '@' in term:
+            return {'email_hash': models.hash_email(term)}
+        return {'last_name': term}
+
+    def tag_names(self, customer):
+        return ', '.join(tag.name for tag in customer.tags.all())
+    tag_names.short_description = 'tags'
+
+
+class CustomerAddressAdmin(ScalableAdmin):
+    list_display = ('shopify_id', 'name', 'address1', 'city', 'zip',
+                    'country_code')
+    search_fields = ('=shopify_id',)
+
+
+class CustomerTagAdmin(ScalableAdmin):
+    list_display = ('name',)
+    search_fields = ('=name',)
+    search_id_field = None
+    ordering = ('name',)
+
+    def search_lookups(self, term):
+        return {'name': term}
+
+
+class ShopAdmin(ScalableAdmin):
+    list_display = ('shopify_id', 'name', 'myshopify_domain', 'plan_name',
+                    'email')
+    search_fields = ('=shopify_id', '=myshopify_domain')
+
+    def search_lookups(self, term):
+        return {'myshopify_domain': term}
+
+
+class SlowEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'topic', 'shop', 'status', 'duration')
+    list_filter = ('topic',)
+    ordering = ('-id',)
+    readonly_fields = ('created_at', 'trace_id', 'topic', 'shop', 'status',
+                       'duration', 'stages', 'payload')
+
+
+admin.site.register(models.Customer, CustomerAdmin)
+admin.site.register(models.CustomerAddress, CustomerAddressAdmin)
+admin.site.register(models.CustomerTag, CustomerTagAdmin)
+admin.site.register(models.Shop, ShopAdmin)
+admin.site.register(models.SlowEvent, SlowEventAdmin)
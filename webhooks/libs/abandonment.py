@@ -0,0 +1,232 @@
+'''
+Flag checkouts that are not followed by an order.
+
+Every checkout webhook (re)arms a timer in a
+:class:`webhooks.libs.timerwheel.TimerWheel` that expires
+``settings.ABANDONED_CHECKOUT_DELAY`` seconds after the checkout was
+last updated. An order referencing the checkout cancels its timer. When
+a timer expires, the checkout is marked abandoned with a conditional
+``UPDATE`` that only matches checkouts which are still open and have
+not been updated since, so timers that are stale, or held twice by
+several processes, are harmless.
+
+The timers live in memory. A serving process starts its ticker when it
+starts (see :mod:`webhooks.libs.worker`), or else on its first checkout
+webhook, and rebuilds them from the open checkouts in the database, so
+none are lost across a restart.
+'''
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from webhooks.libs import metrics
+from webhooks.libs.timerwheel import TimerWheel
+from webhooks.models import Checkout
+
+
+logger = logging.getLogger(__name__)
+
+#: The number of checkouts marked per statement, which keeps the
+#: ``IN`` list within SQLite's limit on query parameters.
+MARK_BATCH_SIZE = 500
+
+
+def _timestamp(value):
+    return value.timestamp() if value is not None else time.time()
+
+
+class AbandonmentScheduler():
+    '''
+    :param float delay: Seconds after its last update at which an open
+      checkout is abandoned; defaults to
+      ``settings.ABANDONED_CHECKOUT_DELAY``.
+    :param float tick: The resolution of the timers in seconds; defaults
+      to ``settings.ABANDONED_CHECKOUT_TICK``.
+    '''
+    def __init__(self, delay=None, tick=None):
+        self._delay = delay
+        self._tick = tick
+        self._wheel = None
+        self._lock = threading.Lock()
+        self._started = False
+        self.started_at = time.time()
+        self.fired = 0
+        self.abandoned = 0
+
+    @property
+    def delay(self):
+        if self._delay is not None:
+            return self._delay
+        return settings.ABANDONED_CHECKOUT_DELAY
+
+    @property
+    def tick_interval(self):
+        if self._tick is not None:
+            return self._tick
+        return settings.ABANDONED_CHECKOUT_TICK
+
+    @property
+    def wheel(self):
+        if self._wheel is None:
+            self._wheel = TimerWheel(time.time(), self.tick_interval or 1.0)
+        return self._wheel
+
+    def arm(self, checkout):
+        '''
+        Set the timer of `checkout`, replacing any earlier one. A
+        completed checkout has its timer cancelled instead.
+
+        :param checkout: A :class:`webhooks.models.Checkout`, saved or
+          not.
+        '''
+        if checkout.completed_at is not None:
+            self.cancel(checkout.shopify_id)
+            return
+        self.start()
+        deadline = _timestamp(checkout.updated_at) + self.delay
+        with self._lock:
+            self.wheel.schedule(checkout.shopify_id, deadline)
+            held = len(self.wheel)
+        metrics.incr('abandonment.armed')
+        metrics.gauge('abandonment.timers', value=held)
+
+    def cancel(self, checkout_id):
+        '''
+        Cancel the timer of the checkout with the given Shopify ID.
+        '''
+        with self._lock:
+            cancelled = self.wheel.cancel(checkout_id)
+            held = len(self.wheel)
+        if cancelled:
+            metrics.incr('abandonment.cancelled')
+            metrics.gauge('abandonment.timers', value=held)
+
+    def tick(self, now=None):
+        '''
+        Advance the timers to `now` and mark the checkouts whose timers
+        expired as abandoned.
+
+        :returns: the number of checkouts marked abandoned.
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            expired = self.wheel.advance(now)
+            held = len(self.wheel)
+        metrics.gauge('abandonment.timers', value=held)
+        if not expired:
+            return 0
+
+        self.fired += len(expired)
+        metrics.incr('abandonment.fired', amount=len(expired))
+        updated = mark_abandoned(expired, now - self.delay)
+        self.abandoned += updated
+        metrics.incr('abandonment.abandoned', amount=updated)
+        return updated
+
+    def rebuild(self):
+        '''
+        Load a timer for every open checkout in the database that has
+        none yet, as after a restart. Timers armed by webhooks are kept,
+        since they are at least as recent. Checkouts that are overdue
+        expire on the next :meth:`tick`.
+
+        :returns: the number of timers held.
+        '''
+        checkouts = open_checkouts().values_list('shopify_id', 'updated_at')
+        for shopify_id, updated_at in checkouts.iterator():
+            deadline = _timestamp(updated_at) + self.delay
+            with self._lock:
+                if shopify_id not in self.wheel:
+                    self.wheel.schedule(shopify_id, deadline)
+
+        held = len(self.wheel)
+        metrics.gauge('abandonment.timers', value=held)
+        return held
+
+    def stats(self):
+        '''
+        Return the number of timers held, the number fired and the
+        average number fired per second since the scheduler was created.
+        '''
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        return {
+            'timers': len(self.wheel),
+            'fired': self.fired,
+            'abandoned': self.abandoned,
+            'firing_rate': self.fired / elapsed,
+        }
+
+    def start(self):
+        '''
+        Rebuild the timers from the database and start the ticker, unless
+        ``settings.ABANDONED_CHECKOUT_TICK`` is 0. Only the first call
+        has any effect.
+        '''
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        interval = self.tick_interval
+        if interval:
+            thread = threading.Thread(target=self._run, args=(interval,),
+                                      name='abandonment')
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, interval):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the checkout timers failed')
+            connection.close()
+        while True:
+            time.sleep(interval)
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('Marking abandoned checkouts failed')
+                connection.close()
+
+
+def open_checkouts():
+    '''
+    Return the checkouts that are neither completed, ordered nor
+    abandoned.
+    '''
+    return Checkout.objects.filter(completed_at__isnull=True,
+                                   order_shopify_id__isnull=True,
+                                   abandoned_at__isnull=True)
+
+
+def mark_abandoned(checkout_ids, updated_before):
+    '''
+    Mark the given checkouts abandoned if they are still open and were
+    last updated no later than `updated_before`.
+
+    :param checkout_ids: Shopify IDs of checkouts.
+    :param float updated_before: A UNIX timestamp.
+    :returns: the number of checkouts marked.
+    '''
+    cutoff = datetime.datetime.fromtimestamp(updated_before, timezone.utc)
+    now = timezone.now()
+    checkout_ids = list(checkout_ids)
+    updated = 0
+    for start in range(0, len(checkout_ids), MARK_BATCH_SIZE):
+        updated += open_checkouts().filter(
+            Q(updated_at__lte=cutoff) | Q(updated_at__isnull=True),
+            shopify_id__in=checkout_ids[start:start + MARK_BATCH_SIZE],
+        ).update(abandoned_at=now)
+    return updated
+
+
+#: The scheduler of this process.
+scheduler = AbandonmentScheduler()
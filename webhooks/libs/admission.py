@@ -0,0 +1,217 @@
+'''
+Admission control for webhook requests.
+
+Every request is charged to two token buckets, one for its shop and one
+for its shop and topic, and counts towards the number of webhook
+requests in flight across all processes. A request is refused before
+its body is read:
+
+* with 503 while more than ``settings.ADMISSION_MAX_IN_FLIGHT`` requests
+  are being processed;
+* with 429 when its shop, or its shop and topic, has used up its budget.
+
+Both carry a Retry-After header. Shopify retries failed webhooks later,
+so shedding load defers work rather than losing it.
+
+The buckets and the in-flight counters live in the Django cache
+``settings.ADMISSION_CACHE_ALIAS``, so they are shared by every process
+using the same cache server. The default locmem backend is not shared:
+each process then has its own buckets and counters, and the limits
+apply per process. A bucket is stored as the time it was last refilled
+to full and the number of requests admitted since, which lets the
+atomic ``incr()`` of the cache backend do the accounting without locks.
+
+Requests in flight are counted per window of :data:`IN_FLIGHT_WINDOW`
+seconds: a request is counted in the window it is admitted in, which it
+records in the request environ, and released from the same one. The
+requests in flight are those of the current and the previous window.
+The counter of a window expires well after both are over, so it is
+never dropped while its requests are running, and counts leaked by
+killed processes are forgotten within two windows.
+
+The shop and topic headers are not authenticated before admission, so
+they are hashed into the cache keys, which keeps the keys short and
+safe for memcached. Shed requests are counted in the ``webhooks.shed``
+metric by reason (``overload``, ``shop`` or ``topic``) and by one of
+:data:`SHOP_BUCKETS` buckets of shops (see :func:`shop_bucket`), so
+that arbitrary headers cannot create unbounded metric labels.
+'''
+import hashlib
+import math
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+import django.http
+
+from webhooks.libs import metrics
+
+
+#: Seconds per window of the in-flight counters.
+IN_FLIGHT_WINDOW = 60
+#: The environ key recording the in-flight counter of an admitted
+#: request.
+LEASE_ENVIRON_KEY = 'logify.admission.lease'
+#: The number of shop buckets used as metric labels.
+SHOP_BUCKETS = 64
+#: Seconds a bucket is kept; the cache backend API cannot extend the
+#: expiry of a key on use, so this is long enough for any busy bucket to
+#: fill up and restart in between.
+BUCKET_TTL = 24 * 60 * 60
+
+
+def backend():
+    return caches[settings.ADMISSION_CACHE_ALIAS]
+
+
+def take(key, rate, burst, now=None):
+    '''
+    Take a token from the bucket `key`, which holds up to `burst` tokens
+    and gains `rate` tokens per second.
+
+    :returns: 0 if a token was taken, otherwise the number of seconds
+      until one will be available.
+    '''
+    shared = backend()
+    now = time.time() if now is None else now
+    epoch_key, count_key = key + ':epoch', key + ':count'
+    epoch = shared.get(epoch_key)
+
+    count = None
+    if epoch is not None:
+        try:
+            count = shared.incr(count_key)
+        except ValueError:  # Evicted
+            pass
+    # The bucket holds the tokens accrued since the epoch that have not
+    # been taken, capped at `burst`: once it is full (or unknown), start
+    # a new epoch with a full bucket.
+    if count is None or rate * (now - epoch) - (count - 1) >= burst:
+        shared.set_many({epoch_key: now - burst / rate, count_key: 1},
+                        BUCKET_TTL)
+        return 0
+
+    missing = count - rate * (now - epoch)
+    if missing > 0:
+        shared.decr(count_key)
+        return missing / rate
+    return 0
+
+
+def refund(key):
+    '''
+    Put back a token taken from the bucket `key`.
+    '''
+    try:
+        backend().decr(key + ':count')
+    except ValueError:
+        pass
+
+
+def digest(value):
+    '''
+    Return a short hash of a header value, for use in cache keys.
+    '''
+    data = value.encode('utf8', 'surrogateescape')
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def shop_bucket(shop):
+    '''
+    Return the metric label of the shop domain `shop`.
+    '''
+    data = shop.encode('utf8', 'surrogateescape')
+    return 'shops-%02d' % (zlib.crc32(data) % SHOP_BUCKETS)
+
+
+def bucket_for(topic):
+    return settings.ADMISSION_TOPIC_BUCKETS.get(
+        topic, settings.ADMISSION_TOPIC_BUCKET)
+
+
+def admit(meta):
+    '''
+    Decide whether to process a request, given its headers. If it is
+    admitted, :func:`release` must be called with the same `meta` once
+    it is processed.
+
+    :param dict meta: The request headers in WSGI environ form.
+    :returns: ``None`` if the request is admitted; otherwise a 429 or
+      503 response to return instead.
+    '''
+    shop = meta['HTTP_X_SHOPIFY_SHOP_DOMAIN']
+    topic = meta['HTTP_X_SHOPIFY_TOPIC']
+
+    lease = _enter()
+    if lease is None:
+        metrics.incr('webhooks.shed', 'overload', shop_bucket(shop))
+        return _refuse(503, 'Overloaded', 1)
+    meta[LEASE_ENVIRON_KEY] = lease
+
+    shop_key = 'logify:admission:%s' % digest(shop)
+    wait = take(shop_key, *settings.ADMISSION_SHOP_BUCKET)
+    reason = 'shop'
+    if not wait:
+        wait = take('%s:%s' % (shop_key, digest(topic)), *bucket_for(topic))
+        reason = 'topic'
+        if wait:
+            refund(shop_key)
+    if wait:
+        release(meta)
+        metrics.incr('webhooks.shed', reason, shop_bucket(shop))
+        return _refuse(429, 'Rate limit exceeded', wait)
+    return None
+
+
+def _refuse(status, message, retry_after):
+    response = django.http.HttpResponse(message, status=status)
+    response['Retry-After'] = str(max(int(math.ceil(retry_after)), 1))
+    return response
+
+
+def window_key(window):
+    return 'logify:admission:in-flight:%d' % window
+
+
+def _enter(now=None):
+    '''
+    Count a request in flight, unless the limit is reached.
+
+    :returns: the key of the counter it was counted in, or ``None``.
+    '''
+    shared = backend()
+    window = int((time.time() if now is None else now) // IN_FLIGHT_WINDOW)
+    key = window_key(window)
+    try:
+        count = shared.incr(key)
+    except ValueError:
+        # Kept until the window after next is over
+        shared.add(key, 0, 3 * IN_FLIGHT_WINDOW)
+        count = shared.incr(key)
+    count += max(shared.get(window_key(window - 1), 0), 0)
+    if count > settings.ADMISSION_MAX_IN_FLIGHT:
+        shared.decr(key)
+        return None
+    return key
+
+
+def release(meta):
+    '''
+    Count an admitted request as no longer in flight.
+
+    :param dict meta: The environ of the request given to :func:`admit`.
+    '''
+    key = meta.pop(LEASE_ENVIRON_KEY, None)
+    if key is None:
+        return
+    try:
+        backend().decr(key)
+    except ValueError:  # Forgotten after running for over a window
+        pass
+
+
+def in_flight(now=None):
+    window = int((time.time() if now is None else now) // IN_FLIGHT_WINDOW)
+    counts = backend().get_many([window_key(window), window_key(window - 1)])
+    return max(sum(counts.values()), 0)
@@ -0,0 +1,148 @@
+'''
+Move customers that have not been updated for a long time out of the
+customer table.
+
+``manage.py archive_customers`` moves customers last updated before a
+cutoff, in batches, into :class:`ArchivedCustomer` rows holding the
+customer, its tag names and its addresses as JSON, which keeps the
+customer table and its indexes limited to the customers in use. The
+archive is partitioned by the month of the last update, so that old
+months can be exported or dropped with one indexed statement; a table
+per month, as the archive would be partitioned on PostgreSQL, cannot be
+managed by Django migrations.
+
+Lookups by Shopify ID fall back to the archive:
+
+* :func:`lookup` returns an unsaved copy of an archived customer;
+* :func:`restore` moves it back into the customer table, which the
+  webhook views do before applying an update. The customer reappears
+  in the changelog as created, with all its fields and tags.
+'''
+import datetime
+import json
+
+from django.db import transaction
+
+from webhooks.libs import cache, changelog, redaction
+from webhooks.models import (ArchivedCustomer, Customer, CustomerAddress,
+                             CustomerTag)
+
+
+#: Fields recomputed or relinked rather than archived.
+SKIPPED_FIELDS = ('id', 'email_hash', 'canonical', 'deleted_at')
+
+
+def dump(instance, skipped=('id',)):
+    '''
+    Return the concrete field values of `instance` as JSON-compatible
+    strings, by attribute name.
+    '''
+    values = {}
+    for field in instance._meta.concrete_fields:
+        if field.name in skipped:
+            continue
+        value = getattr(instance, field.attname)
+        values[field.attname] = (None if value is None
+                                 else field.value_to_string(instance))
+    return values
+
+
+def load(model, values):
+    '''
+    Build an unsaved instance of `model` from the output of :func:`dump`.
+    '''
+    fields = dict((field.attname, field)
+                  for field in model._meta.concrete_fields)
+    return model(**dict(
+        (name, None if value is None else fields[name].to_python(value))
+        for name, value in values.items() if name in fields))
+
+
+def month_of(moment):
+    return datetime.date(moment.year, moment.month, 1)
+
+
+def archive_batch(updated_before, batch_size):
+    '''
+    Archive up to `batch_size` customers last updated before
+    `updated_before`, in one transaction.
+
+    :returns: the number of customers archived.
+    '''
+    with transaction.atomic():
+        customers = list(
+            Customer.objects.select_for_update()
+            .filter(updated_at__lt=updated_before).order_by('id')
+            .prefetch_related('tags', 'addresses')[:batch_size])
+        if not customers:
+            return 0
+        ids = [customer.id for customer in customers]
+
+        ArchivedCustomer.objects.bulk_create(
+            ArchivedCustomer(
+                shopify_id=customer.shopify_id, siteid=customer.siteid,
+                month=month_of(customer.updated_at),
+                updated_at=customer.updated_at,
+                data=json.dumps({
+                    'customer': dump(customer, SKIPPED_FIELDS),
+                    'tags': [tag.name for tag in customer.tags.all()],
+                    'addresses': [dump(address)
+                                  for address in customer.addresses.all()],
+                }))
+            for customer in customers)
+
+        redaction.delete_links(ids)
+        duplicates = Customer.all_objects.filter(canonical_id__in=ids)
+        unlinked = list(duplicates.values_list('shopify_id', flat=True))
+        duplicates.update(canonical=None)
+        hot = Customer.all_objects.filter(id__in=ids)
+        hot._raw_delete(hot.db)
+
+    for shopify_id in unlinked + [customer.shopify_id
+                                  for customer in customers]:
+        cache.invalidate(Customer, shopify_id)
+    return len(customers)
+
+
+def lookup(shopify_id):
+    '''
+    Return the customer with the given Shopify ID, from the customer
+    table or otherwise as an unsaved copy from the archive.
+
+    :raises Customer.DoesNotExist: if it is in neither.
+    '''
+    try:
+        return cache.get(Customer, shopify_id)
+    except Customer.DoesNotExist:
+        archived = ArchivedCustomer.objects.filter(
+            shopify_id=shopify_id).first()
+        if archived is None:
+            raise
+    return load(Customer, json.loads(archived.data)['customer'])
+
+
+def restore(shopify_id):
+    '''
+    Move an archived customer back into the customer table, and record
+    it in the changelog in the same transaction.
+
+    :returns: the restored :class:`Customer`, or `None` if the customer
+      is not archived.
+    '''
+    with transaction.atomic():
+        archived = (ArchivedCustomer.objects.select_for_update()
+                    .filter(shopify_id=shopify_id).first())
+        if archived is None:
+            return None
+        data = json.loads(archived.data)
+        customer = load(Customer, data['customer'])
+        customer.save()
+        for name in data['tags']:
+            customer.tags.add(CustomerTag.get_or_create(name))
+        for values in data['addresses']:
+            address = load(CustomerAddress, values)
+            address.save()
+            customer.addresses.add(address)
+        archived.delete()
+        changelog.created(customer, tags=', '.join(data['tags']))
+    return customer
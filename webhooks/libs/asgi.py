@@ -0,0 +1,238 @@
+'''
+An ASGI front end for the webhook views.
+
+Under WSGI every webhook holds a worker thread from the moment the
+request arrives until the view returns, including the time spent
+receiving the body and checking its HMAC. :class:`WebhookASGIHandler`
+does that work on the event loop instead: the body is received
+asynchronously and the header and HMAC checks run inline, so invalid
+requests never reach a thread. Only requests that pass the checks (and
+all non-webhook requests, such as the admin) are handed to the regular
+Django WSGI application, which runs in a bounded thread pool where the
+ORM can block safely.
+'''
+import asyncio
+import concurrent.futures
+import io
+import sys
+
+from django.conf import settings
+import django.http
+
+from webhooks.libs import validate
+
+
+class AsyncValidateShopifyWebhookRequest():
+    '''
+    The asynchronous counterpart of
+    :class:`webhooks.libs.validate.ValidateShopifyWebhookRequest`.
+
+    It validates a request that has been described by a WSGI environ
+    and a fully received body. The wrapped `handler` is a coroutine
+    function that is only awaited for valid requests.
+    '''
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def __call__(self, environ, body):
+        '''
+        :param dict environ: The WSGI environ for the request.
+        :param bytes body: The request body.
+        :returns: a (status, headers, body) tuple.
+        '''
+        response = validate.check_shopify_webhook_request(
+            environ['REQUEST_METHOD'], environ)
+        if response is None and not validate.verify_hmac(
+                body, environ['HTTP_X_SHOPIFY_HMAC_SHA256']):
+            response = django.http.HttpResponseForbidden('Invalid HMAC')
+        if response is not None:
+            return _response_tuple(response)
+
+        environ[validate.PREVALIDATED_ENVIRON_KEY] = True
+        result = await self.handler(environ, body)
+        return result
+
+
+class WebhookASGIHandler():
+    '''
+    An ASGI application that serves the project through
+    `wsgi_application`.
+
+    :param wsgi_application: The Django WSGI application.
+    :param int max_workers: The number of threads that may run Django
+      code at once; defaults to ``settings.ASGI_THREAD_POOL_SIZE``.
+    :param str prefix: Requests whose path starts with this prefix are
+      validated on the event loop before being handed to Django.
+    '''
+    def __init__(self, wsgi_application, max_workers=None,
+                 prefix='/webhooks/shopify/'):
+        if max_workers is None:
+            max_workers = getattr(settings, 'ASGI_THREAD_POOL_SIZE', 8)
+
+        self.wsgi_application = wsgi_application
+        self.prefix = prefix
+        self.max_workers = max_workers
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.validated = AsyncValidateShopifyWebhookRequest(self.run_in_pool)
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope type %r' % scope['type'])
+
+        limit = None
+        if scope['path'].startswith(self.prefix):
+            headers = dict(scope.get('headers', []))
+            limit = validate.max_body_size(
+                headers.get(b'x-shopify-topic', b'').decode('latin1'))
+            declared = validate.content_length(
+                {'CONTENT_LENGTH': headers.get(b'content-length', b'0')})
+
+        if limit is not None and declared > limit:
+            body = None  # Refuse without reading the body
+        else:
+            body = await self.read_body(receive, limit)
+
+        if body is None:
+            response = django.http.HttpResponse('Payload too large', status=413)
+            status, headers, content = _response_tuple(response)
+        elif limit is not None:
+            environ = self.build_environ(scope, body)
+            status, headers, content = await self.validated(environ, body)
+        else:
+            environ = self.build_environ(scope, body)
+            status, headers, content = await self.run_in_pool(environ, body)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(k.lower().encode('latin1'), v.encode('latin1'))
+                        for k, v in headers],
+        })
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        '''
+        Handle the ASGI lifespan protocol. On shutdown, wait for the
+        requests already in the thread pool to finish.
+        '''
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def read_body(self, receive, limit=None):
+        '''
+        Receive the request body.
+
+        :param int limit: The largest acceptable body in bytes, or
+          `None` for no limit.
+        :returns: the body, or `None` if it is larger than `limit`.
+        '''
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if limit is not None and received > limit:
+                return None
+            chunks.append(chunk)
+            more_body = message.get('more_body', False)
+        return b''.join(chunks)
+
+    async def run_in_pool(self, environ, body):
+        '''
+        Run the WSGI application for `environ` in the thread pool. At
+        most twice as many requests as there are threads are queued on
+        the pool; further requests wait on the event loop, where they
+        cost no thread.
+        '''
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers * 2)
+
+        await self._slots.acquire()
+        try:
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(
+                self.executor, self.call_wsgi, environ)
+        finally:
+            self._slots.release()
+        return result
+
+    def call_wsgi(self, environ):
+        '''
+        Call the WSGI application and collect its response.
+
+        :returns: a (status, headers, body) tuple.
+        '''
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        status, headers = started
+        return int(status.split(' ', 1)[0]), headers, content
+
+    @staticmethod
+    def build_environ(scope, body):
+        '''
+        Translate an ASGI HTTP scope into a WSGI environ.
+        '''
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name == 'CONTENT_LENGTH':
+                continue
+            if name != 'CONTENT_TYPE':
+                name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ',' + value
+            environ[name] = value
+
+        return environ
+
+
+def _response_tuple(response):
+    '''
+    Convert a Django response into a (status, headers, body) tuple.
+    '''
+    return response.status_code, list(response.items()), response.content
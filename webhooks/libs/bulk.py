@@ -0,0 +1,126 @@
+'''
+Set-based writes for collections of child rows.
+
+Payloads such as products carry hundreds of nested objects. Saving them
+one by one costs a query or two per object; the helpers here write the
+whole collection with a fixed number of statements instead.
+'''
+from django.db import connections
+from django.db.models import Case, Value, When
+
+
+def bulk_update(model, instances, fields, key='shopify_id', using='default'):
+    '''
+    Update `fields` of the rows matching `instances` on `key` with one
+    ``UPDATE ... SET field = CASE key WHEN ... END`` statement per batch.
+    Batches are only needed on backends that limit the number of query
+    parameters (SQLite); elsewhere the update is a single statement.
+
+    :param model: The model class.
+    :param instances: Model instances holding the new values.
+    :param fields: The names of the fields to update.
+    :param str key: The name of the unique field identifying each row.
+    :returns: the number of statements issued.
+    '''
+    if not instances or not fields:
+        return 0
+
+    meta = model._meta
+    key_field = meta.get_field(key)
+    model_fields = [meta.get_field(name) for name in fields]
+    connection = connections[using]
+    batch_size = max(connection.ops.bulk_batch_size(
+        model_fields * 2 + [key_field], instances), 1)
+
+    statements = 0
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        updates = {}
+        for field in model_fields:
+            whens = [When(**{key: getattr(obj, key),
+                             'then': Value(getattr(obj, field.attname),
+                                           output_field=field)})
+                     for obj in batch]
+            updates[field.attname] = Case(*whens, output_field=field)
+        keys = [getattr(obj, key) for obj in batch]
+        model._default_manager.using(using).filter(
+            **{key + '__in': keys}).update(**updates)
+        statements += 1
+    return statements
+
+
+def batches(model, field, values, using='default'):
+    '''
+    Split `values` into lists small enough for a ``field__in`` lookup.
+    Like in :func:`bulk_update`, this only splits them on backends that
+    limit the number of query parameters (SQLite).
+
+    :param model: The model class.
+    :param str field: The name of the field looked up.
+    :param values: The values looked up.
+    :returns: a list of lists of values.
+    '''
+    values = list(values)
+    connection = connections[using]
+    size = max(connection.ops.bulk_batch_size(
+        [model._meta.get_field(field)], values), 1)
+    return [values[start:start + size]
+            for start in range(0, len(values), size)]
+
+
+def existing_keys(model, keys, key='shopify_id', using='default'):
+    '''
+    Return the set of `keys` for which a row of `model` exists, with one
+    query per batch (see :func:`batches`).
+
+    :param str key: The name of the unique field holding the keys.
+    '''
+    manager = model._default_manager.using(using)
+    existing = set()
+    for batch in batches(model, key, keys, using):
+        existing.update(manager.filter(**{key + '__in': batch})
+                        .values_list(key, flat=True))
+    return existing
+
+
+def sync_children(model, parent_field, parent, instances, fields,
+                  key='shopify_id', using='default'):
+    '''
+    Make the children of `parent` match `instances`, keyed on `key`:
+    rows for new keys are inserted, rows for known keys are updated and
+    rows whose key is not in `instances` are deleted. This takes one
+    query to find the known keys, one to find the current children, one
+    insert, one update (see :func:`bulk_update`) and one delete, however
+    many children there are; on SQLite, lookups of many keys are split
+    into batches (see :func:`batches`).
+
+    The keys of `instances` must be unique; see
+    :func:`webhooks.libs.schema.check_items`.
+
+    :param model: The child model class.
+    :param str parent_field: The name of the child's foreign key to the
+      parent.
+    :param parent: The saved parent instance.
+    :param instances: Unsaved child instances built from the payload.
+    :param fields: The names of the fields to update on known rows.
+    :param str key: The name of the unique field identifying each child.
+    '''
+    manager = model._default_manager.using(using)
+    for obj in instances:
+        setattr(obj, parent_field, parent)
+
+    keys = [getattr(obj, key) for obj in instances]
+    existing = existing_keys(model, keys, key, using)
+
+    created = [obj for obj in instances if getattr(obj, key) not in existing]
+    updated = [obj for obj in instances if getattr(obj, key) in existing]
+
+    if created:
+        manager.bulk_create(created)
+    bulk_update(model, updated, list(fields) + [parent_field], key, using)
+
+    current = manager.filter(**{parent_field: parent}).values_list(
+        key, flat=True)
+    removed = set(current).difference(keys)
+    for batch in batches(model, key, removed, using):
+        manager.filter(**{key + '__in': batch}).delete()
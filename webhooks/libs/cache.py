@@ -0,0 +1,299 @@
+'''
+A two-tier read-through cache of model instances by Shopify ID.
+
+Lookups go to a small per-process LRU first, then to the Django cache
+``settings.OBJECT_CACHE_ALIAS`` shared by all processes, and only then
+to the database. Entries are keyed by ``(model, shopify_id)`` and hold
+the pickled instance, or a marker for IDs that are not in the database
+so that repeated lookups of unknown IDs (every ``customers/create``)
+are cached too. The marker is only kept in the shared cache, which the
+save that creates the instance overwrites; the LRU of another process
+would go on reporting the new instance missing.
+
+Saving a tracked model (see :func:`track`) overwrites its entry in the
+shared cache and in the LRU of the saving process; deleting one drops
+the entry. A save or delete inside a transaction drops the entry, and
+drops it again once the transaction is over (see :func:`invalidate`),
+so that a lookup made by another process before the commit cannot keep
+the old state in the shared cache. The
+LRUs of other processes may serve the old state for up to
+``settings.OBJECT_CACHE_LOCAL_TTL`` seconds. Writes that bypass the
+model signals, such as ``QuerySet.update()``, must call
+:func:`invalidate` themselves, and the LRUs of other processes may still
+serve the instance from before such a write. Cached instances are
+therefore for reading: a write must start from the row in the
+database, locked, and save only the fields it changes.
+
+When an entry is missing, one process loads it from the database while
+the others wait for it, so a popular key expiring does not send every
+request to the database at once. Entries loaded inside a transaction
+are not stored, since the transaction may still be rolled back.
+
+Hits and misses are counted per model and tier in the ``cache.hit`` and
+``cache.miss`` metrics; :func:`hit_ratios` summarises them.
+'''
+import atexit
+import collections
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.core import signals as request_signals
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import signals
+
+from webhooks.libs import metrics
+
+
+#: Stored for IDs that are not in the database.
+MISSING = b''
+
+#: Seconds a process waits for another one to load an entry before
+#: loading it itself.
+LOCK_TIMEOUT = 1.0
+LOCK_POLL_INTERVAL = 0.01
+
+#: Per thread, the keys to drop once the current transaction is over.
+_deferred = threading.local()
+
+
+class LRU():
+    '''
+    A thread-safe least-recently-used mapping whose entries expire.
+
+    :param int size: The maximum number of entries.
+    :param float ttl: Seconds after which an entry expires.
+    '''
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_local = None
+
+
+def local():
+    '''
+    Return the LRU of this process.
+    '''
+    global _local
+    if _local is None:
+        _local = LRU(settings.OBJECT_CACHE_LOCAL_SIZE,
+                     settings.OBJECT_CACHE_LOCAL_TTL)
+    return _local
+
+
+def backend():
+    return caches[settings.OBJECT_CACHE_ALIAS]
+
+
+def make_key(model, shopify_id):
+    meta = model._meta
+    return 'logify:%s.%s:%s' % (meta.app_label, meta.model_name, shopify_id)
+
+
+def get(model, shopify_id):
+    '''
+    Return the instance of `model` with the given Shopify ID, like
+    ``model.objects.get(shopify_id=shopify_id)``.
+
+    :raises model.DoesNotExist: if there is none.
+    '''
+    drop_deferred()
+    name = model._meta.model_name
+    key = make_key(model, shopify_id)
+
+    value = local().get(key)
+    if value is not None:
+        metrics.incr('cache.hit', name, 'local')
+        return _load(model, value)
+
+    shared = backend()
+    value = shared.get(key)
+    if value is not None:
+        metrics.incr('cache.hit', name, 'shared')
+        if value != MISSING:
+            local().set(key, value)
+    else:
+        metrics.incr('cache.miss', name)
+        value = _fill(model, shopify_id, key, shared)
+    return _load(model, value)
+
+
+def _fill(model, shopify_id, key, shared):
+    '''
+    Load an entry from the database and store it, unless another
+    process is already doing so, in which case wait for its result.
+    '''
+    if connection.in_atomic_block:
+        return _fetch(model, shopify_id)
+
+    lock = key + ':lock'
+    if not shared.add(lock, 1, LOCK_TIMEOUT):
+        deadline = time.time() + LOCK_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = shared.get(key)
+            if value is not None:
+                return value
+        return _fetch(model, shopify_id)
+
+    try:
+        value = _fetch(model, shopify_id)
+        # add(), not set(): a concurrent write has the newer state.
+        shared.add(key, value, settings.OBJECT_CACHE_TIMEOUT)
+    finally:
+        shared.delete(lock)
+    if value != MISSING:
+        local().set(key, value)
+    return value
+
+
+def _fetch(model, shopify_id):
+    try:
+        instance = model.objects.get(shopify_id=shopify_id)
+    except model.DoesNotExist:
+        return MISSING
+    return pickle.dumps(instance, pickle.HIGHEST_PROTOCOL)
+
+
+def _load(model, value):
+    # Every caller gets its own copy to modify and save.
+    if value == MISSING:
+        raise model.DoesNotExist('%s matching query does not exist.' %
+                                 model._meta.object_name)
+    return pickle.loads(value)
+
+
+def put(instance):
+    '''
+    Store the current state of a saved instance.
+    '''
+    if connection.in_atomic_block:
+        invalidate(type(instance), instance.shopify_id)
+        return
+    drop_deferred()
+    key = make_key(type(instance), instance.shopify_id)
+    value = pickle.dumps(instance, pickle.HIGHEST_PROTOCOL)
+    backend().set(key, value, settings.OBJECT_CACHE_TIMEOUT)
+    local().set(key, value)
+
+
+def invalidate(model, shopify_id):
+    '''
+    Mark the entry for an instance as unknown, so that the next lookup
+    loads it from the database.
+
+    Inside a transaction, another process may load the entry again
+    before the commit, and store the state from before the transaction.
+    The entry is therefore dropped again once the transaction is over.
+    Django 1.8 has no ``transaction.on_commit()``, so that is done by
+    :func:`drop_deferred`: at the next lookup or store made outside a
+    transaction, when the request finishes, or at exit, whichever comes
+    first. It does no harm if the transaction was rolled back.
+    '''
+    key = make_key(model, shopify_id)
+    _drop(key)
+    if connection.in_atomic_block:
+        keys = getattr(_deferred, 'keys', None)
+        if keys is None:
+            keys = _deferred.keys = set()
+        keys.add(key)
+
+
+def drop_deferred(**kwargs):
+    '''
+    Drop the entries invalidated inside transactions of this thread that
+    are over.
+    '''
+    keys = getattr(_deferred, 'keys', None)
+    if not keys or connection.in_atomic_block:
+        return
+    _deferred.keys = None
+    for key in keys:
+        _drop(key)
+
+
+def _drop(key):
+    backend().delete(key)
+    local().delete(key)
+
+
+def clear():
+    '''
+    Empty the LRU of this process and the shared cache.
+    '''
+    local().clear()
+    backend().clear()
+
+
+def hit_ratios():
+    '''
+    Return the share of lookups answered by each tier, by model.
+    '''
+    counters = metrics.snapshot()
+    hits = counters.get('cache.hit', {})
+    misses = counters.get('cache.miss', {})
+    ratios = {}
+    for name in set(hits) | set(misses):
+        tiers = hits.get(name, {})
+        total = sum(tiers.values()) + misses.get(name, 0)
+        ratios[name] = dict((tier, count / total)
+                            for tier, count in tiers.items())
+    return ratios
+
+
+def _saved(sender, instance, **kwargs):
+    put(instance)
+
+
+def _deleted(sender, instance, **kwargs):
+    # Sent inside the deleting transaction, so only drop the entry.
+    invalidate(sender, instance.shopify_id)
+
+
+request_signals.request_finished.connect(drop_deferred)
+atexit.register(drop_deferred)
+
+
+def track(model):
+    '''
+    Keep the cache entries of `model` up to date when its instances are
+    saved or deleted.
+    '''
+    signals.post_save.connect(_saved, sender=model, weak=False)
+    signals.post_delete.connect(_deleted, sender=model, weak=False)
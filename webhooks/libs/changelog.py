@@ -0,0 +1,181 @@
+'''
+An ordered changelog of the writes made by the webhook views, so that
+downstream services can follow the customers and shops without
+scanning the tables for recent timestamps.
+
+Every create, update or delete made by a customer or shop view appends
+a :class:`ChangeRecord` holding the entity, its Shopify ID, the
+operation and the fields that changed with their new values. Records
+are numbered by their ID, the offset, which only grows. Consumers keep
+the offset of the last record they processed and resume after it,
+either over HTTP (``/webhooks/changes?after=<offset>``, which waits for
+new records) or with ``manage.py tail_changelog``.
+
+Offsets are allocated when a record is inserted, not when it commits,
+so a record may become visible after one with a higher offset. Records
+are therefore only served once they are ``settings.CHANGELOG_SETTLE``
+seconds old.
+
+``manage.py compact_changelog`` folds the older records of each entity
+into its latest one, so a consumer starting from offset 0 reads one
+record per entity for the compacted part of the log.
+'''
+import datetime
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from webhooks.libs import metrics
+from webhooks.models import ChangeRecord
+
+
+#: Fields left out of the records.
+SKIPPED_FIELDS = ('id', 'email_hash')
+
+
+def snapshot(instance):
+    '''
+    Return the field values of `instance` by attribute name, to compare
+    with after a write; see :func:`updated`.
+    '''
+    return dict((field.attname, getattr(instance, field.attname))
+                for field in instance._meta.concrete_fields
+                if field.name not in SKIPPED_FIELDS)
+
+
+def encode(data):
+    return json.dumps(data, sort_keys=True, separators=(',', ':'),
+                      cls=DjangoJSONEncoder)
+
+
+def append(entity, key, op, data):
+    metrics.incr('changelog.appended', entity, op)
+    return ChangeRecord.objects.create(entity=entity, key=key, op=op,
+                                       data=encode(data))
+
+
+def created(instance, **extra):
+    '''
+    Record the creation of `instance` with all its fields, and the
+    values in `extra`, such as tags.
+    '''
+    data = snapshot(instance)
+    data.update(extra)
+    return append(instance._meta.model_name, instance.shopify_id,
+                  ChangeRecord.CREATE, data)
+
+
+def updated(instance, before, **extra):
+    '''
+    Record the fields of `instance` that differ from the
+    :func:`snapshot` `before`, and the values in `extra`. Nothing is
+    recorded if nothing changed.
+    '''
+    # Values are compared, not their encodings: a timestamp read back
+    # from the database is the same instant in another time zone.
+    data = dict((name, value) for name, value in snapshot(instance).items()
+                if before.get(name) != value)
+    data.update(extra)
+    if not data:
+        return None
+    return append(instance._meta.model_name, instance.shopify_id,
+                  ChangeRecord.UPDATE, data)
+
+
+def deleted(model, key):
+    return append(model._meta.model_name, key, ChangeRecord.DELETE, {})
+
+
+def as_dict(record):
+    return {
+        'offset': record.id,
+        'at': record.created_at.isoformat(),
+        'entity': record.entity,
+        'key': record.key,
+        'op': record.op,
+        'data': json.loads(record.data),
+    }
+
+
+def read(after, limit=None, timeout=0):
+    '''
+    Return the records after the offset `after`, waiting up to `timeout`
+    seconds for one to appear.
+
+    :returns: a list of up to `limit` (by default
+      ``settings.CHANGELOG_PAGE_SIZE``) :class:`ChangeRecord` instances
+      in order of offset.
+    '''
+    limit = limit or settings.CHANGELOG_PAGE_SIZE
+    deadline = time.time() + timeout
+    while True:
+        settled = timezone.now() - datetime.timedelta(
+            seconds=settings.CHANGELOG_SETTLE)
+        records = list(ChangeRecord.objects
+                       .filter(id__gt=after, created_at__lte=settled)
+                       .order_by('id')[:limit])
+        if records or time.time() >= deadline:
+            return records
+        time.sleep(min(settings.CHANGELOG_POLL_INTERVAL,
+                       max(deadline - time.time(), 0)))
+
+
+def merge(records):
+    '''
+    Fold the records of one entity, in order of offset, into the data
+    and operation of a single record with the same effect.
+    '''
+    data = {}
+    for record in records:
+        if record.op == ChangeRecord.DELETE:
+            data = {}
+        else:
+            data.update(json.loads(record.data))
+    last = records[-1].op
+    if last != ChangeRecord.DELETE and any(
+            record.op == ChangeRecord.CREATE for record in records):
+        last = ChangeRecord.CREATE
+    return data, last
+
+
+def compact(upto, batch_size=1000):
+    '''
+    Compact the records up to the offset `upto`: the records of each
+    entity are replaced by its latest record, holding the merged data.
+
+    :returns: the number of records removed.
+    '''
+    removed = 0
+    keys = (ChangeRecord.objects.filter(id__lte=upto)
+            .values_list('entity', 'key').annotate(count=Count('id'))
+            .filter(count__gt=1).order_by())
+    keys = list(keys)
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        with transaction.atomic():
+            for entity, key, count in batch:
+                records = list(ChangeRecord.objects
+                               .filter(entity=entity, key=key, id__lte=upto)
+                               .order_by('id'))
+                data, op = merge(records)
+                latest = records[-1]
+                latest.op = op
+                latest.data = encode(data)
+                latest.save(update_fields=['op', 'data'])
+                ChangeRecord.objects.filter(
+                    id__in=[record.id for record in records[:-1]]).delete()
+                removed += len(records) - 1
+    return removed
+
+
+def offset_before(moment):
+    '''
+    Return the offset of the last record created before `moment`, or 0.
+    '''
+    return (ChangeRecord.objects.filter(created_at__lt=moment)
+            .aggregate(offset=Max('id'))['offset'] or 0)
@@ -0,0 +1,225 @@
+'''
+A small asyncio HTTP server that accepts Shopify webhooks into a spool.
+
+The server runs the same header and HMAC checks as
+:class:`webhooks.libs.validate.ValidateShopifyWebhookRequest`, appends
+each valid request to a :class:`webhooks.libs.spool.SpoolWriter` and
+acknowledges it once it is on disk. It never touches the database; the
+spooled requests are processed later by ``manage.py consume_spool``.
+
+Appends made during one pass of the event loop share a single fsync.
+When the spool is full, requests are refused with 503 so that Shopify
+retries them later.
+'''
+import asyncio
+import io
+import sys
+
+from django.core import urlresolvers
+import django.http
+
+from webhooks.libs import spool, validate
+
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+    503: 'Service Unavailable',
+}
+
+
+class IngressServer():
+    '''
+    Requests larger than :func:`webhooks.libs.validate.max_body_size`
+    allows for their topic are refused with 413 without reading their
+    body.
+
+    :param writer: The :class:`webhooks.libs.spool.SpoolWriter` that
+      receives accepted requests.
+    '''
+    def __init__(self, writer):
+        self.spool = writer
+        self.accepted = 0
+        self.rejected = 0
+        self.shed = 0
+        self._sync_waiter = None
+
+    async def process(self, method, path, meta, body):
+        '''
+        Validate and spool one request.
+
+        :param str method: The HTTP method.
+        :param str path: The request path, without the query string.
+        :param dict meta: The request headers in WSGI environ form.
+        :param bytes body: The request body.
+        :returns: a (status, content) tuple.
+        '''
+        try:
+            urlresolvers.resolve(path)
+        except urlresolvers.Resolver404:
+            self.rejected += 1
+            return 404, b''
+
+        response = validate.check_shopify_webhook_request(method, meta)
+        if response is None and not validate.verify_hmac(
+                body, meta['HTTP_X_SHOPIFY_HMAC_SHA256']):
+            response = django.http.HttpResponseForbidden('Invalid HMAC')
+        if response is not None:
+            self.rejected += 1
+            return response.status_code, response.content
+
+        headers = dict((key, value) for key, value in meta.items()
+                       if key.startswith('HTTP_X_') or key == 'CONTENT_TYPE')
+        try:
+            self.spool.append({'path': path, 'meta': headers}, body)
+        except spool.SpoolFullError:
+            self.shed += 1
+            return 503, b'spool full'
+
+        await self.synced()
+        self.accepted += 1
+        return 200, b''
+
+    async def synced(self):
+        '''
+        Wait until everything appended so far has been synced to disk.
+        The first caller in a pass of the event loop schedules the
+        fsync; the rest wait for the same one.
+        '''
+        if self._sync_waiter is None:
+            loop = asyncio.get_event_loop()
+            self._sync_waiter = loop.create_future()
+            loop.call_soon(self._sync)
+        await asyncio.shield(self._sync_waiter)
+
+    def _sync(self):
+        waiter, self._sync_waiter = self._sync_waiter, None
+        try:
+            self.spool.sync()
+        except Exception as e:
+            waiter.set_exception(e)
+        else:
+            waiter.set_result(None)
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve the HTTP/1.1 requests of one connection, keeping the
+        connection alive between requests unless asked not to.
+        '''
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    self._respond(writer, 431, b'', False)
+                    return
+
+                lines = head[:-4].decode('latin1').split('\r\n')
+                try:
+                    method, target, version = lines[0].split(' ', 2)
+                except ValueError:
+                    self._respond(writer, 400, b'', False)
+                    return
+                meta = parse_headers(lines[1:])
+
+                try:
+                    length = int(meta.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self._respond(writer, 400, b'bad Content-Length', False)
+                    return
+                topic = meta.get('HTTP_X_SHOPIFY_TOPIC')
+                if length > validate.max_body_size(topic):
+                    self.rejected += 1
+                    self._respond(writer, 413, b'', False)
+                    return
+
+                try:
+                    body = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                path = target.split('?', 1)[0]
+                status, content = await self.process(method, path, meta, body)
+
+                keep_alive = (version == 'HTTP/1.1' and
+                              meta.get('HTTP_CONNECTION', '').lower() != 'close')
+                self._respond(writer, status, content, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    def _respond(self, writer, status, content, keep_alive):
+        head = ['HTTP/1.1 %d %s' % (status, STATUS_REASONS.get(status, '')),
+                'Content-Length: %d' % len(content)]
+        if status == 503:
+            head.append('Retry-After: 1')
+        if not keep_alive:
+            head.append('Connection: close')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin1') + content)
+
+    async def sync_periodically(self, interval):
+        '''
+        Sync the spool every `interval` seconds so that the active
+        segment is sealed and handed to consumers even when traffic
+        stops.
+        '''
+        while True:
+            await asyncio.sleep(interval)
+            self.spool.sync()
+
+
+def parse_headers(lines):
+    '''
+    Convert HTTP header lines into a dict keyed like a WSGI environ.
+    '''
+    meta = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        name = name.strip().upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        meta[name] = value.strip()
+    return meta
+
+
+def build_environ(metadata, body):
+    '''
+    Build a WSGI environ that replays a spooled request through Django.
+    The request is marked as validated and admitted, so that its HMAC
+    is not checked again and it is not shed.
+
+    :param dict metadata: The metadata stored with the record.
+    :param bytes body: The request body.
+    '''
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': metadata['path'],
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        validate.PREVALIDATED_ENVIRON_KEY: True,
+        validate.ADMITTED_ENVIRON_KEY: True,
+    }
+    environ.update(metadata['meta'])
+    return environ
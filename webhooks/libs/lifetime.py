@@ -0,0 +1,373 @@
+'''
+Lifetime values of the customers, kept up to date from the order and
+refund webhooks.
+
+Each :class:`webhooks.models.CustomerLifetimeValue` holds the totals of
+the counted orders of a customer, those paid and not cancelled, and of
+their refunds. The webhooks adjust them with additive ``UPDATE``
+statements (``orders_count = orders_count + 1``), so reading the value
+of a customer is a single row, and concurrent webhooks for the same
+customer never overwrite each other's changes:
+
+- ``orders/paid`` counts the order, with any refunds recorded before
+  it;
+- ``orders/cancelled`` takes a counted order and its refunds back out;
+- ``refunds/create`` records the refund and its line items, adds it to
+  the refunded total of its order and, if the order is counted, to the
+  refunds of the customer.
+
+The webhooks for an order lock its :class:`webhooks.models.Order` row,
+created on first sight, so that they apply one at a time whatever order
+they arrive in, and redeliveries are recognised: an order is only
+counted once, and a refund is recorded once by its ID.
+
+``manage.py reconcile_lifetime_values`` recomputes the totals of the
+orders and customers from the refunds and orders, reports those that
+differ and, with ``--fix``, corrects them.
+'''
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import (Case, Count, DateTimeField, F, Max, Min, Q,
+                              Sum, Value, When)
+from django.utils import timezone
+
+from webhooks.libs import mapping
+from webhooks.models import (CustomerLifetimeValue, Order, Refund,
+                             RefundLineItem)
+
+
+#: The compared fields of a lifetime value.
+FIELDS = ('orders_count', 'gross', 'refunds', 'net', 'first_order_at',
+          'last_order_at')
+
+ZERO = Decimal('0.00')
+
+
+def _decimal(value):
+    if value is None:
+        return ZERO
+    return Decimal(str(value)).quantize(ZERO)
+
+
+def _datetime(value):
+    return mapping.parse_datetime(value) if value else None
+
+
+def customer_id(data):
+    '''
+    Return the Shopify ID of the customer of the order payload `data`,
+    or ``None`` for guest checkouts.
+    '''
+    customer = data.get('customer') or {}
+    return customer.get('id')
+
+
+def refund_amount(data):
+    '''
+    Return the amount of the refund payload `data`: the sum of its
+    successful refund transactions.
+    '''
+    return sum((_decimal(item.get('amount'))
+                for item in data.get('transactions') or []
+                if item.get('kind') == 'refund' and
+                item.get('status', 'success') == 'success'), ZERO)
+
+
+def locked_order(shopify_id):
+    '''
+    Return the :class:`webhooks.models.Order` with `shopify_id`, created
+    if needed and locked until the end of the transaction.
+    '''
+    Order.objects.get_or_create(shopify_id=shopify_id)
+    return Order.objects.select_for_update().get(shopify_id=shopify_id)
+
+
+def adjust(customer_shopify_id, orders=0, gross=ZERO, refunds=ZERO,
+           order_at=None):
+    '''
+    Add the given amounts to the lifetime value of a customer with one
+    ``UPDATE``, creating it if needed. A positive `orders` with
+    `order_at` also moves the first and last order dates to include
+    `order_at`.
+    '''
+    CustomerLifetimeValue.objects.get_or_create(
+        customer_shopify_id=customer_shopify_id)
+    updates = {
+        'orders_count': F('orders_count') + orders,
+        'gross': F('gross') + gross,
+        'refunds': F('refunds') + refunds,
+        'net': F('net') + (gross - refunds),
+        'updated_at': timezone.now(),
+    }
+    if orders > 0 and order_at is not None:
+        updates['first_order_at'] = Case(
+            When(Q(first_order_at__isnull=True) |
+                 Q(first_order_at__gt=order_at), then=Value(order_at)),
+            default=F('first_order_at'), output_field=DateTimeField())
+        updates['last_order_at'] = Case(
+            When(Q(last_order_at__isnull=True) |
+                 Q(last_order_at__lt=order_at), then=Value(order_at)),
+            default=F('last_order_at'), output_field=DateTimeField())
+    CustomerLifetimeValue.objects.filter(
+        customer_shopify_id=customer_shopify_id).update(**updates)
+
+
+def paid(data):
+    '''
+    Record the payment of the order payload `data` and count the order
+    for its customer, unless it is counted already or cancelled.
+
+    :returns: whether the order was counted.
+    '''
+    with transaction.atomic():
+        order = locked_order(data['id'])
+        if order.paid_at is not None:  # Redelivered
+            return False
+        order.customer_shopify_id = customer_id(data)
+        order.total_price = _decimal(data.get('total_price'))
+        order.currency = data.get('currency') or ''
+        order.processed_at = _datetime(data.get('processed_at') or
+                                       data.get('created_at'))
+        order.paid_at = timezone.now()
+        order.save()
+
+        if (order.cancelled_at is not None or
+                order.customer_shopify_id is None):
+            return False
+        adjust(order.customer_shopify_id, 1, order.total_price,
+               order.total_refunded, order.processed_at)
+        return True
+
+
+def cancelled(data):
+    '''
+    Record the cancellation of the order payload `data` and, if it was
+    counted, take it and its refunds out of the lifetime value of its
+    customer.
+
+    :returns: whether a counted order was taken out.
+    '''
+    with transaction.atomic():
+        order = locked_order(data['id'])
+        if order.cancelled_at is not None:  # Redelivered
+            return False
+        counted = (order.paid_at is not None and
+                   order.customer_shopify_id is not None)
+        order.cancelled_at = (_datetime(data.get('cancelled_at')) or
+                              timezone.now())
+        order.save(update_fields=['cancelled_at'])
+        if not counted:
+            return False
+
+        adjust(order.customer_shopify_id, -1, -order.total_price,
+               -order.total_refunded)
+        # The dates cannot be taken back additively; recompute them from
+        # the orders still counted, with the value locked.
+        value = CustomerLifetimeValue.objects.select_for_update().get(
+            customer_shopify_id=order.customer_shopify_id)
+        dates = (counted_orders()
+                 .filter(customer_shopify_id=order.customer_shopify_id)
+                 .aggregate(first=Min('processed_at'),
+                            last=Max('processed_at')))
+        value.first_order_at = dates['first']
+        value.last_order_at = dates['last']
+        value.save(update_fields=['first_order_at', 'last_order_at'])
+        return True
+
+
+def refund_created(data):
+    '''
+    Record the refund payload `data` with its line items, and add its
+    amount to the refunded total of the order and, if the order is
+    counted, to the refunds of its customer, all in one transaction. A
+    refund received before its order is paid is counted with the order.
+
+    The totals are changed with additive updates, and the update of the
+    order locks it: concurrent refunds of the same order, and its paid
+    and cancelled webhooks, apply one after the other, each on the
+    totals left by the previous one.
+
+    :returns: whether the refund was recorded, rather than already
+      known.
+    '''
+    refund = Refund(amount=refund_amount(data))
+    line_items = Refund.copy_payload(refund, data).get(
+        'refund_line_items', [])
+    refund.created_at = _datetime(data.get('processed_at') or
+                                  data.get('created_at'))
+
+    with transaction.atomic():
+        Order.objects.get_or_create(shopify_id=refund.order_shopify_id)
+        try:
+            # A concurrent delivery of the same refund waits here for
+            # this one to commit, then fails.
+            with transaction.atomic():
+                refund.save()
+        except IntegrityError:  # Redelivered
+            return False
+        for line_item in line_items:
+            line_item.refund = refund
+        RefundLineItem.objects.bulk_create(line_items)
+
+        Order.objects.filter(shopify_id=refund.order_shopify_id).update(
+            total_refunded=F('total_refunded') + refund.amount)
+        order = Order.objects.get(shopify_id=refund.order_shopify_id)
+        if (order.paid_at is not None and order.cancelled_at is None and
+                order.customer_shopify_id is not None):
+            adjust(order.customer_shopify_id, refunds=refund.amount)
+        return True
+
+
+def refund_totals(batch_size=1000):
+    '''
+    Compare the refunded totals of the orders with the sums of their
+    refunds, in batches of `batch_size` orders.
+
+    :returns: an iterator of (order ID, actual, expected) tuples for the
+      orders that differ.
+    '''
+    after = 0
+    while True:
+        orders = list(Order.objects.filter(id__gt=after).order_by('id')
+                      .values_list('id', 'shopify_id',
+                                   'total_refunded')[:batch_size])
+        if not orders:
+            return
+        after = orders[-1][0]
+        sums = dict(
+            Refund.objects.filter(order_shopify_id__in=[
+                shopify_id for _, shopify_id, _ in orders])
+            .values_list('order_shopify_id').order_by()
+            .annotate(amount=Sum('amount')))
+        for _, shopify_id, total in orders:
+            amount = _decimal(sums.get(shopify_id))
+            if _decimal(total) != amount:
+                yield shopify_id, _decimal(total), amount
+
+
+def fix_refund_total(order_shopify_id):
+    '''
+    Overwrite the refunded total of an order with the sum of its
+    refunds, with the order locked. A refund being recorded meanwhile
+    is not in the sum yet and adds itself once the lock is released.
+    '''
+    with transaction.atomic():
+        order = locked_order(order_shopify_id)
+        order.total_refunded = _decimal(
+            Refund.objects.filter(order_shopify_id=order_shopify_id)
+            .aggregate(total=Sum('amount'))['total'])
+        order.save(update_fields=['total_refunded'])
+        return order
+
+
+def counted_orders():
+    return Order.objects.filter(paid_at__isnull=False,
+                                cancelled_at__isnull=True,
+                                customer_shopify_id__isnull=False)
+
+
+def expected(first, last):
+    '''
+    Recompute from the orders and refunds the lifetime values of the
+    customers with Shopify IDs from `first` to `last`.
+
+    :returns: a dict of dicts of :data:`FIELDS` values by customer ID.
+    '''
+    orders = counted_orders().filter(customer_shopify_id__gte=first,
+                                     customer_shopify_id__lte=last)
+    values = {}
+    for row in (orders.values('customer_shopify_id').order_by()
+                .annotate(orders_count=Count('id'), gross=Sum('total_price'),
+                          first_order_at=Min('processed_at'),
+                          last_order_at=Max('processed_at'))):
+        customer = row.pop('customer_shopify_id')
+        row['refunds'] = ZERO
+        values[customer] = row
+
+    customers = dict(orders.values_list('shopify_id', 'customer_shopify_id'))
+    for order_shopify_id, amount in (
+            Refund.objects.filter(order_shopify_id__in=orders.values(
+                'shopify_id'))
+            .values_list('order_shopify_id').order_by()
+            .annotate(amount=Sum('amount'))):
+        values[customers[order_shopify_id]]['refunds'] += _decimal(amount)
+
+    for row in values.values():
+        row['gross'] = _decimal(row['gross'])
+        row['refunds'] = _decimal(row['refunds'])
+        row['net'] = row['gross'] - row['refunds']
+    return values
+
+
+def differences(value, expected_value):
+    '''
+    Return the (field, expected, actual) tuples of the fields of the
+    lifetime value `value` that differ from `expected_value`.
+    '''
+    return [(name, expected_value[name], getattr(value, name))
+            for name in FIELDS if getattr(value, name) != expected_value[name]]
+
+
+def empty():
+    '''
+    Return the lifetime value of a customer without counted orders.
+    '''
+    return {'orders_count': 0, 'gross': ZERO, 'refunds': ZERO, 'net': ZERO,
+            'first_order_at': None, 'last_order_at': None}
+
+
+def fix(customer_shopify_id):
+    '''
+    Overwrite the lifetime value of a customer with the one recomputed
+    from the orders and refunds. The value is locked while it is
+    recomputed, so webhooks applied meanwhile are not lost.
+    '''
+    with transaction.atomic():
+        CustomerLifetimeValue.objects.get_or_create(
+            customer_shopify_id=customer_shopify_id)
+        value = CustomerLifetimeValue.objects.select_for_update().get(
+            customer_shopify_id=customer_shopify_id)
+        values = expected(customer_shopify_id, customer_shopify_id).get(
+            customer_shopify_id, empty())
+        for name in FIELDS:
+            setattr(value, name, values[name])
+        value.save()
+        return value
+
+
+def reconcile(batch_size=1000):
+    '''
+    Compare the lifetime values with those recomputed from the orders
+    and refunds, in batches of about `batch_size` customers.
+
+    :returns: an iterator of (customer ID, differences) tuples, with the
+      differences as returned by :func:`differences`.
+    '''
+    after = None
+    while True:
+        values = CustomerLifetimeValue.objects.order_by('customer_shopify_id')
+        orders = (counted_orders().order_by('customer_shopify_id')
+                  .values_list('customer_shopify_id', flat=True).distinct())
+        if after is not None:
+            values = values.filter(customer_shopify_id__gt=after)
+            orders = orders.filter(customer_shopify_id__gt=after)
+        ids = sorted(
+            set(values.values_list('customer_shopify_id',
+                                   flat=True)[:batch_size]) |
+            set(orders[:batch_size]))[:batch_size]
+        if not ids:
+            return
+        first, last = ids[0], ids[-1]
+
+        actual = dict((value.customer_shopify_id, value) for value in
+                      values.filter(customer_shopify_id__lte=last))
+        recomputed = expected(first, last)
+        for customer in sorted(set(actual) | set(recomputed)):
+            value = actual.get(customer, CustomerLifetimeValue(
+                customer_shopify_id=customer, first_order_at=None,
+                last_order_at=None))
+            found = differences(value, recomputed.get(customer, empty()))
+            if found:
+                yield customer, found
+        after = last
@@ -0,0 +1,341 @@
+'''
+Generate signed Shopify webhooks and post them to a running server.
+
+Used by ``manage.py loadtest``. Each worker process runs a number of
+connections, each a thread posting over its own keep-alive HTTP
+connection on a schedule:
+
+* with a rate and ``open_loop``, requests are due at exponentially
+  distributed intervals (Poisson arrivals), independent of how fast the
+  server answers. Latency is measured from when a request was due, so
+  time spent waiting behind a slow server is counted rather than
+  hidden;
+* with a rate only, requests are paced at fixed intervals and latency is
+  measured from when a request was sent;
+* without a rate, each connection posts as fast as the server answers.
+'''
+import collections
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+from webhooks.libs import validate
+
+
+def customer(rng, shopify_id):
+    return {
+        'id': shopify_id,
+        'email': 'customer%d@example.com' % shopify_id,
+        'accepts_marketing': rng.random() < 0.5,
+        'created_at': '2015-05-27T19:12:18+01:00',
+        'updated_at': '2015-05-27T19:12:19+01:00',
+        'first_name': 'First%d' % shopify_id,
+        'last_name': 'Last%d' % shopify_id,
+        'orders_count': rng.randint(0, 20),
+        'state': 'enabled',
+        'total_spent': '%d.%02d' % (rng.randint(0, 999), rng.randint(0, 99)),
+        'last_order_id': None,
+        'note': None,
+        'verified_email': True,
+        'multipass_identifier': None,
+        'tax_exempt': False,
+        'tags': 'loadtest',
+        'last_order_name': None,
+        'addresses': [],
+    }
+
+
+def deleted(rng, shopify_id):
+    return {'id': shopify_id}
+
+
+def shop(rng, shopify_id):
+    return {
+        'id': shopify_id,
+        'name': 'Shop %d' % shopify_id,
+        'email': 'shop%d@example.com' % shopify_id,
+        'domain': 'shop%d.example.com' % shopify_id,
+        'created_at': '2015-05-27T19:12:18+01:00',
+    }
+
+
+def product(rng, shopify_id):
+    variants = [{'id': shopify_id * 100 + index,
+                 'title': 'Variant %d' % index,
+                 'price': '%d.00' % rng.randint(1, 100),
+                 'sku': 'SKU-%d-%d' % (shopify_id, index),
+                 'position': index + 1}
+                for index in range(rng.randint(1, 10))]
+    return {
+        'id': shopify_id,
+        'title': 'Product %d' % shopify_id,
+        'handle': 'product-%d' % shopify_id,
+        'body_html': '<p>Product</p>',
+        'vendor': 'Load test',
+        'product_type': 'Test',
+        'created_at': '2015-05-27T19:12:18+01:00',
+        'updated_at': '2015-05-27T19:12:19+01:00',
+        'tags': '',
+        'variants': variants,
+        'images': [],
+    }
+
+
+def cart(rng, shopify_id):
+    token = '%032x' % shopify_id
+    return {
+        'id': token,
+        'token': token,
+        'note': None,
+        'created_at': '2015-05-27T19:12:18+01:00',
+        'updated_at': '2015-05-27T19:12:19+01:00',
+        'line_items': [{'id': rng.randint(1, 10 ** 6),
+                        'quantity': rng.randint(1, 5)}],
+    }
+
+
+def checkout(rng, shopify_id):
+    return {
+        'id': shopify_id,
+        'token': '%032x' % shopify_id,
+        'cart_token': '%032x' % shopify_id,
+        'email': 'customer%d@example.com' % shopify_id,
+        'created_at': '2015-05-27T19:12:18+01:00',
+        'updated_at': '2015-05-27T19:12:19+01:00',
+        'completed_at': None,
+        'currency': 'USD',
+        'subtotal_price': '10.00',
+        'total_price': '12.50',
+        'line_items': [],
+    }
+
+
+def order(rng, shopify_id):
+    return {'id': shopify_id, 'checkout_id': shopify_id}
+
+
+#: The topics that can be generated: the route under
+#: ``/webhooks/shopify/<siteid>/`` and the payload builder, which takes
+#: a `random.Random` and the Shopify ID to use.
+TOPICS = {
+    'customers/create': ('customer_create', customer),
+    'customers/update': ('customer_update', customer),
+    'customers/enable': ('customer_enable', customer),
+    'customers/disable': ('customer_disable', customer),
+    'customers/delete': ('customer_delete', deleted),
+    'shop/update': ('shop_update', shop),
+    'products/create': ('product_create', product),
+    'products/update': ('product_update', product),
+    'products/delete': ('product_delete', deleted),
+    'carts/create': ('cart_create', cart),
+    'carts/update': ('cart_update', cart),
+    'checkouts/create': ('checkout_create', checkout),
+    'checkouts/update': ('checkout_update', checkout),
+    'checkouts/delete': ('checkout_delete', deleted),
+    'orders/create': ('order_create', order),
+}
+
+DEFAULT_MIX = ('customers/create=2,customers/update=4,carts/update=6,'
+               'checkouts/update=3,products/update=1,orders/create=1')
+
+
+def parse_mix(value):
+    '''
+    Parse a topic mix such as ``"customers/update=3,carts/update=1"``.
+
+    :returns: a list of (topic, weight) tuples.
+    :raises ValueError: for unknown topics or invalid weights.
+    '''
+    mix = []
+    for item in value.split(','):
+        topic, _, weight = item.strip().partition('=')
+        if topic not in TOPICS:
+            raise ValueError('Unknown topic %r' % topic)
+        weight = float(weight or 1)
+        if weight < 0:
+            raise ValueError('Negative weight for %r' % topic)
+        mix.append((topic, weight))
+    if not sum(weight for topic, weight in mix):
+        raise ValueError('The mix is empty')
+    return mix
+
+
+def build_request(rng, mix, siteid, keyspace, shared_secret=None):
+    '''
+    Build one signed request.
+
+    :param mix: A list of (topic, weight) tuples to pick the topic from.
+    :param int keyspace: Shopify IDs are drawn from 1 to `keyspace`, so
+      that updates hit rows created earlier.
+    :returns: a (topic, path, headers, body) tuple.
+    '''
+    topics, weights = zip(*mix)
+    topic = rng.choices(topics, weights)[0]
+    route, builder = TOPICS[topic]
+    body = json.dumps(builder(rng, rng.randint(1, keyspace))).encode('utf8')
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Request-Id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'X-Shopify-Topic': topic,
+        'X-Shopify-Shop-Domain': '%s.myshopify.com' % siteid,
+        'X-Shopify-Hmac-Sha256': validate.compute_hmac(body, shared_secret),
+    }
+    return topic, '/webhooks/shopify/%s/%s' % (siteid, route), headers, body
+
+
+def run_connection(url, siteid, mix, rate, open_loop, duration, keyspace,
+                   seed, shared_secret=None):
+    '''
+    Post requests over one keep-alive connection for `duration` seconds.
+
+    :param str url: The base URL of the server.
+    :param float rate: Requests per second, or 0 to post as fast as the
+      server answers.
+    :returns: a dict with the latencies in seconds, a Counter of the
+      status codes (connection failures count as status 0), a Counter
+      of (topic, status) pairs for unsuccessful requests, and the
+      seconds elapsed until the last response. With a rate, every
+      request due within `duration` is sent, so a server that cannot
+      keep up makes the run take longer.
+    '''
+    rng = random.Random(seed)
+    parts = urllib.parse.urlsplit(url)
+    connection_class = (http.client.HTTPSConnection
+                        if parts.scheme == 'https' else http.client.HTTPConnection)
+    connection = connection_class(parts.netloc, timeout=30)
+
+    latencies = []
+    statuses = collections.Counter()
+    failures = collections.Counter()
+    start = time.perf_counter()
+    end = start + duration
+    due = start
+
+    while True:
+        if rate:
+            due += rng.expovariate(rate) if open_loop else 1 / rate
+            if due >= end:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elif time.perf_counter() >= end:
+            break
+
+        topic, path, headers, body = build_request(
+            rng, mix, siteid, keyspace, shared_secret)
+        sent = time.perf_counter()
+        try:
+            connection.request('POST', parts.path.rstrip('/') + path, body,
+                               headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            status = 0
+        finished = time.perf_counter()
+
+        latencies.append(finished - (due if rate and open_loop else sent))
+        statuses[status] += 1
+        if not 200 <= status < 300:
+            failures[(topic, status)] += 1
+
+    connection.close()
+    return {'latencies': latencies, 'statuses': statuses,
+            'failures': failures, 'elapsed': time.perf_counter() - start}
+
+
+def run_worker(options):
+    '''
+    Run ``options['connections']`` connections in threads and merge
+    their results. `options` holds the keyword arguments of
+    :func:`run_connection`, except for `seed`, plus `connections` and
+    `seed_base`. The rate is shared between the connections.
+    '''
+    options = dict(options)
+    connections = options.pop('connections')
+    seed_base = options.pop('seed_base')
+    options['rate'] = options['rate'] / connections
+    results = [None] * connections
+
+    def target(index):
+        results[index] = run_connection(seed=seed_base + index, **options)
+
+    threads = [threading.Thread(target=target, args=(index,))
+               for index in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return merge(results)
+
+
+def merge(results):
+    merged = {'latencies': [], 'statuses': collections.Counter(),
+              'failures': collections.Counter(), 'elapsed': 0}
+    for result in results:
+        merged['elapsed'] = max(merged['elapsed'], result['elapsed'])
+        merged['latencies'].extend(result['latencies'])
+        merged['statuses'].update(result['statuses'])
+        merged['failures'].update(result['failures'])
+    return merged
+
+
+def percentile(ordered, fraction):
+    '''
+    Return the value below which `fraction` of the sorted values
+    `ordered` fall (nearest rank), or `None` if there are none.
+    '''
+    if not ordered:
+        return None
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarise(result, duration, target_rate=0):
+    '''
+    Summarise the merged result of a run.
+
+    :returns: a dict with the target rate, the achieved throughput in
+      requests per second, the 50th, 95th and 99th percentile latencies
+      in seconds, the number of requests, the share that failed, the
+      status code counts, and the lag: how many seconds the run
+      overran `duration`.
+    '''
+    elapsed = max(result['elapsed'], duration)
+    ordered = sorted(result['latencies'])
+    total = len(ordered)
+    ok = sum(count for status, count in result['statuses'].items()
+             if 200 <= status < 300)
+    return {
+        'target': target_rate,
+        'throughput': total / elapsed,
+        'p50': percentile(ordered, 0.50),
+        'p95': percentile(ordered, 0.95),
+        'p99': percentile(ordered, 0.99),
+        'requests': total,
+        'error_rate': (total - ok) / total if total else 0.0,
+        'statuses': dict(result['statuses']),
+        'lag': elapsed - duration,
+        'duration': duration,
+    }
+
+
+def saturated(summary, max_p99, max_error_rate=0.01):
+    '''
+    Tell whether a step of a ramp shows the server saturated: it fell
+    behind the target rate, overrunning the step by more than 10%, its
+    99th percentile latency
+    exceeded `max_p99` seconds, or more than `max_error_rate` of the
+    requests failed.
+    '''
+    if summary['target'] and summary['lag'] > 0.1 * summary['duration']:
+        return True
+    if summary['p99'] is not None and summary['p99'] > max_p99:
+        return True
+    return summary['error_rate'] > max_error_rate
@@ -0,0 +1,140 @@
+'''
+Copy Shopify payloads onto model instances.
+
+:func:`compile_mapper` generates one specialised function per model
+from a list of payload keys. The field types are looked up once, when
+the function is built, so copying a payload is a straight sequence of
+key tests, conversions and attribute assignments with no per-request
+introspection.
+'''
+from decimal import Decimal
+
+from django.db import models
+from django.utils import dateparse
+import dateutil.parser
+
+from webhooks.libs import tracing
+
+
+def parse_datetime(value):
+    '''
+    Parse a timestamp from a payload. Shopify sends ISO 8601 timestamps,
+    which Django's parser handles several times faster than dateutil;
+    anything else falls back to dateutil.
+    '''
+    with tracing.span('timestamps'):
+        try:
+            parsed = dateparse.parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            parsed = dateutil.parser.parse(value)
+        return parsed
+
+
+#: Payload values accepted for boolean fields. Strings are mapped
+#: explicitly since ``bool('false')`` is true.
+BOOLEANS = {True: True, False: False, 'true': True, 'false': False}
+
+
+def parse_boolean(value):
+    '''
+    Convert a payload value to a boolean: a JSON boolean, or one of the
+    strings ``'true'`` and ``'false'``.
+
+    :raises ValueError: for any other value.
+    '''
+    try:
+        return BOOLEANS[value]
+    except (KeyError, TypeError):
+        raise ValueError('Not a boolean: %r' % (value,))
+
+
+#: Conversions applied to payload values, by model field class. Values
+#: for fields whose class is not listed here (such as text fields, which
+#: JSON already delivers as `str`) are copied unchanged.
+COERCIONS = (
+    (models.NullBooleanField, parse_boolean),
+    (models.BooleanField, parse_boolean),
+    (models.DecimalField, lambda value: Decimal(str(value))),
+    (models.DateTimeField, parse_datetime),
+    (models.IntegerField, int),
+    (models.FloatField, float),
+)
+
+
+def coercion_for(field):
+    for field_class, coerce in COERCIONS:
+        if isinstance(field, field_class):
+            return coerce
+    return None
+
+
+def compile_mapper(model, keys, renames=None, nested=None):
+    '''
+    Build a function ``copy(obj, data)`` that copies the values of
+    `keys` from the payload `data` onto the `model` instance `obj`.
+
+    Values are converted according to the type of the model field they
+    are copied to (see :data:`COERCIONS`). A ``None`` value is stored as
+    ``None`` if the field is nullable and is otherwise ignored, leaving
+    the current value in place. Keys missing from `data` are ignored.
+
+    :param model: The model class.
+    :param keys: An iterable of payload keys to copy.
+    :param dict renames: Maps payload keys to the names of the model
+      fields they are copied to; by default a key is copied to the field
+      of the same name.
+    :param dict nested: Maps payload keys holding an object or a list of
+      objects to a (model, mapper) pair. For each such object, a new
+      instance of the model is created and filled in by the mapper.
+    :returns: the copy function. It returns a dict mapping each nested
+      key found in `data` to the list of instances built for it.
+    '''
+    renames = renames or {}
+    nested = nested or {}
+    namespace = {}
+    lines = ['def copy(obj, data):', '    children = {}']
+
+    for index, key in enumerate(keys):
+        name = renames.get(key, key)
+        field = model._meta.get_field(name)
+        coerce = coercion_for(field)
+
+        lines.append('    if %r in data:' % key)
+        lines.append('        value = data[%r]' % key)
+        if coerce is None and field.null:
+            lines.append('        obj.%s = value' % field.attname)
+            continue
+
+        lines.append('        if value is not None:')
+        if coerce is None:
+            lines.append('            obj.%s = value' % field.attname)
+        else:
+            namespace['coerce_%d' % index] = coerce
+            lines.append('            obj.%s = coerce_%d(value)' %
+                         (field.attname, index))
+        if field.null:
+            lines.append('        else:')
+            lines.append('            obj.%s = None' % field.attname)
+
+    for index, (key, (child_model, child_mapper)) in enumerate(nested.items()):
+        namespace['child_model_%d' % index] = child_model
+        namespace['child_mapper_%d' % index] = child_mapper
+        lines.append('    value = data.get(%r)' % key)
+        lines.append('    if isinstance(value, dict):')
+        lines.append('        value = [value]')
+        lines.append('    if value:')
+        lines.append('        built = children[%r] = []' % key)
+        lines.append('        for item in value:')
+        lines.append('            child = child_model_%d()' % index)
+        lines.append('            child_mapper_%d(child, item)' % index)
+        lines.append('            built.append(child)')
+
+    lines.append('    return children')
+
+    exec('\n'.join(lines), namespace)
+    copy = namespace['copy']
+    copy.__name__ = 'copy_%s' % model._meta.model_name
+    copy.__doc__ = 'Copy a Shopify payload onto a %s.' % model.__name__
+    return copy
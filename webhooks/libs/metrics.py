@@ -0,0 +1,63 @@
+'''
+Process-local counters for the webhook pipeline.
+
+Counters are identified by a name and a tuple of labels, for example
+``incr('webhooks.rejected', 'customers/create', 'missing:id')``. They
+are kept per process and are exposed as JSON by
+:func:`webhooks.views.metrics`.
+'''
+import collections
+import threading
+
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+
+
+def incr(name, *labels, amount=1):
+    '''
+    Add `amount` to the counter `name` with the given `labels`.
+    '''
+    with _lock:
+        _counters[(name,) + labels] += amount
+
+
+def gauge(name, *labels, value):
+    '''
+    Set the counter `name` with the given `labels` to `value`, for
+    quantities that go down as well as up.
+    '''
+    with _lock:
+        _counters[(name,) + labels] = value
+
+
+def get(name, *labels):
+    '''
+    Return the value of a counter; unknown counters are 0.
+    '''
+    return _counters[(name,) + labels]
+
+
+def snapshot():
+    '''
+    Return the current counters as a nested dict: the name, then each
+    label in turn, leading to the counter value.
+    '''
+    with _lock:
+        items = list(_counters.items())
+
+    result = {}
+    for key, value in items:
+        node = result
+        for part in key[:-1]:
+            node = node.setdefault(part, {})
+        node[key[-1]] = value
+    return result
+
+
+def reset():
+    '''
+    Remove all counters.
+    '''
+    with _lock:
+        _counters.clear()
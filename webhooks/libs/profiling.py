@@ -0,0 +1,113 @@
+'''
+Opt-in profiling of the webhook requests.
+
+A fraction ``settings.PROFILE_SAMPLE_RATE`` of the webhook requests are
+run under :mod:`cProfile`, as is any request whose ``X-Logify-Profile``
+header matches ``settings.PROFILE_SECRET``. Only the view of a request
+whose HMAC is valid, and whose topic is one of
+:data:`webhooks.libs.schema.SCHEMAS`, is profiled, so requests cannot
+create directories or files at will. Each profile is written in
+:mod:`pstats` format to a directory per topic under
+``settings.PROFILE_DIR``; ``manage.py profile_report`` merges them and
+prints the top cumulative hotspots of each topic.
+'''
+import cProfile
+import hmac
+import itertools
+import os
+import random
+import re
+import time
+
+from django.conf import settings
+
+from webhooks.libs import metrics, schema
+
+
+#: META key of the header that requests a profile.
+HEADER = 'HTTP_X_LOGIFY_PROFILE'
+
+#: Suffix of the profile files.
+SUFFIX = '.prof'
+
+_sequence = itertools.count()
+
+
+def wanted(meta):
+    '''
+    Return whether the request described by `meta` should be profiled:
+    its topic is known, and either it carries the secret header or it is
+    sampled.
+    '''
+    if meta.get('HTTP_X_SHOPIFY_TOPIC') not in schema.SCHEMAS:
+        return False
+    secret = getattr(settings, 'PROFILE_SECRET', '')
+    token = meta.get(HEADER)
+    if secret and token and hmac.compare_digest(
+            token.encode('utf8'), secret.encode('utf8')):
+        return True
+    rate = settings.PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def topic_directory(topic):
+    '''
+    Return the directory holding the profiles of `topic`; the topic
+    comes from a request header, so only word characters are kept.
+    '''
+    return os.path.join(settings.PROFILE_DIR,
+                        re.sub(r'\W', '_', topic) or '_')
+
+
+def run(topic, func, *args, **kwargs):
+    '''
+    Call `func` with the given arguments under a profiler and save the
+    profile for `topic`, even if `func` raises.
+    '''
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        save(profiler, topic)
+
+
+def save(profiler, topic):
+    '''
+    Write the stats of `profiler` to a new file in the directory of
+    `topic`. The file is renamed into place once written, so a report
+    never reads half a profile. A failure to write is counted, not
+    raised: profiling must not fail the request.
+    '''
+    directory = topic_directory(topic)
+    name = '%d-%d-%d' % (time.time() * 1000, os.getpid(), next(_sequence))
+    path = os.path.join(directory, name + SUFFIX)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    except OSError:
+        metrics.incr('profiles.failed', topic)
+        return None
+    metrics.incr('profiles.written', topic)
+    return path
+
+
+def profiles(directory=None):
+    '''
+    Return the profile files under `directory` (by default
+    ``settings.PROFILE_DIR``) as a dict of sorted lists of paths by
+    topic directory name.
+    '''
+    directory = directory or settings.PROFILE_DIR
+    result = {}
+    if not os.path.isdir(directory):
+        return result
+    for topic in sorted(os.listdir(directory)):
+        path = os.path.join(directory, topic)
+        if not os.path.isdir(path):
+            continue
+        files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                       if name.endswith(SUFFIX))
+        if files:
+            result[topic] = files
+    return result
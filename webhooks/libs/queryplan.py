@@ -0,0 +1,58 @@
+'''
+Inspect the plans the database chooses for querysets.
+
+Used by the query plan tests to check that the read paths of the
+webhook models are served by indexes rather than by reading whole
+tables. Only SQLite and PostgreSQL are supported.
+'''
+import re
+
+from django.db import connections
+
+
+def explain(queryset):
+    '''
+    Return the plan of `queryset` as a list of lines.
+
+    :raises NotImplementedError: for databases other than SQLite and
+      PostgreSQL.
+    '''
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        elif connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    raise NotImplementedError('Cannot explain queries on %s' %
+                              connection.vendor)
+
+
+def full_scans(queryset):
+    '''
+    Return the names of the tables `queryset` reads sequentially, that is
+    without an index.
+    '''
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        # "SCAN t" ("SCAN TABLE t" before SQLite 3.36); a scan in index
+        # order reads "SCAN t USING INDEX i" and is not counted.
+        pattern = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+    else:
+        pattern = re.compile(r'Seq Scan on (\w+)')
+    tables = []
+    for line in explain(queryset):
+        match = pattern.search(line.strip().lstrip('->').strip())
+        if match:
+            tables.append(match.group(1))
+    return tables
+
+
+def analyze(using='default'):
+    '''
+    Update the statistics the query planner bases its choices on.
+    '''
+    with connections[using].cursor() as cursor:
+        cursor.execute('ANALYZE')
@@ -0,0 +1,171 @@
+'''
+Carry out the GDPR redactions queued as :class:`RedactionJob` rows.
+
+Shopify sends ``customers/redact`` for one customer and ``shop/redact``
+48 hours after a shop uninstalls the app, for all of its customers. The
+webhooks only queue a job; ``manage.py redact`` runs it in chunks of
+customers in order of ID. Each chunk is one short transaction that
+
+* removes the tag and address links and the addresses of the customers,
+* blanks their personal fields and tombstones them, so that
+  ``manage.py purge_customers`` removes them later,
+* blanks the email of their checkouts,
+* deletes their changelog records,
+* and moves the cursor of the job past them.
+
+Once no customers are left, further chunks delete the archived copies
+of the customers (see :mod:`webhooks.libs.archive`) and finally the
+slow events that may hold their data (see :func:`slow_events`) and the
+shop.
+
+The job row is locked for the duration of a chunk, so several runners
+can work on the queue, and a runner that is stopped resumes from the
+last committed chunk. A shop is matched by the site ID its webhooks are
+received under: customers last written before sites were recorded have
+an empty site ID and are only found by ``customers/redact``.
+'''
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from webhooks.libs import cache
+from webhooks.models import (ArchivedCustomer, ChangeRecord, Checkout,
+                             Customer, CustomerAddress, CustomerScore,
+                             RedactionJob, Shop, SlowEvent)
+
+
+#: The values personal fields of a redacted customer are set to.
+REDACTED_FIELDS = {
+    'email': '',
+    'email_hash': '',
+    'verified_email': False,
+    'first_name': '',
+    'last_name': '',
+    'note': '',
+    'multipass_identifier': None,
+    'last_order_name': None,
+}
+
+
+def enqueue(kind, siteid, shop_shopify_id, customer_shopify_id=None):
+    return RedactionJob.objects.create(
+        kind=kind, siteid=siteid, shop_shopify_id=shop_shopify_id,
+        customer_shopify_id=customer_shopify_id)
+
+
+def pending():
+    return RedactionJob.objects.filter(finished_at__isnull=True).order_by('id')
+
+
+def customers(job):
+    '''
+    Return the customers, including tombstoned ones, that `job` redacts.
+    '''
+    if job.kind == RedactionJob.SHOP:
+        return Customer.all_objects.filter(siteid=job.siteid)
+    return Customer.all_objects.filter(shopify_id=job.customer_shopify_id)
+
+
+def archived_customers(job):
+    if job.kind == RedactionJob.SHOP:
+        return ArchivedCustomer.objects.filter(siteid=job.siteid)
+    return ArchivedCustomer.objects.filter(shopify_id=job.customer_shopify_id)
+
+
+def slow_events(job):
+    '''
+    Return the slow events that may hold data of the customers `job`
+    redacts: those received from the shop for a shop job, and those
+    whose payload has the ID of the customer for a customer job.
+    '''
+    if job.kind == RedactionJob.SHOP:
+        domains = Shop.objects.filter(shopify_id=job.shop_shopify_id
+                                      ).values_list('myshopify_domain',
+                                                    flat=True)
+        return SlowEvent.objects.filter(shop__in=list(domains))
+    # The payloads are truncated JSON with sorted keys
+    return SlowEvent.objects.filter(
+        payload__regex=r'"(customer_)?id": %d([,}]|$)' %
+        job.customer_shopify_id)
+
+
+def delete_links(customer_ids):
+    '''
+    Delete the tag and address links and the scores of the given
+    customers, and the addresses no other customer links to.
+    '''
+    tag_links = Customer.tags.through.objects
+    address_links = Customer.addresses.through.objects
+    address_ids = list(address_links.filter(customer_id__in=customer_ids)
+                       .values_list('customeraddress_id', flat=True))
+    tag_links.filter(customer_id__in=customer_ids).delete()
+    address_links.filter(customer_id__in=customer_ids).delete()
+    # Shopify addresses belong to one customer, but keep any that are
+    # linked to another one anyway.
+    orphans = (CustomerAddress.objects.filter(id__in=address_ids)
+               .exclude(id__in=address_links.values('customeraddress_id')))
+    orphans._raw_delete(orphans.db)
+    CustomerScore.objects.filter(customer_id__in=customer_ids).delete()
+
+
+def redact_chunk(job_id, chunk_size):
+    '''
+    Redact the next `chunk_size` customers of a job, and finish the job
+    if there are no more.
+
+    :returns: a (redacted, finished) tuple: the number of customers
+      redacted and whether the job is finished.
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        job = RedactionJob.objects.select_for_update().get(pk=job_id)
+        if job.finished_at is not None:
+            return 0, True
+
+        rows = list(customers(job).filter(id__gt=job.cursor).order_by('id')
+                    .values_list('id', 'shopify_id')[:chunk_size])
+        ids = [pk for pk, shopify_id in rows]
+        shopify_ids = [shopify_id for pk, shopify_id in rows]
+        if rows:
+            delete_links(ids)
+            Customer.all_objects.filter(id__in=ids).update(
+                deleted_at=Coalesce('deleted_at', Value(now)),
+                **REDACTED_FIELDS)
+            Checkout.objects.filter(customer_shopify_id__in=shopify_ids
+                                    ).update(email='')
+            ChangeRecord.objects.filter(entity='customer',
+                                        key__in=shopify_ids).delete()
+            job.cursor = ids[-1]
+            job.redacted += len(ids)
+
+        if len(rows) < chunk_size:
+            archived = list(archived_customers(job).order_by('id')
+                            .values_list('id', 'shopify_id')
+                            [:chunk_size - len(rows)])
+            archived_ids = [shopify_id for pk, shopify_id in archived]
+            ArchivedCustomer.objects.filter(
+                id__in=[pk for pk, shopify_id in archived]).delete()
+            Checkout.objects.filter(customer_shopify_id__in=archived_ids
+                                    ).update(email='')
+            ChangeRecord.objects.filter(entity='customer',
+                                        key__in=archived_ids).delete()
+            job.redacted += len(archived)
+            rows += archived
+
+        if len(rows) < chunk_size:
+            slow_events(job).delete()
+            if job.kind == RedactionJob.SHOP:
+                # delete() sends the signals that update the cache
+                for shop in Shop.objects.filter(
+                        shopify_id=job.shop_shopify_id):
+                    shop.delete()
+                ChangeRecord.objects.filter(
+                    entity='shop', key=job.shop_shopify_id).delete()
+            job.finished_at = now
+        job.save()
+
+    # update() bypasses the signals that update the cache.
+    for shopify_id in shopify_ids:
+        cache.invalidate(Customer, shopify_id)
+    return len(rows), job.finished_at is not None
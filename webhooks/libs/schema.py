@@ -0,0 +1,378 @@
+'''
+Declarative payload schemas for the webhook topics.
+
+Each topic lists the keys its view relies on together with their
+expected type. :func:`compile_schema` turns a schema into a plain
+function of type tests so that a malformed payload is rejected with 400
+right after parsing, before any database access, instead of failing
+with a 500 somewhere inside the view.
+
+A payload whose ``id`` is ``None`` is a test request sent from the
+Shopify admin; only the presence of ``id`` is checked for those.
+'''
+import json
+import re
+
+import django.http
+
+from webhooks.libs import metrics, tracing
+
+
+class Type():
+    '''
+    An expected payload value type.
+
+    :param str name: The name used in rejection reasons.
+    :param str test: A Python expression of ``value`` that is true for
+      valid (non-``None``) values.
+    :param dict namespace: Names used by `test`.
+    '''
+    def __init__(self, name, test, namespace=None):
+        self.name = name
+        self.test = test
+        self.namespace = namespace or {}
+
+
+TIMESTAMP_RE = re.compile(r'\d{4}-\d{1,2}-\d{1,2}[T ]\d{1,2}:\d{1,2}')
+DECIMAL_RE = re.compile(r'-?\d+(\.\d+)?$')
+
+INTEGER = Type('integer', 'value.__class__ is int')
+STRING = Type('string', 'value.__class__ is str')
+BOOLEAN = Type('boolean', 'value.__class__ is bool')
+NUMBER = Type('number', 'value.__class__ in (int, float)')
+LIST = Type('list', 'value.__class__ is list')
+OBJECT = Type('object', 'value.__class__ is dict')
+TIMESTAMP = Type('timestamp', 'value.__class__ is str and timestamp_re(value)',
+                 {'timestamp_re': TIMESTAMP_RE.match})
+DECIMAL = Type('decimal', '(value.__class__ is str and decimal_re(value)) or '
+               'value.__class__ in (int, float)',
+               {'decimal_re': DECIMAL_RE.match})
+
+
+class Field():
+    '''
+    :param Type type: The expected type of the value.
+    :param bool required: Reject payloads without this key.
+    :param bool null: Accept ``None`` as a value.
+    '''
+    def __init__(self, type, required=False, null=True):
+        self.type = type
+        self.required = required
+        self.null = null
+
+
+def compile_schema(schema, key='id'):
+    '''
+    Build a function ``check(data)`` that returns ``None`` if the parsed
+    payload `data` satisfies `schema`, or otherwise a short reason such
+    as ``'missing:updated_at'`` or ``'type:total_spent'``.
+
+    :param dict schema: Maps payload keys to :class:`Field` objects.
+    :param str key: The key identifying the payload, which is always
+      required; only its presence is checked when it is ``None``.
+    '''
+    namespace = {}
+    lines = ['def check(data):',
+             '    if data.__class__ is not dict:',
+             '        return "not_object"',
+             '    if %r not in data:' % key,
+             '        return %r' % ('missing:%s' % key),
+             '    if data[%r] is None:' % key,
+             '        return None']
+
+    for key, field in sorted(schema.items()):
+        namespace.update(field.type.namespace)
+        if field.required:
+            lines.append('    if %r not in data:' % key)
+            lines.append('        return %r' % ('missing:%s' % key))
+            lines.append('    value = data[%r]' % key)
+        else:
+            lines.append('    value = data.get(%r)' % key)
+
+        test = '(%s)' % field.type.test
+        if field.null or not field.required:
+            test = 'value is None or %s' % test
+        if not field.null:
+            lines.append('    if value is None and %r in data:' % key)
+            lines.append('        return %r' % ('null:%s' % key))
+        lines.append('    if not (%s):' % test)
+        lines.append('        return %r' % ('type:%s' % key))
+
+    lines.append('    return None')
+
+    exec('\n'.join(lines), namespace)
+    return namespace['check']
+
+
+CUSTOMER = {
+    'id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP, required=True, null=False),
+    'updated_at': Field(TIMESTAMP, required=True, null=False),
+    'accepts_marketing': Field(BOOLEAN),
+    'email': Field(STRING),
+    'first_name': Field(STRING),
+    'last_name': Field(STRING),
+    'last_order_id': Field(INTEGER),
+    'last_order_name': Field(STRING),
+    'multipass_identifier': Field(STRING),
+    'note': Field(STRING),
+    'orders_count': Field(INTEGER),
+    'state': Field(STRING),
+    'tags': Field(STRING),
+    'tax_exempt': Field(BOOLEAN),
+    'total_spent': Field(DECIMAL),
+    'verified_email': Field(BOOLEAN),
+    'addresses': Field(LIST),
+}
+
+CUSTOMER_STATE = {
+    'id': Field(INTEGER, required=True, null=False),
+    'updated_at': Field(TIMESTAMP, required=True, null=False),
+}
+
+DELETE = {
+    'id': Field(INTEGER, required=True, null=False),
+}
+
+SHOP = {
+    'id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'latitude': Field(NUMBER),
+    'longitude': Field(NUMBER),
+    'primary_location_id': Field(INTEGER),
+    'county_taxes': Field(BOOLEAN),
+    'eligible_for_payments': Field(BOOLEAN),
+    'google_apps_login_enabled': Field(BOOLEAN),
+    'has_storefront': Field(BOOLEAN),
+    'password_enabled': Field(BOOLEAN),
+    'requires_extra_payments_agreement': Field(BOOLEAN),
+    'tax_shipping': Field(BOOLEAN),
+    'taxes_included': Field(BOOLEAN),
+}
+
+PRODUCT = {
+    'id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'updated_at': Field(TIMESTAMP),
+    'published_at': Field(TIMESTAMP),
+    'title': Field(STRING),
+    'body_html': Field(STRING),
+    'handle': Field(STRING),
+    'vendor': Field(STRING),
+    'product_type': Field(STRING),
+    'tags': Field(STRING),
+    'variants': Field(LIST),
+    'images': Field(LIST),
+}
+
+PRODUCT_VARIANT = {
+    'id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'updated_at': Field(TIMESTAMP),
+    'title': Field(STRING),
+    'sku': Field(STRING),
+    'barcode': Field(STRING),
+    'position': Field(INTEGER),
+    'price': Field(DECIMAL),
+    'compare_at_price': Field(DECIMAL),
+    'option1': Field(STRING),
+    'option2': Field(STRING),
+    'option3': Field(STRING),
+    'image_id': Field(INTEGER),
+    'inventory_quantity': Field(INTEGER),
+    'inventory_management': Field(STRING),
+    'inventory_policy': Field(STRING),
+    'fulfillment_service': Field(STRING),
+    'grams': Field(INTEGER),
+    'weight': Field(NUMBER),
+    'weight_unit': Field(STRING),
+    'requires_shipping': Field(BOOLEAN),
+    'taxable': Field(BOOLEAN),
+}
+
+PRODUCT_IMAGE = {
+    'id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'updated_at': Field(TIMESTAMP),
+    'position': Field(INTEGER),
+    'src': Field(STRING),
+}
+
+CART = {
+    'id': Field(STRING, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'updated_at': Field(TIMESTAMP),
+    'note': Field(STRING),
+    'line_items': Field(LIST),
+}
+
+CHECKOUT = {
+    'id': Field(INTEGER, required=True, null=False),
+    'token': Field(STRING, required=True, null=False),
+    'cart_token': Field(STRING),
+    'created_at': Field(TIMESTAMP),
+    'updated_at': Field(TIMESTAMP),
+    'completed_at': Field(TIMESTAMP),
+    'email': Field(STRING),
+    'currency': Field(STRING),
+    'subtotal_price': Field(DECIMAL),
+    'total_price': Field(DECIMAL),
+    'customer': Field(OBJECT),
+    'line_items': Field(LIST),
+}
+
+#: The keys linking an order to its checkout, and those counted in the
+#: lifetime values of customers.
+ORDER = {
+    'id': Field(INTEGER, required=True, null=False),
+    'checkout_id': Field(INTEGER),
+    'checkout_token': Field(STRING),
+    'customer': Field(OBJECT),
+    'total_price': Field(DECIMAL),
+    'currency': Field(STRING),
+    'created_at': Field(TIMESTAMP),
+    'processed_at': Field(TIMESTAMP),
+    'cancelled_at': Field(TIMESTAMP),
+}
+
+REFUND = {
+    'id': Field(INTEGER, required=True, null=False),
+    'order_id': Field(INTEGER, required=True, null=False),
+    'created_at': Field(TIMESTAMP),
+    'processed_at': Field(TIMESTAMP),
+    'note': Field(STRING),
+    'transactions': Field(LIST),
+    'refund_line_items': Field(LIST),
+}
+
+REFUND_LINE_ITEM = {
+    'id': Field(INTEGER, required=True, null=False),
+    'line_item_id': Field(INTEGER),
+    'quantity': Field(INTEGER),
+    'restock_type': Field(STRING),
+    'subtotal': Field(DECIMAL),
+    'total_tax': Field(DECIMAL),
+}
+
+TRANSACTION = {
+    'id': Field(INTEGER, required=True, null=False),
+    'amount': Field(DECIMAL),
+    'kind': Field(STRING),
+    'status': Field(STRING),
+}
+
+#: The mandatory privacy webhooks, which carry no ``id``; see :data:`KEYS`.
+CUSTOMERS_REDACT = {
+    'shop_id': Field(INTEGER, required=True, null=False),
+    'shop_domain': Field(STRING),
+    'customer': Field(OBJECT, required=True, null=False),
+    'orders_to_redact': Field(LIST),
+}
+
+SHOP_REDACT = {
+    'shop_id': Field(INTEGER, required=True, null=False),
+    'shop_domain': Field(STRING),
+}
+
+#: Payload schemas by topic.
+SCHEMAS = {
+    'customers/create': CUSTOMER,
+    'customers/update': CUSTOMER,
+    'customers/enable': CUSTOMER_STATE,
+    'customers/disable': CUSTOMER_STATE,
+    'customers/delete': DELETE,
+    'shop/update': SHOP,
+    'products/create': PRODUCT,
+    'products/update': PRODUCT,
+    'products/delete': DELETE,
+    'carts/create': CART,
+    'carts/update': CART,
+    'checkouts/create': CHECKOUT,
+    'checkouts/update': CHECKOUT,
+    'checkouts/delete': DELETE,
+    'orders/create': ORDER,
+    'orders/paid': ORDER,
+    'orders/cancelled': ORDER,
+    'refunds/create': REFUND,
+    'customers/redact': CUSTOMERS_REDACT,
+    'shop/redact': SHOP_REDACT,
+}
+
+#: The key identifying the payload of a topic, if not ``id``.
+KEYS = {
+    'customers/redact': 'shop_id',
+    'shop/redact': 'shop_id',
+}
+
+#: Compiled checks by topic, built at import time.
+CHECKS = dict((topic, compile_schema(schema, KEYS.get(topic, 'id')))
+              for topic, schema in SCHEMAS.items())
+
+PRODUCT_ITEM_CHECKS = {
+    'variants': compile_schema(PRODUCT_VARIANT),
+    'images': compile_schema(PRODUCT_IMAGE),
+}
+
+#: Compiled checks of the objects in list keys, by topic and key. The
+#: views store these objects, so they are checked like the payload.
+ITEM_CHECKS = {
+    'products/create': PRODUCT_ITEM_CHECKS,
+    'products/update': PRODUCT_ITEM_CHECKS,
+    'refunds/create': {
+        'refund_line_items': compile_schema(REFUND_LINE_ITEM),
+        'transactions': compile_schema(TRANSACTION),
+    },
+}
+
+
+def check_items(topic, data):
+    '''
+    Check the objects in the list keys of `data` listed in
+    :data:`ITEM_CHECKS`. The objects of a list must have distinct ids,
+    since the views store them as rows keyed on their id.
+
+    :returns: ``None``, or a reason such as
+      ``'type:refund_line_items.quantity'`` or ``'duplicate:variants.id'``.
+    '''
+    for key, check in sorted(ITEM_CHECKS.get(topic, {}).items()):
+        items = data.get(key) or []
+        for item in items:
+            reason = check(item)
+            if reason == 'not_object':
+                return 'type:%s' % key
+            if reason is None and item['id'] is None:
+                # Only payloads may be test requests
+                reason = 'null:id'
+            if reason is not None:
+                problem, name = reason.split(':')
+                return '%s:%s.%s' % (problem, key, name)
+        if len(set(item['id'] for item in items)) < len(items):
+            return 'duplicate:%s.id' % key
+    return None
+
+
+def parse_payload(request, topic):
+    '''
+    Parse the JSON body of `request` and check it against the schema of
+    `topic`. Rejections are counted in the ``webhooks.rejected`` metric
+    by topic and reason.
+
+    :returns: a (data, response) tuple. `response` is ``None`` if the
+      payload is valid; otherwise it is a 400 response to be returned by
+      the view.
+    '''
+    try:
+        with tracing.span('json'):
+            data = json.loads(request.body.decode('utf8'))
+    except ValueError:
+        reason = 'invalid_json'
+    else:
+        with tracing.span('schema'):
+            reason = CHECKS[topic](data)
+            if reason is None and data[KEYS.get(topic, 'id')] is not None:
+                reason = check_items(topic, data)
+        if reason is None:
+            return data, None
+
+    metrics.incr('webhooks.rejected', topic, reason)
+    return None, django.http.HttpResponseBadRequest(reason)
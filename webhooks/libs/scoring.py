@@ -0,0 +1,202 @@
+'''
+Recency, frequency and monetary (RFM) scores of the customers.
+
+The scores are computed with NumPy. The columns they need are loaded in
+chunks of customers in order of ID, each chunk becomes a few arrays,
+and each score of a whole chunk is found with a single
+``searchsorted`` against the quantile breakpoints of that score. The
+scores are written to :class:`webhooks.models.CustomerScore` with one
+bulk insert and one bulk update (see
+:func:`webhooks.libs.bulk.bulk_update`) per chunk.
+
+- Frequency is ``orders_count`` and monetary is ``total_spent``.
+- Recency is the time since ``updated_at`` of the customers who have
+  ordered (``last_order_id`` is set), since Shopify updates a customer
+  with each order. Customers who never ordered get the lowest recency.
+
+A full run computes the breakpoints from every customer, so that each
+score splits the customers into `bins` groups of about equal size, and
+scores them all; it holds the arrays of every customer, about 32 bytes
+each, until it is done. An incremental run reuses the breakpoints of
+the last full run and only scores the customers updated since the last
+run started, less an overlap for late webhooks. The recency of
+customers that do not change is only refreshed by full runs, so those
+should still run regularly.
+
+NumPy is an optional dependency: :data:`numpy` is ``None`` without it.
+'''
+import datetime
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from webhooks.libs import bulk
+from webhooks.models import Customer, CustomerScore, ScoringRun
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: The customer columns loaded for scoring.
+COLUMNS = ('id', 'orders_count', 'total_spent', 'last_order_id',
+           'updated_at')
+
+#: The scores, in the order they appear in a segment.
+SCORES = ('recency', 'frequency', 'monetary')
+
+#: The :class:`webhooks.models.CustomerScore` fields written by a run.
+FIELDS = list(SCORES) + ['segment', 'scored_at']
+
+
+def load_chunks(queryset, chunk_size, now):
+    '''
+    Iterate over the customers of `queryset` in chunks of up to
+    `chunk_size`, in order of ID, as dicts of NumPy arrays: ``id``, and
+    the value behind each score. Recency is in days since the last
+    order as of `now`, and infinite for customers who never ordered.
+    '''
+    last = 0
+    now = now.timestamp()
+    while True:
+        rows = list(queryset.filter(id__gt=last).order_by('id')
+                    .values_list(*COLUMNS)[:chunk_size])
+        if not rows:
+            return
+        last = rows[-1][0]
+        ids, orders, spent, last_orders, updated = zip(*rows)
+        yield {
+            'id': numpy.array(ids, dtype=numpy.int64),
+            'recency': numpy.array(
+                [(now - at.timestamp()) / 86400
+                 if order is not None and at is not None else numpy.inf
+                 for order, at in zip(last_orders, updated)]),
+            'frequency': numpy.array(orders, dtype=numpy.float64),
+            'monetary': numpy.array(spent, dtype=numpy.float64),
+        }
+
+
+def breakpoints(values, bins):
+    '''
+    Return the `bins` - 1 quantiles splitting the finite `values` into
+    `bins` groups of about equal size, as a list of floats.
+    '''
+    values = values[numpy.isfinite(values)]
+    if not values.size:
+        return []
+    quantiles = numpy.linspace(0, 100, bins + 1)[1:-1]
+    return numpy.percentile(values, quantiles).tolist()
+
+
+def score(values, breaks, bins, reverse=False):
+    '''
+    Return the scores of `values`, from 1 to `bins`: the number of the
+    group they fall in between the `breaks`. A value equal to a
+    breakpoint falls in the lower group, so that a common value, such as
+    0 orders, does not lift everyone who shares it. With `reverse`,
+    smaller values score higher.
+    '''
+    groups = numpy.searchsorted(breaks, values, side='left') + 1
+    groups = numpy.minimum(groups, bins)
+    if reverse:
+        return bins + 1 - groups
+    return groups
+
+
+def score_chunk(chunk, breaks, bins):
+    '''
+    Return the arrays of scores of a chunk from :func:`load_chunks`, by
+    score name.
+    '''
+    return dict((name, score(chunk[name], breaks[name], bins,
+                             reverse=(name == 'recency')))
+                for name in SCORES)
+
+
+def write(chunk, scores, now):
+    '''
+    Save the `scores` of the customers in `chunk`, inserting the scores
+    of customers scored for the first time and updating the others.
+    Customers deleted since the chunk was loaded are skipped.
+    '''
+    ids = chunk['id'].tolist()
+    columns = [scores[name].tolist() for name in SCORES]
+    instances = [
+        CustomerScore(customer_id=customer_id, recency=r, frequency=f,
+                      monetary=m, segment='%d%d%d' % (r, f, m),
+                      scored_at=now)
+        for customer_id, r, f, m in zip(ids, *columns)]
+
+    # The chunk is an ID range, which keeps the queries short
+    with transaction.atomic():
+        live = set(Customer.all_objects.filter(id__gte=ids[0],
+                                               id__lte=ids[-1])
+                   .values_list('id', flat=True))
+        existing = set(CustomerScore.objects
+                       .filter(customer_id__gte=ids[0],
+                               customer_id__lte=ids[-1])
+                       .values_list('customer_id', flat=True))
+        instances = [obj for obj in instances if obj.customer_id in live]
+        CustomerScore.objects.bulk_create(
+            [obj for obj in instances if obj.customer_id not in existing])
+        bulk.bulk_update(
+            CustomerScore,
+            [obj for obj in instances if obj.customer_id in existing],
+            FIELDS, key='customer_id')
+    return len(instances)
+
+
+def last_run(full=False):
+    '''
+    Return the latest finished :class:`webhooks.models.ScoringRun`, or
+    the latest full one, or ``None``.
+    '''
+    runs = ScoringRun.objects.filter(finished_at__isnull=False)
+    if full:
+        runs = runs.filter(full=True)
+    return runs.order_by('-started_at').first()
+
+
+def run(full=False, bins=5, chunk_size=10000,
+        overlap=datetime.timedelta(days=1)):
+    '''
+    Score the customers; see the module documentation. The run is
+    incremental unless `full` is set or there has been no full run.
+
+    :param int bins: The number of groups of each score, for full runs;
+      incremental runs use those of the last full run.
+    :param datetime.timedelta overlap: How far before the start of the
+      last run an incremental run looks for updated customers.
+    :returns: the finished :class:`webhooks.models.ScoringRun`.
+    '''
+    now = timezone.now()
+    previous = last_run(full=True)
+    scoring_run = ScoringRun(started_at=now, full=full or previous is None)
+    customers = Customer.objects.all()
+
+    if scoring_run.full:
+        chunks = list(load_chunks(customers, chunk_size, now))
+        breaks = {}
+        for name in SCORES:
+            values = (numpy.concatenate([chunk[name] for chunk in chunks])
+                      if chunks else numpy.array([]))
+            breaks[name] = breakpoints(values, bins)
+    else:
+        breaks = json.loads(previous.breakpoints)
+        bins = breaks['bins']
+        scoring_run.since = last_run().started_at - overlap
+        chunks = load_chunks(customers.filter(
+            updated_at__gte=scoring_run.since), chunk_size, now)
+    breaks['bins'] = bins
+    scoring_run.breakpoints = json.dumps(breaks)
+    scoring_run.save()
+
+    for chunk in chunks:
+        scores = score_chunk(chunk, breaks, bins)
+        scoring_run.scored += write(chunk, scores, now)
+
+    scoring_run.finished_at = timezone.now()
+    scoring_run.save()
+    return scoring_run
@@ -0,0 +1,258 @@
+'''
+A durable, append-only spool of accepted webhook requests.
+
+The ingress server (``manage.py serve_ingress``) appends every webhook
+that passes validation to the spool and only acknowledges it once the
+record has been synced to disk. Django workers (``manage.py
+consume_spool``) later replay the records through the regular views.
+
+The spool is a directory of segment files. A writer appends to one
+active segment (``<name>.open``) and seals it into ``<name>.log`` when
+it grows past `segment_bytes` or is older than `segment_age`. Consumers
+only read sealed segments; a consumer claims a segment by renaming it to
+``<name>.work``, which is atomic, so several consumers can share a spool
+without coordination. A claimed segment is deleted once every record in
+it has been processed. The records that failed are first copied to a
+dead-letter segment, ``<name>.dead``, which is kept until an operator
+requeues it (``manage.py consume_spool --requeue-dead``), since the
+webhooks in it were acknowledged to Shopify and will not be resent.
+
+Each record is a fixed header, a JSON object of request metadata and the
+raw request body::
+
+    >II  (metadata length, body length)
+    metadata (utf8 JSON)
+    body
+'''
+import json
+import os
+import struct
+import time
+
+
+RECORD_HEADER = struct.Struct('>II')
+
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.log'
+CLAIMED_SUFFIX = '.work'
+DEAD_SUFFIX = '.dead'
+
+
+class SpoolFullError(Exception):
+    '''
+    Raised when appending to a spool that holds `max_bytes` or more of
+    unprocessed records.
+    '''
+    pass
+
+
+def spool_size(directory):
+    '''
+    Return the number of bytes held by the segments in `directory`.
+    '''
+    total = 0
+    for entry in os.listdir(directory):
+        if entry.endswith((OPEN_SUFFIX, SEALED_SUFFIX, CLAIMED_SUFFIX,
+                           DEAD_SUFFIX)):
+            try:
+                total += os.path.getsize(os.path.join(directory, entry))
+            except OSError:  # Removed by a consumer in the meantime
+                pass
+    return total
+
+
+class SpoolWriter():
+    '''
+    Append records to the spool in `directory`. Only one writer may use
+    a given directory at a time.
+
+    :param str directory: The spool directory; created if necessary.
+    :param int max_bytes: :meth:`append` raises :class:`SpoolFullError`
+      while the spool holds at least this many bytes.
+    :param int segment_bytes: Seal the active segment once it is this
+      large.
+    :param float segment_age: Seal the active segment once it is this
+      many seconds old, so that consumers see records promptly.
+    '''
+    def __init__(self, directory, max_bytes, segment_bytes=64 * 2 ** 20,
+                 segment_age=1.0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+
+        self.size = spool_size(directory)
+        self._size_checked = time.time()
+        self._file = None
+        self._opened = 0
+        self._sequence = 0
+
+        # Seal segments left open by a previous writer
+        for entry in os.listdir(directory):
+            if entry.endswith(OPEN_SUFFIX):
+                path = os.path.join(directory, entry)
+                os.rename(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+
+    def is_full(self):
+        '''
+        Return `True` if the spool has reached `max_bytes`. The size of
+        the directory is re-read at most once a second to account for
+        segments removed by consumers.
+        '''
+        now = time.time()
+        if self.size >= self.max_bytes and now - self._size_checked >= 1:
+            self.size = spool_size(self.directory)
+            self._size_checked = now
+        return self.size >= self.max_bytes
+
+    def append(self, metadata, body):
+        '''
+        Append a record. The record is written to the operating system
+        but is only durable once :meth:`sync` has returned.
+
+        :param dict metadata: JSON serializable request metadata.
+        :param bytes body: The request body.
+        :raises SpoolFullError: if the spool is full.
+        '''
+        if self.is_full():
+            raise SpoolFullError()
+
+        if self._file is None:
+            self._open_segment()
+
+        start = self._file.tell()
+        write_records(self._file, [(metadata, body)])
+        self.size += self._file.tell() - start
+
+    def sync(self):
+        '''
+        Flush and fsync the active segment, then seal it if it is large
+        or old enough.
+        '''
+        if self._file is None:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        if (self._file.tell() >= self.segment_bytes or
+                time.time() - self._opened >= self.segment_age):
+            self.seal()
+
+    def seal(self):
+        '''
+        Close the active segment and make it visible to consumers.
+        '''
+        if self._file is None:
+            return
+
+        path = self._file.name
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        os.rename(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+
+    def close(self):
+        self.seal()
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = '%020d-%d-%06d%s' % (time.time() * 1e6, os.getpid(),
+                                    self._sequence, OPEN_SUFFIX)
+        self._file = open(os.path.join(self.directory, name), 'ab')
+        self._opened = time.time()
+
+
+def write_records(segment, records):
+    for metadata, body in records:
+        metadata = json.dumps(metadata).encode('utf8')
+        segment.write(RECORD_HEADER.pack(len(metadata), len(body)))
+        segment.write(metadata)
+        segment.write(body)
+
+
+def read_segment(path):
+    '''
+    Iterate over the (metadata, body) records of the segment at `path`.
+    A truncated record at the end of the segment (from a writer that
+    crashed before syncing) is ignored.
+    '''
+    with open(path, 'rb') as segment:
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            metadata_length, body_length = RECORD_HEADER.unpack(header)
+            metadata = segment.read(metadata_length)
+            body = segment.read(body_length)
+            if len(metadata) < metadata_length or len(body) < body_length:
+                return
+            yield json.loads(metadata.decode('utf8')), body
+
+
+def claim_segment(directory):
+    '''
+    Claim the oldest sealed segment in `directory` for processing.
+
+    :returns: the path of the claimed segment, or `None` if there are
+      no sealed segments.
+    '''
+    for entry in sorted(os.listdir(directory)):
+        if not entry.endswith(SEALED_SUFFIX):
+            continue
+        path = os.path.join(directory, entry)
+        claimed = path[:-len(SEALED_SUFFIX)] + CLAIMED_SUFFIX
+        try:
+            os.rename(path, claimed)
+        except OSError:  # Claimed by another consumer
+            continue
+        return claimed
+    return None
+
+
+def release_claims(directory):
+    '''
+    Return the segments claimed by consumers that have died to the
+    sealed state so that they are processed again. Only call this when
+    no consumer is running.
+    '''
+    for entry in os.listdir(directory):
+        if entry.endswith(CLAIMED_SUFFIX):
+            path = os.path.join(directory, entry)
+            os.rename(path, path[:-len(CLAIMED_SUFFIX)] + SEALED_SUFFIX)
+
+
+def dead_letter(path, records):
+    '''
+    Save the (metadata, body) `records` of the claimed segment at `path`
+    that failed to process to its dead-letter segment, synced to disk,
+    so that the claimed segment can be deleted.
+
+    :returns: the path of the dead-letter segment.
+    '''
+    dead = path[:-len(CLAIMED_SUFFIX)] + DEAD_SUFFIX
+    partial = dead + '.tmp'
+    with open(partial, 'wb') as segment:
+        write_records(segment, records)
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.replace(partial, dead)
+    return dead
+
+
+def requeue_dead(directory):
+    '''
+    Seal the dead-letter segments in `directory` again, so that
+    consumers retry their records.
+
+    :returns: the number of segments requeued.
+    '''
+    count = 0
+    for entry in os.listdir(directory):
+        if entry.endswith(DEAD_SUFFIX):
+            path = os.path.join(directory, entry)
+            os.rename(path, path[:-len(DEAD_SUFFIX)] + SEALED_SUFFIX)
+            count += 1
+    return count
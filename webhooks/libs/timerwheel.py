@@ -0,0 +1,121 @@
+'''
+A hierarchical timer wheel.
+
+Timers are kept in `levels` wheels of `wheel_size` slots. A slot of the
+lowest wheel covers one tick; a slot of each higher wheel covers all of
+the wheel below it. A timer is placed in the lowest wheel whose range
+covers its deadline. Whenever the lower wheel has gone round once, the
+timers in the next slot of the wheel above are moved down a level
+("cascaded"). Scheduling and cancelling are O(1) and advancing the clock
+by one tick only touches the timers that are due or cascaded, however
+many timers are held.
+
+With the defaults (1 second ticks, 4 wheels of 64 slots) deadlines up to
+about 194 days ahead are placed directly; later deadlines are parked in
+the top wheel and placed again when they come into range.
+'''
+
+
+class TimerWheel():
+    '''
+    :param float tick: The resolution of the wheel in seconds.
+    :param int wheel_size: The number of slots per wheel.
+    :param int levels: The number of wheels.
+    :param float now: The current time, as a UNIX timestamp.
+    '''
+    def __init__(self, now, tick=1.0, wheel_size=64, levels=4):
+        self.tick = tick
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self.current = int(now // tick)
+        self.wheels = [[{} for slot in range(wheel_size)]
+                       for level in range(levels)]
+        #: Maps each key to the (level, slot) holding its timer.
+        self.timers = {}
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline):
+        '''
+        Set the timer for `key` to expire at `deadline`, replacing any
+        timer already set for it. Deadlines in the past expire on the
+        next :meth:`advance`.
+
+        :param key: A hashable key identifying the timer.
+        :param float deadline: A UNIX timestamp.
+        '''
+        self.cancel(key)
+        self._place(key, max(int(deadline // self.tick), self.current + 1))
+
+    def cancel(self, key):
+        '''
+        Cancel the timer for `key`.
+
+        :returns: `True` if a timer was cancelled.
+        '''
+        position = self.timers.pop(key, None)
+        if position is None:
+            return False
+        level, slot = position
+        del self.wheels[level][slot][key]
+        return True
+
+    def advance(self, now):
+        '''
+        Move the clock forward to `now`.
+
+        :returns: a list of the keys whose timers expired.
+        '''
+        target = int(now // self.tick)
+        size = self.wheel_size
+        expired = []
+
+        while self.current < target:
+            self.current += 1
+
+            # Cascade the timers of the higher wheels that are now due
+            # to be placed with finer resolution.
+            span = 1
+            for level in range(1, self.levels):
+                span *= size
+                if self.current % span:
+                    break
+                slot = (self.current // span) % size
+                bucket = self.wheels[level][slot]
+                self.wheels[level][slot] = {}
+                for key, expires in bucket.items():
+                    del self.timers[key]
+                    self._place(key, expires)
+
+            slot = self.current % size
+            bucket = self.wheels[0][slot]
+            self.wheels[0][slot] = {}
+            for key, expires in bucket.items():
+                del self.timers[key]
+                if expires <= self.current:
+                    expired.append(key)
+                else:  # Parked beyond the range of the wheels
+                    self._place(key, expires)
+
+        return expired
+
+    def _place(self, key, expires):
+        size = self.wheel_size
+        delta = expires - self.current
+        span = 1
+        for level in range(self.levels):
+            if delta < span * size or level == self.levels - 1:
+                if delta >= span * size:
+                    # Too far ahead; park the timer in the furthest slot
+                    # of the top wheel.
+                    slot = (self.current // span - 1) % size
+                else:
+                    slot = (expires // span) % size
+                self.wheels[level][slot][key] = expires
+                self.timers[key] = (level, slot)
+                return
+            span *= size
@@ -0,0 +1,338 @@
+'''
+Stage-level tracing of the webhook requests.
+
+:class:`webhooks.libs.validate.ValidateShopifyWebhookRequest` starts a
+:class:`Trace` for every webhook request, kept in a thread-local, and
+the code it runs marks its stages with :func:`span`::
+
+    with tracing.span('save'):
+        customer.save()
+
+Outside a traced request, or with ``settings.TRACE_ENABLED`` off,
+:func:`span` returns a shared no-op, so the stages cost next to nothing
+when they are not recorded.
+
+When a request finishes:
+
+- if it took ``settings.TRACE_SLOW_THRESHOLD`` seconds or more and its
+  HMAC was verified (see :func:`verified`), it is stored as a
+  :class:`webhooks.models.SlowEvent` with its stages and its payload,
+  with personal data redacted. Only the latest
+  ``settings.TRACE_SLOW_EVENTS`` events are kept, and redaction jobs
+  delete those of the customers and shops they erase.
+- if ``settings.TRACE_ZIPKIN_URL`` is set, its spans are queued for a
+  background thread that posts them, in the Zipkin v2 JSON format, to
+  that collector.
+
+``manage.py slow_events`` prints the stored events as Zipkin v2 spans.
+'''
+import collections
+import json
+import logging
+import random
+import threading
+import time
+import urllib.request
+
+from django.conf import settings
+
+from webhooks.libs import metrics
+
+
+logger = logging.getLogger(__name__)
+
+#: Payload keys whose values are replaced in stored events.
+REDACTED_KEYS = frozenset([
+    'email', 'contact_email', 'customer_email', 'first_name', 'last_name',
+    'name', 'phone', 'note', 'multipass_identifier', 'company', 'address1',
+    'address2', 'city', 'zip', 'latitude', 'longitude', 'browser_ip',
+])
+
+#: Replaces the values of :data:`REDACTED_KEYS`.
+REDACTED = '[redacted]'
+
+#: Service name of the exported spans.
+SERVICE_NAME = 'logify'
+
+_local = threading.local()
+
+
+class Trace():
+    '''
+    The stages of one request, as (name, start, end) tuples of
+    :func:`time.perf_counter` values.
+    '''
+    def __init__(self, topic, shop=''):
+        self.trace_id = '%032x' % random.getrandbits(128)
+        self.topic = topic
+        self.shop = shop
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.status = None
+        #: Whether the HMAC of the request was verified
+        self.verified = False
+        self.spans = []
+
+    @classmethod
+    def from_event(cls, event):
+        '''
+        Rebuild the trace stored as the
+        :class:`webhooks.models.SlowEvent` `event`.
+        '''
+        trace = cls(event.topic, event.shop)
+        trace.trace_id = event.trace_id
+        trace.timestamp = event.created_at.timestamp() - event.duration
+        trace.start, trace.end = 0.0, event.duration
+        trace.status = event.status
+        for stage in json.loads(event.stages):
+            start = stage['start'] / 1000
+            trace.record(stage['name'], start,
+                         start + stage['duration'] / 1000)
+        return trace
+
+    def record(self, name, start, end):
+        self.spans.append((name, start, end))
+
+    @property
+    def duration(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def stages(self):
+        '''
+        Return the spans as a list of dicts with the stage name, and
+        its start and duration in milliseconds since the request
+        started.
+        '''
+        return [{'name': name,
+                 'start': round((start - self.start) * 1000, 3),
+                 'duration': round((end - start) * 1000, 3)}
+                for name, start, end in self.spans]
+
+    def zipkin(self):
+        '''
+        Return the trace as a list of Zipkin v2 spans: one for the
+        request, and one child per stage.
+        '''
+        endpoint = {'serviceName': SERVICE_NAME}
+        root_id = '%016x' % random.getrandbits(64)
+        tags = {'shopify.topic': self.topic, 'shopify.shop': self.shop}
+        if self.status is not None:
+            tags['http.status_code'] = str(self.status)
+        spans = [{
+            'traceId': self.trace_id,
+            'id': root_id,
+            'name': self.topic or 'webhook',
+            'kind': 'SERVER',
+            'timestamp': int(self.timestamp * 1e6),
+            'duration': max(int(self.duration * 1e6), 1),
+            'localEndpoint': endpoint,
+            'tags': tags,
+        }]
+        for name, start, end in self.spans:
+            offset = start - self.start
+            spans.append({
+                'traceId': self.trace_id,
+                'id': '%016x' % random.getrandbits(64),
+                'parentId': root_id,
+                'name': name,
+                'timestamp': int((self.timestamp + offset) * 1e6),
+                'duration': max(int((end - start) * 1e6), 1),
+                'localEndpoint': endpoint,
+            })
+        return spans
+
+
+class _Span():
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.name, self.start, time.perf_counter())
+
+
+class _NoSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def current():
+    '''
+    Return the trace of the request being handled by this thread, or
+    ``None``.
+    '''
+    return getattr(_local, 'trace', None)
+
+
+def span(name):
+    '''
+    Return a context manager recording the stage `name` in the current
+    trace, if any.
+    '''
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+def start(meta):
+    '''
+    Start tracing the request described by `meta` in this thread.
+
+    :returns: the new :class:`Trace`, or ``None`` if tracing is off or
+      a trace is already running, as when a view calls another view.
+    '''
+    if not settings.TRACE_ENABLED or current() is not None:
+        return None
+    trace = Trace(meta.get('HTTP_X_SHOPIFY_TOPIC', ''),
+                  meta.get('HTTP_X_SHOPIFY_SHOP_DOMAIN', ''))
+    _local.trace = trace
+    return trace
+
+
+def verified():
+    '''
+    Mark the current trace as that of a request whose HMAC is valid.
+    '''
+    trace = current()
+    if trace is not None:
+        trace.verified = True
+
+
+def finish(trace, status, body=b''):
+    '''
+    End `trace`, started by :func:`start`, with the HTTP `status` of the
+    response. The trace is exported, and stored with the request `body`
+    if it was slow.
+    '''
+    _local.trace = None
+    trace.end = time.perf_counter()
+    trace.status = status
+
+    if settings.TRACE_ZIPKIN_URL:
+        exporter.put(trace.zipkin())
+    # Only authenticated requests may write to the table
+    if trace.verified and trace.duration >= settings.TRACE_SLOW_THRESHOLD:
+        metrics.incr('tracing.slow', trace.topic)
+        try:
+            store(trace, body)
+        except Exception:
+            # The response is ready; losing the event must not lose it
+            logger.exception('Storing a slow %s event failed', trace.topic)
+
+
+def redact(value):
+    '''
+    Return a copy of the decoded payload `value` with the values of
+    :data:`REDACTED_KEYS` replaced, at any depth.
+    '''
+    if isinstance(value, dict):
+        return dict((key, REDACTED if key in REDACTED_KEYS and item
+                     else redact(item))
+                    for key, item in value.items())
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def redacted_payload(body):
+    '''
+    Return the JSON `body` with personal data redacted, truncated to
+    ``settings.TRACE_PAYLOAD_MAX`` characters. Bodies that are not JSON
+    are not kept, since they cannot be redacted.
+    '''
+    try:
+        data = json.loads(bytes(body).decode('utf8'))
+    except ValueError:
+        return ''
+    return json.dumps(redact(data),
+                      sort_keys=True)[:settings.TRACE_PAYLOAD_MAX]
+
+
+def store(trace, body):
+    '''
+    Save `trace` as a :class:`webhooks.models.SlowEvent` and drop the
+    events that fall out of the ring of ``settings.TRACE_SLOW_EVENTS``.
+    '''
+    from webhooks.models import SlowEvent  # The models import this module
+
+    event = SlowEvent.objects.create(
+        trace_id=trace.trace_id, topic=trace.topic, shop=trace.shop,
+        status=trace.status, duration=trace.duration,
+        stages=json.dumps(trace.stages()), payload=redacted_payload(body))
+    SlowEvent.objects.filter(
+        id__lte=event.id - settings.TRACE_SLOW_EVENTS).delete()
+    return event
+
+
+class ZipkinExporter():
+    '''
+    Post queued spans to ``settings.TRACE_ZIPKIN_URL`` from a background
+    thread, every ``settings.TRACE_EXPORT_INTERVAL`` seconds. At most
+    ``settings.TRACE_EXPORT_QUEUE`` spans are queued; more are dropped,
+    as are spans the collector fails to accept.
+    '''
+    def __init__(self):
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def put(self, spans):
+        self._start()
+        with self._lock:
+            if len(self._queue) + len(spans) > settings.TRACE_EXPORT_QUEUE:
+                metrics.incr('tracing.dropped', amount=len(spans))
+                return
+            self._queue.extend(spans)
+
+    def flush(self):
+        with self._lock:
+            spans = list(self._queue)
+            self._queue.clear()
+        if not spans or not settings.TRACE_ZIPKIN_URL:
+            return
+        try:
+            request = urllib.request.Request(
+                settings.TRACE_ZIPKIN_URL,
+                data=json.dumps(spans).encode('utf8'),
+                headers={'Content-Type': 'application/json'})
+            urllib.request.urlopen(request, timeout=5).close()
+        except (OSError, ValueError):
+            metrics.incr('tracing.export_failed', amount=len(spans))
+            logger.warning('Exporting %d spans failed', len(spans),
+                           exc_info=True)
+        else:
+            metrics.incr('tracing.exported', amount=len(spans))
+
+    def _start(self):
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        thread = threading.Thread(target=self._run, name='zipkin-exporter')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.TRACE_EXPORT_INTERVAL)
+            self.flush()
+
+
+exporter = ZipkinExporter()
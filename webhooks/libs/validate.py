@@ -1,9 +1,200 @@
+from concurrent import futures
 from hashlib import sha256
 import base64
+import collections
 import hmac
+import itertools
+import os
+import time
 
+from django.conf import settings
 import django.http
 from logify import private_settings
+from webhooks.libs import admission, profiling, tracing
+
+
+#: WSGI environ key set by a front end (such as
+#: :class:`webhooks.libs.asgi.WebhookASGIHandler`) that has already
+#: checked the HMAC of the request body. Clients cannot set this key;
+#: header-derived environ keys always start with ``HTTP_``.
+PREVALIDATED_ENVIRON_KEY = 'logify.webhook_validated'
+#: WSGI environ key set when replaying a request that was admitted
+#: before it was spooled; such requests skip admission control. Only
+#: the spool replay sets it: requests validated by the ASGI front end
+#: are still admitted here.
+ADMITTED_ENVIRON_KEY = 'logify.webhook_admitted'
+
+#: (META key, human-readable header name) pairs for the headers that
+#: every Shopify webhook request must carry.
+REQUIRED_HEADERS = (
+    ('HTTP_X_SHOPIFY_SHOP_DOMAIN', 'X-Shopify-Shop-Domain'),
+    ('HTTP_X_REQUEST_ID', 'X-Request-Id'),
+    ('HTTP_X_SHOPIFY_TOPIC', 'X-Shopify-Topic'),
+    ('HTTP_X_SHOPIFY_HMAC_SHA256', 'X-Shopify-Hmac-Sha256'),
+    ('CONTENT_TYPE', 'Content-Type'),
+)
+
+
+def check_shopify_webhook_request(method, meta):
+    '''
+    Check that a request uses the POST method and carries the headers
+    of a Shopify webhook request. This does not touch the request body,
+    so it can be run by any front end before the body is read.
+
+    :param str method: The HTTP method of the request.
+    :param dict meta: The WSGI environ/``request.META`` of the request.
+    :returns: ``None`` if the request passes the checks; otherwise an
+      :class:`django.http.HttpResponse` describing the problem.
+    '''
+    if method != 'POST':
+        return django.http.HttpResponseNotAllowed(['POST'])
+
+    for key, name in REQUIRED_HEADERS:
+        if key not in meta:
+            return django.http.HttpResponseBadRequest('missing %s' % name)
+    if meta['CONTENT_TYPE'] != 'application/json':
+        return django.http.HttpResponseBadRequest('bad Content-Type')
+
+    return None
+
+
+#: The request body is read and hashed in chunks of this many bytes.
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def max_body_size(topic):
+    '''
+    Return the largest request body, in bytes, accepted for `topic`.
+    Limits are looked up in ``settings.WEBHOOK_MAX_BODY_SIZES`` and
+    default to ``settings.WEBHOOK_MAX_BODY_SIZE``.
+
+    :param str topic: The X-Shopify-Topic of the request.
+    '''
+    limits = getattr(settings, 'WEBHOOK_MAX_BODY_SIZES', {})
+    return limits.get(topic, settings.WEBHOOK_MAX_BODY_SIZE)
+
+
+def content_length(meta):
+    '''
+    Return the Content-Length of a request as an `int`; a missing or
+    invalid header counts as 0, as it does for Django.
+    '''
+    try:
+        return max(int(meta.get('CONTENT_LENGTH') or 0), 0)
+    except ValueError:
+        return 0
+
+
+def _new_hmac(shared_secret=None):
+    if shared_secret is None:
+        shared_secret = private_settings.SHARED_SECRET
+    if isinstance(shared_secret, str):
+        shared_secret = shared_secret.encode('utf8')
+    return hmac.new(shared_secret, digestmod=sha256)
+
+
+def compute_hmac(data, shared_secret=None):
+    '''
+    Compute the base64 encoded SHA256-HMAC of `data`, as sent by Shopify
+    in the X-Shopify-Hmac-Sha256 header.
+
+    :param bytes data: The request body.
+    :param shared_secret: The shared secret as `str` or `bytes`;
+      defaults to ``private_settings.SHARED_SECRET``.
+    :returns: the digest as a `str`.
+    '''
+    if isinstance(data, str):
+        data = data.encode('utf8')
+
+    mac = _new_hmac(shared_secret)
+    mac.update(data)
+    return base64.b64encode(mac.digest()).decode('utf8')
+
+
+def verify_hmac(data, signature, shared_secret=None):
+    '''
+    Check `signature` against the SHA256-HMAC of `data`.
+
+    :param bytes data: The request body.
+    :param str signature: The value of the X-Shopify-Hmac-Sha256
+      header.
+    :param shared_secret: See :func:`compute_hmac`.
+    :returns: a boolean value; `true` indicates a valid signature.
+    '''
+    return _safe_compare(compute_hmac(data, shared_secret), signature)
+
+
+def _safe_compare(a, b):
+    '''
+    Compare two digests in constant time with hmac.compare_digest(). The
+    values are compared as UTF-8 bytes, since compare_digest() rejects
+    `str` values with non-ASCII characters, which a forged header may
+    contain.
+    '''
+    return hmac.compare_digest(a.encode('utf8'), b.encode('utf8'))
+
+
+def verify_batch(items, secrets=None, workers=None, processes=False,
+                 chunk_size=500):
+    '''
+    Verify the signatures of many payloads in parallel, such as payloads
+    imported from elsewhere or replayed from an archive.
+
+    The items are verified in chunks of `chunk_size` by a pool of
+    threads, or of processes if `processes` is true. hashlib releases
+    the GIL while hashing more than 2 KiB, so threads suffice for large
+    bodies; processes also spread the per-item Python overhead that
+    dominates for small ones. Only ``2 * workers`` chunks are queued at
+    a time, so `items` may be a generator over millions of payloads.
+
+    :param items: An iterable of (body, signature, shop) tuples, with
+      the body as `bytes` and the X-Shopify-Hmac-Sha256 and
+      X-Shopify-Shop-Domain header values as `str`.
+    :param dict secrets: Shared secrets by shop domain; other shops use
+      ``private_settings.SHARED_SECRET``.
+    :param int workers: The pool size; defaults to the number of CPUs.
+    :returns: a dict with the number of items `verified`, the
+      `failures` as a list of (index, shop) tuples in order of index,
+      the seconds `elapsed` and the `rate` in verifications per second.
+    '''
+    workers = workers or os.cpu_count() or 1
+    secrets = secrets or {}
+    default = private_settings.SHARED_SECRET
+    executor_class = (futures.ProcessPoolExecutor if processes
+                      else futures.ThreadPoolExecutor)
+
+    start = time.perf_counter()
+    verified = 0
+    failures = []
+    pending = collections.deque()
+    items = iter(items)
+    with executor_class(workers) as executor:
+        for offset in itertools.count(0, chunk_size):
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            pending.append(executor.submit(_verify_chunk, offset, chunk,
+                                           secrets, default))
+            if len(pending) >= 2 * workers:
+                count, failed = pending.popleft().result()
+                verified += count
+                failures.extend(failed)
+        while pending:
+            count, failed = pending.popleft().result()
+            verified += count
+            failures.extend(failed)
+
+    elapsed = time.perf_counter() - start
+    return {'verified': verified, 'failures': failures, 'elapsed': elapsed,
+            'rate': verified / elapsed if elapsed else 0.0}
+
+
+def _verify_chunk(offset, chunk, secrets, default):
+    failed = []
+    for index, (body, signature, shop) in enumerate(chunk, offset):
+        if not verify_hmac(body, signature, secrets.get(shop, default)):
+            failed.append((index, shop))
+    return len(chunk), failed
 
 
 class ValidateShopifyWebhookRequest():
@@ -17,37 +208,85 @@ class ValidateShopifyWebhookRequest():
         check that the HMAC is valid.
         
         If the request is valid, then call the view with the `request`
-        and `siteid` as parameters. 
+        and `siteid` as parameters. The stages of the request are
+        traced; see :mod:`webhooks.libs.tracing`.
         '''
-        # Check that the request is using the POST method
-        if request.method != 'POST':
-            return django.http.HttpResponseNotAllowed(['POST'])
-
-        # Check that the headers exist.
-        if 'HTTP_X_SHOPIFY_SHOP_DOMAIN' not in request.META:
-            return django.http.HttpResponseBadRequest('missing X-Shopify-Shop-Domain')
-        if 'HTTP_X_REQUEST_ID' not in request.META:
-            return django.http.HttpResponseBadRequest('missing X-Request-Id')
-        if 'HTTP_X_SHOPIFY_TOPIC' not in request.META:
-            return django.http.HttpResponseBadRequest('missing X-Shopify-Topic')
-        if 'HTTP_X_SHOPIFY_HMAC_SHA256' not in request.META:
-            return django.http.HttpResponseBadRequest('missing X-Shopify-Hmac-Sha256')
-        if 'CONTENT_TYPE' not in request.META:
-            return django.http.HttpResponseBadRequest('missing Content-Type')
-        if request.META['CONTENT_TYPE'] != 'application/json':
-            return django.http.HttpResponseBadRequest('bad Content-Type')
+        trace = tracing.start(request.META)
+        if trace is None:
+            return self.handle(request, siteid, *args, **kwargs)
+        response = None
+        try:
+            response = self.handle(request, siteid, *args, **kwargs)
+            return response
+        finally:
+            tracing.finish(trace, getattr(response, 'status_code', None),
+                           getattr(request, '_body', b''))
+
+    def handle(self, request, siteid, *args, **kwargs):
+        # Check the method and headers, and refuse oversized bodies
+        # before reading them
+        with tracing.span('headers'):
+            response = check_shopify_webhook_request(request.method,
+                                                     request.META)
+            if response is None:
+                topic = request.META['HTTP_X_SHOPIFY_TOPIC']
+                if content_length(request.META) > max_body_size(topic):
+                    response = django.http.HttpResponse('Payload too large',
+                                                        status=413)
+        if response is not None:
+            return response
+        return self.dispatch(request, siteid, *args, **kwargs)
 
-        # Check that the HMAC is valid
-        if not self.validate_shopify_webhook_hmac(request):
-            return django.http.HttpResponseForbidden('Invalid HMAC')
+    def dispatch(self, request, siteid, *args, **kwargs):
+        '''
+        Admit the request, check its HMAC and call the view; the
+        method and headers have been checked by :meth:`__call__`.
+        '''
+        # Requests replayed from the spool were admitted by the ingress
+        admit = (settings.ADMISSION_ENABLED and
+                 not request.META.get(ADMITTED_ENVIRON_KEY))
+
+        # Shed load before reading the body
+        if admit:
+            response = admission.admit(request.META)
+            if response is not None:
+                return response
+        try:
+            # Check that the HMAC is valid, unless a front end did
+            if (not request.META.get(PREVALIDATED_ENVIRON_KEY) and
+                    not self.validate_shopify_webhook_hmac(request)):
+                return django.http.HttpResponseForbidden('Invalid HMAC')
+            tracing.verified()
+
+            # The checks pass; forward the request to the view
+            return self.call_view(request, siteid, *args, **kwargs)
+        finally:
+            if admit:
+                admission.release(request.META)
 
-        # The checks pass; forward the request to the view
+    def call_view(self, request, siteid, *args, **kwargs):
+        '''
+        Call the view, under the profiler if the request is to be
+        profiled; see :mod:`webhooks.libs.profiling`. Only requests
+        whose HMAC is valid get here, so forged requests cannot write
+        profiles.
+        '''
+        topic = request.META['HTTP_X_SHOPIFY_TOPIC']
+        if profiling.wanted(request.META):
+            return profiling.run(topic, self.view, request, siteid,
+                                 *args, **kwargs)
         return self.view(request, siteid, *args, **kwargs)
 
     def validate_shopify_webhook_hmac(self, request):
         '''
         Check that the necessary headers are included on the request and
         verify the SHA256-HMAC with our shared secret.
+
+        Unless the body has already been read, it is read from the input
+        stream in chunks of :data:`BODY_CHUNK_SIZE` bytes, hashed as it
+        arrives and stored in a single buffer of the declared length;
+        that buffer becomes ``request.body``, so the body is held in
+        memory only once.
         
         :param django.http.HttpRequest request: A Django request object
           that contains the headers, POST data, etc.
@@ -57,32 +296,39 @@ class ValidateShopifyWebhookRequest():
         if 'HTTP_X_SHOPIFY_HMAC_SHA256' not in request.META:
             return False
 
-        shared_secret = private_settings.SHARED_SECRET.encode('utf8')
-        digest = hmac.new(shared_secret, request.body, sha256).digest()
-        digest = base64.b64encode(digest).decode('utf8')
+        signature = request.META['HTTP_X_SHOPIFY_HMAC_SHA256']
+        if hasattr(request, '_body'):  # Already read
+            with tracing.span('hmac'):
+                return verify_hmac(request.body, signature)
 
-        return self.__safe_compare(digest, request.META['HTTP_X_SHOPIFY_HMAC_SHA256'])
+        length = content_length(request.META)
+        body = bytearray(length)
+        mac = _new_hmac()
+        received = 0
+        start = time.perf_counter()
+        reading = 0.0
+        with memoryview(body) as buf:
+            while received < length:
+                before = time.perf_counter()
+                chunk = request.read(min(BODY_CHUNK_SIZE, length - received))
+                reading += time.perf_counter() - before
+                if not chunk:
+                    break
+                buf[received:received + len(chunk)] = chunk
+                mac.update(chunk)
+                received += len(chunk)
+        if received < length:  # The client sent less than it announced
+            del body[received:]
+        request._body = body
 
-    @staticmethod
-    def __safe_compare(a, b):
-        '''
-        Attempt to use hmac.compare_digest(), which is available in
-        Python 3.3+. If that fails, iterate over the entire digest to
-        detect a difference; only return after iterating over the
-        entire digest to avoid a timing attack.
-        '''
-        # TODO: implement the manual comparison in a low-level language
-        #   Python might optimize the comparison loop
-        try:
-            return hmac.safe_compare(a, b)
-        except AttributeError:
-            if len(a) != len(b):
-                return False
-
-            result = True
-            count = 0  # Hack to prevent optimization
-            for i in range(0, len(a)):
-                if a[i] != b[i]:
-                    result = False
-                count += 1
-            return result
+        digest = base64.b64encode(mac.digest()).decode('utf8')
+        valid = _safe_compare(digest, signature)
+
+        # Reading and hashing interleave; each is traced as one span of
+        # its total time.
+        trace = tracing.current()
+        if trace is not None:
+            end = time.perf_counter()
+            trace.record('body_read', start, start + reading)
+            trace.record('hmac', start + reading, end)
+        return valid
@@ -0,0 +1,27 @@
+'''
+Background work of the processes serving webhooks.
+
+The WSGI and ASGI entry points call :func:`start` once the application
+is loaded. Servers that load the application before forking their
+workers (such as gunicorn with ``preload_app``) should call it from
+their post-fork hook instead, since threads do not survive a fork, and
+may call :func:`stop` from their worker exit hook.
+'''
+from webhooks.libs import abandonment, writebehind
+
+
+def start():
+    '''
+    Prepare this process to serve webhooks: rebuild the abandoned
+    checkout timers and start their ticker, and make SIGTERM run the
+    exit handlers that flush the write-behind buffers.
+    '''
+    abandonment.scheduler.start()
+    writebehind.exit_on_signals()
+
+
+def stop():
+    '''
+    Flush the write-behind buffers before the process exits.
+    '''
+    writebehind.flush_all()
@@ -0,0 +1,307 @@
+'''
+A write-behind buffer that coalesces frequent updates of the same row.
+
+Cart and checkout webhooks fire on every change, often many times a
+minute for the same cart. :class:`WriteBehindBuffer` keeps only the
+latest state per key in memory and writes everything it holds to the
+database in bulk: every ``settings.WRITE_BEHIND_FLUSH_INTERVAL``
+seconds, whenever it grows to ``settings.WRITE_BEHIND_MAX_SIZE`` keys,
+and when the process exits.
+
+Several processes may hold states of the same row. A buffer given a
+`version` field, such as ``updated_at``, locks the rows it writes and
+leaves alone those holding a newer state than its own; a row another
+process inserted first is updated instead.
+
+Updates acknowledged to Shopify but not yet flushed are lost if the
+process is killed without a chance to run its exit handlers. SIGTERM
+skips them unless it is handled, so :func:`exit_on_signals` makes it
+exit the process normally where nothing else handles it; servers that
+handle it themselves and exit by other means can call
+:func:`flush_all` from their worker exit hook.
+
+A batch that fails to write is retried row by row. Rows the database
+rejects, such as a value too long for its column, are logged and moved
+to the bounded :attr:`WriteBehindBuffer.dead_letters`; the others are
+kept for the next flush. While the database is unavailable the buffer
+stops at ``settings.WRITE_BEHIND_MAX_SIZE`` keys and refuses updates of
+new keys, which the views answer with 503 so that Shopify sends them
+again later.
+'''
+import atexit
+import collections
+import logging
+import signal
+import sys
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+
+from webhooks.libs import bulk, metrics
+
+
+logger = logging.getLogger(__name__)
+
+#: Marks a key whose row is to be deleted.
+DELETED = object()
+
+#: The signals that stop a process without running its exit handlers,
+#: unless they are handled.
+SHUTDOWN_SIGNALS = (signal.SIGTERM,)
+
+#: Every buffer of this process; see :func:`flush_all`.
+_buffers = weakref.WeakSet()
+
+
+class WriteBehindBuffer():
+    '''
+    :param model: The model class of the buffered rows.
+    :param str key: The name of the unique field identifying a row.
+    :param fields: The names of the fields written when a row already
+      exists.
+    :param str name: The name used in metrics; defaults to the model
+      name.
+    :param str version: The name of a field that orders the states of a
+      row, such as ``updated_at``. A state older than the row in the
+      database is not written.
+    '''
+    def __init__(self, model, key, fields, name=None, version=None):
+        self.model = model
+        self.key = key
+        self.fields = list(fields)
+        self.name = name or model._meta.model_name
+        self.version = version
+
+        self._pending = collections.OrderedDict()
+        #: The latest (key, state) pairs the database rejected
+        self.dead_letters = collections.deque(
+            maxlen=settings.WRITE_BEHIND_MAX_SIZE)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._started = False
+        self.received = 0
+        self.written = 0
+        _buffers.add(self)
+
+    def put(self, instance):
+        '''
+        Buffer the latest state of a row, replacing any state buffered
+        earlier for the same key.
+
+        :param instance: An unsaved model instance holding every field
+          in `fields`.
+        :returns: whether the state was buffered; see :meth:`delete`.
+        '''
+        return self._put(getattr(instance, self.key), instance)
+
+    def delete(self, key):
+        '''
+        Buffer the deletion of the row with the given key.
+
+        :returns: whether the deletion was buffered. It is not when the
+          buffer is full of rows that could not be written, and the key
+          is not already buffered.
+        '''
+        return self._put(key, DELETED)
+
+    def _put(self, key, value):
+        self._start()
+        limit = settings.WRITE_BEHIND_MAX_SIZE
+        with self._lock:
+            if key not in self._pending and len(self._pending) >= limit:
+                metrics.incr('writebehind.shed', self.name)
+                return False
+            self._pending.pop(key, None)
+            self._pending[key] = value
+            self.received += 1
+            full = len(self._pending) >= limit
+        metrics.incr('writebehind.received', self.name)
+
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                # The update is buffered; the next flush retries it.
+                logger.exception('Flushing the %s write-behind buffer failed',
+                                 self.name)
+        return True
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        '''
+        Write every buffered row to the database. If the write fails,
+        the rows are written one at a time: those the database rejects
+        are dead-lettered, and if another error stops the rows, the
+        remaining ones are put back unless a newer state has been
+        buffered in the meantime, and the error is raised.
+        '''
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, collections.OrderedDict()
+            if not batch:
+                return
+
+            try:
+                self._write(batch)
+            except Exception:
+                logger.warning('Writing %d %s rows failed; retrying them one '
+                               'at a time', len(batch), self.name,
+                               exc_info=True)
+                self._write_rows(batch)
+            else:
+                self._written(len(batch))
+
+    def _write_rows(self, batch):
+        items = list(batch.items())
+        for index, (key, value) in enumerate(items):
+            try:
+                try:
+                    self._write({key: value})
+                except IntegrityError:
+                    # Most likely inserted by another process since the
+                    # lookup, in which case it is now updated instead
+                    self._write({key: value})
+            except (DataError, IntegrityError):
+                logger.exception('Dropping the %s row %r', self.name, key)
+                self.dead_letters.append((key, value))
+                metrics.incr('writebehind.dead', self.name)
+            except Exception:
+                with self._lock:
+                    for key, value in items[index:]:
+                        if key not in self._pending:
+                            self._pending[key] = value
+                raise
+            else:
+                self._written(1)
+
+    def _written(self, count):
+        self.written += count
+        metrics.incr('writebehind.written', self.name, amount=count)
+
+    def _write(self, batch):
+        deleted = [key for key, value in batch.items() if value is DELETED]
+        instances = [value for value in batch.values() if value is not DELETED]
+        manager = self.model._default_manager
+
+        with transaction.atomic():
+            if instances:
+                stored = self._lock_rows([getattr(obj, self.key)
+                                          for obj in instances])
+                created = [obj for obj in instances
+                           if getattr(obj, self.key) not in stored]
+                updated = [obj for obj in instances
+                           if getattr(obj, self.key) in stored and
+                           self._is_current(obj, stored[getattr(obj,
+                                                                self.key)])]
+                stale = len(instances) - len(created) - len(updated)
+                if stale:
+                    metrics.incr('writebehind.stale', self.name,
+                                 amount=stale)
+                if created:
+                    manager.bulk_create(created)
+                bulk.bulk_update(self.model, updated, self.fields, self.key)
+            for keys in bulk.batches(self.model, self.key, deleted):
+                manager.filter(**{self.key + '__in': keys}).delete()
+
+    def _lock_rows(self, keys):
+        '''
+        Lock the rows with the given keys until the end of the
+        transaction.
+
+        :returns: a dict mapping the key of each row found to its
+          version, or to ``None`` if the buffer has no `version` field.
+        '''
+        manager = self.model._default_manager.select_for_update()
+        fields = [self.key] + ([self.version] if self.version else [])
+        stored = {}
+        for batch in bulk.batches(self.model, self.key, keys):
+            for row in (manager.filter(**{self.key + '__in': batch})
+                        .values_list(*fields)):
+                stored[row[0]] = row[1] if self.version else None
+        return stored
+
+    def _is_current(self, instance, stored):
+        '''
+        Return whether the state `instance` is at least as recent as the
+        row whose version is `stored`.
+        '''
+        if stored is None:
+            return True
+        version = getattr(instance, self.version)
+        return version is None or version >= stored
+
+    def coalescing_ratio(self):
+        '''
+        Return the number of updates received per row written, or
+        ``None`` before the first flush.
+        '''
+        if not self.written:
+            return None
+        return self.received / self.written
+
+    def _start(self):
+        '''
+        On first use, make sure the buffer is flushed when the process
+        exits and start the periodic flush, unless
+        ``settings.WRITE_BEHIND_FLUSH_INTERVAL`` is 0.
+        '''
+        if self._started:
+            return
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        atexit.register(self.flush)
+        interval = settings.WRITE_BEHIND_FLUSH_INTERVAL
+        if interval:
+            thread = threading.Thread(target=self._run, args=(interval,),
+                                      name='writebehind-%s' % self.name)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing the %s write-behind buffer failed',
+                                 self.name)
+                connection.close()
+
+
+def flush_all():
+    '''
+    Flush every buffer of this process, logging failures; for use in the
+    worker exit hook of a server.
+    '''
+    for buffer in list(_buffers):
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception('Flushing the %s write-behind buffer failed',
+                             buffer.name)
+
+
+def exit_on_signals():
+    '''
+    Make the :data:`SHUTDOWN_SIGNALS` that nothing handles yet exit the
+    process normally, so that the buffers are flushed by their exit
+    handlers. Signal handlers can only be set from the main thread;
+    elsewhere this does nothing.
+    '''
+    if threading.current_thread() is not threading.main_thread():
+        return
+    for signum in SHUTDOWN_SIGNALS:
+        if signal.getsignal(signum) == signal.SIG_DFL:
+            signal.signal(signum, _exit)
+
+
+def _exit(signum, frame):
+    sys.exit(128 + signum)
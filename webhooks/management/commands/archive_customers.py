@@ -0,0 +1,34 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webhooks.libs import archive
+
+
+class Command(BaseCommand):
+    help = ('Move customers not updated for a long time, with their tags '
+            'and addresses, into the customer archive, in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=730,
+                            help='Archive customers last updated more '
+                            'than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.5,
+                            help='Seconds to sleep between batches, to let '
+                            'other writers take the locks.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(
+            days=options['older_than'])
+        total = 0
+        while True:
+            archived = archive.archive_batch(cutoff, options['batch_size'])
+            if not archived:
+                break
+            total += archived
+            self.stdout.write('%d customers archived' % total)
+            time.sleep(options['pause'])
+        self.stdout.write('Done, %d customers archived' % total)
@@ -0,0 +1,31 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webhooks.libs import changelog
+
+
+class Command(BaseCommand):
+    help = ('Fold the changelog records older than a cutoff into one '
+            'record per entity.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=24,
+                            help='Compact the records created more than '
+                            'this many hours ago.')
+        parser.add_argument('--upto', type=int, default=None,
+                            help='Compact the records up to this offset '
+                            'instead.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Entities compacted per transaction.')
+
+    def handle(self, *args, **options):
+        upto = options['upto']
+        if upto is None:
+            upto = changelog.offset_before(
+                timezone.now() - datetime.timedelta(
+                    hours=options['older_than']))
+        removed = changelog.compact(upto, options['batch_size'])
+        self.stdout.write('%d records removed up to offset %d' %
+                          (removed, upto))
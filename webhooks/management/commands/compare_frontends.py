@@ -0,0 +1,225 @@
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand, CommandError
+import django.http
+from django.test.utils import override_settings
+
+from webhooks.libs import loadgen, validate
+from webhooks.libs.asgi import WebhookASGIHandler
+
+
+PATH = '/webhooks/shopify/bench/customer_create'
+TOPIC = 'customers/create'
+
+
+def make_application(view_time):
+    '''
+    Return a WSGI application serving a webhook view that only waits for
+    `view_time` seconds, standing for its database work, behind the
+    regular validation decorator.
+    '''
+    @validate.ValidateShopifyWebhookRequest
+    def view(request, siteid):
+        time.sleep(view_time)
+        return django.http.HttpResponse()
+
+    def application(environ, start_response):
+        response = view(WSGIRequest(environ), 'bench')
+        start_response('%d %s' % (response.status_code,
+                                  response.reason_phrase),
+                       list(response.items()))
+        return [response.content]
+    return application
+
+
+def make_requests(count, invalid):
+    '''
+    Return `count` (body, headers) pairs of customers/create webhooks,
+    of which the fraction `invalid` carry a wrong HMAC.
+    '''
+    requests = []
+    for index in range(count):
+        body = json.dumps({
+            'id': index + 1, 'email': 'customer%d@example.com' % index,
+            'created_at': '2015-05-27T19:12:18+01:00',
+            'updated_at': '2015-05-27T19:12:19+01:00',
+            'first_name': 'Bob', 'last_name': 'Norman', 'note': 'x' * 512,
+        }).encode('utf8')
+        signature = validate.compute_hmac(body)
+        if index < count * invalid:
+            signature = validate.compute_hmac(body + b'forged')
+        headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode('latin1')),
+                   (b'x-shopify-shop-domain', b'example.myshopify.com'),
+                   (b'x-request-id', str(index).encode('latin1')),
+                   (b'x-shopify-topic', TOPIC.encode('latin1')),
+                   (b'x-shopify-hmac-sha256', signature.encode('latin1'))]
+        requests.append((body, headers))
+    return requests
+
+
+def run_wsgi(application, requests, concurrency, body_delay):
+    '''
+    Serve the requests like a threaded WSGI server with a thread per
+    connection: each thread is held while the body arrives.
+    '''
+    scope = {'type': 'http', 'method': 'POST', 'path': PATH}
+    latencies = []
+    statuses = []
+    threads = [threading.active_count()]
+
+    def serve(request):
+        body, headers = request
+        started = time.perf_counter()
+        threads.append(threading.active_count())
+        time.sleep(body_delay)
+        environ = WebhookASGIHandler.build_environ(
+            dict(scope, headers=headers), body)
+        status = []
+        content = application(
+            environ, lambda line, headers: status.append(line))
+        b''.join(content)
+        statuses.append(int(status[0].split(' ', 1)[0]))
+        latencies.append(time.perf_counter() - started)
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(serve, requests))
+    return latencies, statuses, max(threads)
+
+
+def run_asgi(application, requests, concurrency, body_delay, workers):
+    '''
+    Serve the requests through :class:`WebhookASGIHandler`, with
+    `concurrency` clients sending their bodies after `body_delay`
+    seconds.
+    '''
+    handler = WebhookASGIHandler(application, max_workers=workers)
+    pending = iter(requests)
+    latencies = []
+    statuses = []
+    threads = [threading.active_count()]
+
+    async def client():
+        for body, headers in pending:
+            scope = {'type': 'http', 'method': 'POST', 'path': PATH,
+                     'headers': headers}
+            started = time.perf_counter()
+
+            async def receive():
+                await asyncio.sleep(body_delay)
+                return {'type': 'http.request', 'body': body}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+
+            await handler(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+            threads.append(threading.active_count())
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asyncio.gather(
+            *[client() for i in range(concurrency)], loop=loop))
+    finally:
+        loop.close()
+        handler.executor.shutdown(wait=True)
+    return latencies, statuses, max(threads)
+
+
+def measure(options):
+    '''
+    Run one front end and summarise it; run in a child process so that
+    the peak memory of each front end is measured separately.
+    '''
+    settings = {'ADMISSION_ENABLED': False, 'TRACE_ENABLED': False,
+                'PROFILE_SAMPLE_RATE': 0}
+    with override_settings(**settings):
+        application = make_application(options['view_time'])
+        requests = make_requests(options['requests'], options['invalid'])
+        tracemalloc.start()
+        started = time.perf_counter()
+        if options['frontend'] == 'wsgi':
+            latencies, statuses, threads = run_wsgi(
+                application, requests, options['concurrency'],
+                options['body_delay'])
+        else:
+            latencies, statuses, threads = run_asgi(
+                application, requests, options['concurrency'],
+                options['body_delay'], options['workers'])
+        elapsed = time.perf_counter() - started
+        traced = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'frontend': options['frontend'],
+        'rate': len(latencies) / elapsed,
+        'p50': loadgen.percentile(latencies, 0.50),
+        'p99': loadgen.percentile(latencies, 0.99),
+        'threads': threads,
+        'traced': traced,
+        'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'statuses': dict((status, statuses.count(status))
+                         for status in set(statuses)),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Compare the WSGI and ASGI front ends on the same webhook view '
+            'with slow clients: throughput, latency, threads and memory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Clients sending requests at once; the '
+                                 'WSGI front end holds a thread for each.')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Threads running Django behind the ASGI '
+                                 'front end.')
+        parser.add_argument('--body-delay', type=float, default=0.05,
+                            help='Seconds each client takes to send its '
+                                 'body.')
+        parser.add_argument('--view-time', type=float, default=0.002,
+                            help='Seconds each valid request spends in the '
+                                 'view.')
+        parser.add_argument('--invalid', type=float, default=0.2,
+                            help='The fraction of requests with a wrong '
+                                 'HMAC.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or \
+                options['workers'] < 1:
+            raise CommandError('--requests, --concurrency and --workers must '
+                               'be positive')
+
+        self.stdout.write('%-5s %9s %8s %8s %8s %11s %11s  %s' % (
+            'front', 'req/s', 'p50 ms', 'p99 ms', 'threads', 'traced MB',
+            'max RSS MB', 'status codes'))
+        context = multiprocessing.get_context('fork')
+        for frontend in ('wsgi', 'asgi'):
+            with context.Pool(1) as pool:
+                result = pool.apply(measure, (dict(options,
+                                                   frontend=frontend),))
+            self.stdout.write('%-5s %9.0f %8.1f %8.1f %8d %11.1f %11.1f  %s' % (
+                result['frontend'], result['rate'], result['p50'] * 1000,
+                result['p99'] * 1000, result['threads'],
+                result['traced'] / 2 ** 20, maxrss_mb(result['maxrss']),
+                ', '.join('%s x %d' % item
+                          for item in sorted(result['statuses'].items()))))
+
+
+def maxrss_mb(value):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return value / 2 ** 20
+    return value / 2 ** 10
@@ -0,0 +1,86 @@
+import os
+import time
+
+from django.conf import settings
+from django.core import urlresolvers
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand
+from django import db
+
+from webhooks.libs import ingress, spool
+
+
+class Command(BaseCommand):
+    help = ('Process the webhooks spooled by serve_ingress through the '
+            'webhook views. Several consumers may share one spool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--spool-dir', default=settings.INGRESS_SPOOL_DIR)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no sealed segments are left.')
+        parser.add_argument('--poll-interval', type=float, default=0.5)
+        parser.add_argument('--recover', action='store_true',
+                            help='Release segments claimed by consumers that '
+                                 'died. Only use when no consumer is running.')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Retry the records of the dead-letter '
+                                 'segments.')
+
+    def handle(self, *args, **options):
+        directory = options['spool_dir']
+        os.makedirs(directory, exist_ok=True)
+        if options['recover']:
+            spool.release_claims(directory)
+        if options['requeue_dead']:
+            spool.requeue_dead(directory)
+
+        while True:
+            path = spool.claim_segment(directory)
+            if path is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            db.close_old_connections()
+            processed = 0
+            failed = []
+            for metadata, body in spool.read_segment(path):
+                if self.replay(metadata, body):
+                    processed += 1
+                else:
+                    failed.append((metadata, body))
+            # The webhooks were acknowledged when spooled; keep the
+            # failed ones rather than lose them.
+            if failed:
+                dead = spool.dead_letter(path, failed)
+            os.remove(path)
+
+            if options['verbosity'] > 1 or failed:
+                self.stdout.write('%s: %d processed, %d failed' %
+                                  (os.path.basename(path), processed,
+                                   len(failed)))
+            if failed:
+                self.stdout.write('Failed records kept in %s' % dead)
+
+    def replay(self, metadata, body):
+        '''
+        Run one spooled request through its view.
+
+        :returns: `True` if the view returned a successful response.
+        '''
+        request = WSGIRequest(ingress.build_environ(metadata, body))
+        try:
+            match = urlresolvers.resolve(metadata['path'])
+            response = match.func(request, *match.args, **match.kwargs)
+        except Exception as e:
+            self.stderr.write('%s %s: %r' % (
+                metadata['meta'].get('HTTP_X_REQUEST_ID'), metadata['path'], e))
+            return False
+
+        if response.status_code >= 300:
+            self.stderr.write('%s %s: HTTP %d' % (
+                metadata['meta'].get('HTTP_X_REQUEST_ID'), metadata['path'],
+                response.status_code))
+            return False
+        return True
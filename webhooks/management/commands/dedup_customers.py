@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from webhooks.libs import bulk, cache
+from webhooks.models import Customer
+
+
+class Command(BaseCommand):
+    help = ('Link customers sharing a normalised email address to the '
+            'oldest of them, their canonical customer.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the clusters without writing.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        changes = find_changes(Customer.objects.all())
+
+        if not options['dry_run']:
+            with transaction.atomic():
+                for start in range(0, len(changes), batch_size):
+                    bulk.bulk_update(Customer, changes[start:start + batch_size],
+                                     ['canonical'], key='id')
+            # bulk_update() bypasses the signals that update the cache.
+            for customer in changes:
+                cache.invalidate(Customer, customer.shopify_id)
+
+        duplicates = Customer.objects.filter(canonical__isnull=False)
+        self.stdout.write('%d customers relinked, %d duplicates in total' %
+                          (len(changes), duplicates.count()))
+
+
+def find_changes(customers):
+    '''
+    Cluster `customers` by email hash in one pass over the table: the
+    first customer seen with a hash, in order of ID, is the canonical
+    one and every later one is linked to it. Memory grows with the
+    number of distinct addresses, not with the number of pairs.
+
+    :returns: unsaved :class:`Customer` instances holding only the IDs
+      and the new canonical ID of the customers whose link changes.
+    '''
+    canonical_ids = {}
+    changes = []
+    rows = (customers.exclude(email_hash='').order_by('id')
+            .values_list('id', 'shopify_id', 'email_hash', 'canonical_id'))
+    for pk, shopify_id, email_hash, current in rows.iterator():
+        canonical_id = canonical_ids.setdefault(email_hash, pk)
+        if canonical_id == pk:
+            canonical_id = None
+        if canonical_id != current:
+            changes.append(Customer(id=pk, shopify_id=shopify_id,
+                                    canonical_id=canonical_id))
+    return changes
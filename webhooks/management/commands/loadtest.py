@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webhooks.libs import loadgen
+
+
+class Command(BaseCommand):
+    help = ('Post signed Shopify webhooks to a running server and report '
+            'throughput, latency percentiles and error codes. With several '
+            '--rates, step through them and report where the server '
+            'saturates.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/',
+                            help='The base URL of the server.')
+        parser.add_argument('--siteid', default='loadtest')
+        parser.add_argument('--mix', default=loadgen.DEFAULT_MIX,
+                            help='Topics and their weights, e.g. '
+                                 '"customers/update=3,carts/update=1". '
+                                 'Topics: %s.' % ', '.join(sorted(loadgen.TOPICS)))
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='The number of worker processes.')
+        parser.add_argument('--connections', type=int, default=4,
+                            help='Keep-alive connections per worker.')
+        parser.add_argument('--rates', default='0',
+                            help='Comma-separated target rates in requests '
+                                 'per second, run in turn; 0 posts as fast as '
+                                 'the server answers.')
+        parser.add_argument('--open-loop', action='store_true',
+                            help='Send at Poisson arrival times regardless '
+                                 'of responses, measuring latency from when '
+                                 'each request was due.')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds per rate.')
+        parser.add_argument('--keyspace', type=int, default=10000,
+                            help='The number of distinct Shopify IDs used.')
+        parser.add_argument('--max-p99', type=float, default=500,
+                            help='The p99 latency in milliseconds above which '
+                                 'the server counts as saturated.')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadgen.parse_mix(options['mix'])
+            rates = [float(rate) for rate in options['rates'].split(',')]
+        except ValueError as e:
+            raise CommandError(e)
+        workers = options['workers']
+        if workers < 1 or options['connections'] < 1:
+            raise CommandError('--workers and --connections must be positive')
+
+        self.stdout.write('%10s %10s %9s %9s %9s %8s  %s' % (
+            'target', 'achieved', 'p50 ms', 'p95 ms', 'p99 ms', 'errors',
+            'status codes'))
+        saturation = None
+        with multiprocessing.Pool(workers) as pool:
+            for rate in rates:
+                jobs = [{'url': options['url'], 'siteid': options['siteid'],
+                         'mix': mix, 'rate': rate / workers,
+                         'open_loop': options['open_loop'],
+                         'duration': options['duration'],
+                         'keyspace': options['keyspace'],
+                         'connections': options['connections'],
+                         'seed_base': index * options['connections']}
+                        for index in range(workers)]
+                result = loadgen.merge(pool.map(loadgen.run_worker, jobs))
+                summary = loadgen.summarise(result, options['duration'], rate)
+                self.report(summary)
+                for (topic, status), count in sorted(result['failures'].items()):
+                    self.stdout.write('    %s: %d x %s' % (topic, count,
+                                                           status or 'failed'))
+
+                if saturation is None and loadgen.saturated(
+                        summary, options['max_p99'] / 1000):
+                    saturation = summary
+                    if len(rates) > 1:
+                        break
+
+        if saturation is None:
+            self.stdout.write('No saturation observed.')
+        else:
+            self.stdout.write('Saturated at a target of %s: %.1f req/s achieved '
+                              '(p99 %s, %.1f%% errors).' % (
+                                  '%g req/s' % saturation['target']
+                                  if saturation['target'] else 'full speed',
+                                  saturation['throughput'],
+                                  self.ms(saturation['p99']),
+                                  saturation['error_rate'] * 100))
+
+    def report(self, summary):
+        self.stdout.write('%10s %10.1f %9s %9s %9s %7.1f%%  %s' % (
+            '%g' % summary['target'] if summary['target'] else 'max',
+            summary['throughput'], self.ms(summary['p50']),
+            self.ms(summary['p95']), self.ms(summary['p99']),
+            summary['error_rate'] * 100,
+            ' '.join('%s:%d' % item for item in sorted(summary['statuses'].items()))))
+
+    def ms(self, seconds):
+        return '-' if seconds is None else '%.1f' % (seconds * 1000)
@@ -0,0 +1,48 @@
+import io
+import os
+import pstats
+
+from django.core.management.base import BaseCommand
+
+from webhooks.libs import profiling
+
+
+class Command(BaseCommand):
+    help = ('Merge the profiles of the webhook requests and print the top '
+            'hotspots of each topic.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Directory of the profiles; defaults to '
+                            'settings.PROFILE_DIR.')
+        parser.add_argument('--topic', action='append', default=[],
+                            help='Only report on this topic, such as '
+                            'customers/create; may be repeated.')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Functions listed per topic.')
+        parser.add_argument('--sort', default='cumulative',
+                            help='pstats sort key, such as tottime.')
+        parser.add_argument('--delete', action='store_true',
+                            help='Delete the profiles once reported.')
+
+    def handle(self, *args, **options):
+        topics = set(os.path.basename(profiling.topic_directory(topic))
+                     for topic in options['topic'])
+        found = profiling.profiles(options['dir'])
+        if not found:
+            self.stdout.write('No profiles found')
+            return
+
+        for topic, files in sorted(found.items()):
+            if topics and topic not in topics:
+                continue
+            out = io.StringIO()
+            stats = pstats.Stats(*files, stream=out)
+            stats.files = []  # Not one header line per profile
+            stats.strip_dirs().sort_stats(options['sort'])
+            stats.print_stats(options['limit'])
+            self.stdout.write('=== %s: %d profiles ===' % (topic, len(files)))
+            self.stdout.write(out.getvalue(), ending='')
+            if options['delete']:
+                for path in files:
+                    os.remove(path)
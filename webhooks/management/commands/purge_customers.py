@@ -0,0 +1,66 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from webhooks.libs import cache, redaction
+from webhooks.models import Customer
+
+
+class Command(BaseCommand):
+    help = ('Remove customers deleted in Shopify, with their tag and '
+            'address links and their addresses, in batches.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.5,
+                            help='Seconds to sleep between batches, to let '
+                            'other writers take the locks.')
+        parser.add_argument('--older-than', type=float, default=0,
+                            help='Only remove customers deleted at least '
+                            'this many seconds ago.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(
+            seconds=options['older_than'])
+        total = 0
+        while True:
+            purged = purge_batch(cutoff, options['batch_size'])
+            if not purged:
+                break
+            total += purged
+            self.stdout.write('%d customers purged' % total)
+            time.sleep(options['pause'])
+        self.stdout.write('Done, %d customers purged' % total)
+
+
+def purge_batch(deleted_before, batch_size):
+    '''
+    Remove up to `batch_size` customers deleted before `deleted_before`,
+    in one transaction of a few set-based statements: one per link
+    table, one to unlink their duplicates, one for the addresses no
+    other customer uses, and one for the customers.
+
+    :returns: the number of customers removed.
+    '''
+    ids = list(Customer.all_objects
+               .filter(deleted_at__lte=deleted_before)
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+
+    with transaction.atomic():
+        redaction.delete_links(ids)
+        duplicates = Customer.all_objects.filter(canonical_id__in=ids)
+        unlinked = list(duplicates.values_list('shopify_id', flat=True))
+        duplicates.update(canonical=None)
+        # The links are gone, so nothing cascades; skip the collector,
+        # which would load every customer.
+        customers = Customer.all_objects.filter(id__in=ids)
+        customers._raw_delete(customers.db)
+    # update() bypasses the signals that update the cache.
+    for shopify_id in unlinked:
+        cache.invalidate(Customer, shopify_id)
+    return len(ids)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from webhooks.libs import lifetime
+
+
+class Command(BaseCommand):
+    help = ('Check the refunded totals of the orders and the lifetime '
+            'values of the customers against their refunds and orders, '
+            'and optionally correct them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Orders or customers checked at a '
+                            'time.')
+        parser.add_argument('--fix', action='store_true',
+                            help='Overwrite the values that differ with '
+                            'the recomputed ones.')
+
+    def handle(self, *args, **options):
+        # The order totals first: orders/cancelled takes them back out
+        # of the lifetime values.
+        mismatched = 0
+        for order, actual, expected in lifetime.refund_totals(
+                options['batch_size']):
+            mismatched += 1
+            self.stdout.write('order %d: total_refunded %s != %s' % (
+                order, actual, expected))
+            if options['fix']:
+                lifetime.fix_refund_total(order)
+        self.stdout.write('%d order totals %s' % (
+            mismatched, 'fixed' if options['fix'] else 'differ'))
+
+        mismatched = 0
+        for customer, differences in lifetime.reconcile(
+                options['batch_size']):
+            mismatched += 1
+            self.stdout.write('customer %d: %s' % (customer, ', '.join(
+                '%s %s != %s' % (name, actual, expected)
+                for name, expected, actual in differences)))
+            if options['fix']:
+                lifetime.fix(customer)
+        self.stdout.write('%d lifetime values %s' % (
+            mismatched, 'fixed' if options['fix'] else 'differ'))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webhooks.libs import redaction
+
+
+class Command(BaseCommand):
+    help = ('Carry out the queued customers/redact and shop/redact '
+            'requests in chunks of customers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to sleep between chunks, to let '
+                            'other writers take the locks.')
+
+    def handle(self, *args, **options):
+        for job in redaction.pending():
+            total, finished = 0, False
+            while not finished:
+                redacted, finished = redaction.redact_chunk(
+                    job.pk, options['chunk_size'])
+                total += redacted
+                if not finished:
+                    time.sleep(options['pause'])
+            self.stdout.write('%s: %d customers redacted' % (job, total))
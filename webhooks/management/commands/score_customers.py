@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webhooks.libs import scoring
+
+
+class Command(BaseCommand):
+    help = ('Compute the recency, frequency and monetary scores of the '
+            'customers changed since the last run, or of all customers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute the breakpoints and score every '
+                            'customer.')
+        parser.add_argument('--bins', type=int, default=5,
+                            help='Groups per score in a full run, from 2 '
+                            'to 9.')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Customers loaded and written at a time.')
+        parser.add_argument('--overlap', type=float, default=24,
+                            help='Also rescore customers updated this many '
+                            'hours before the last run started.')
+
+    def handle(self, *args, **options):
+        if scoring.numpy is None:
+            raise CommandError('Scoring customers requires NumPy')
+        if not 2 <= options['bins'] <= 9:
+            raise CommandError('--bins must be between 2 and 9')
+
+        scoring_run = scoring.run(
+            full=options['full'], bins=options['bins'],
+            chunk_size=options['chunk_size'],
+            overlap=datetime.timedelta(hours=options['overlap']))
+        elapsed = (scoring_run.finished_at -
+                   scoring_run.started_at).total_seconds()
+        self.stdout.write('%s run: %d customers scored in %.1fs' % (
+            'Full' if scoring_run.full else 'Incremental',
+            scoring_run.scored, elapsed))
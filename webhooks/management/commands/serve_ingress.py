@@ -0,0 +1,45 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from webhooks.libs import ingress, spool
+
+
+class Command(BaseCommand):
+    help = ('Run a lightweight HTTP server that validates Shopify webhooks '
+            'and appends them to the spool for consume_spool.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--spool-dir', default=settings.INGRESS_SPOOL_DIR)
+
+    def handle(self, *args, **options):
+        writer = spool.SpoolWriter(
+            options['spool_dir'], settings.INGRESS_SPOOL_MAX_BYTES,
+            segment_bytes=settings.INGRESS_SPOOL_SEGMENT_BYTES,
+            segment_age=settings.INGRESS_SPOOL_SEGMENT_AGE)
+        server = ingress.IngressServer(writer)
+
+        loop = asyncio.get_event_loop()
+        listener = loop.run_until_complete(asyncio.start_server(
+            server.handle_connection, options['host'], options['port'],
+            backlog=1024))
+        syncer = loop.create_task(
+            server.sync_periodically(settings.INGRESS_SPOOL_SEGMENT_AGE))
+
+        self.stdout.write('Accepting webhooks on http://%s:%d/ into %s' %
+                          (options['host'], options['port'],
+                           options['spool_dir']))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            syncer.cancel()
+            listener.close()
+            loop.run_until_complete(listener.wait_closed())
+            writer.close()
+            self.stdout.write('accepted %d, rejected %d, shed %d' %
+                              (server.accepted, server.rejected, server.shed))
@@ -0,0 +1,41 @@
+import json
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webhooks.libs import tracing
+from webhooks.models import SlowEvent
+
+
+class Command(BaseCommand):
+    help = ('Print the stored slow webhook events as a JSON array of '
+            'Zipkin v2 spans, or post them to a collector.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', help='Only export this topic.')
+        parser.add_argument('--limit', type=int, default=100,
+                            help='Export the latest events, up to this many.')
+        parser.add_argument('--post', metavar='URL',
+                            help='Post the spans to this collector, such as '
+                            'http://localhost:9411/api/v2/spans.')
+
+    def handle(self, *args, **options):
+        events = SlowEvent.objects.order_by('-id')
+        if options['topic']:
+            events = events.filter(topic=options['topic'])
+        spans = []
+        for event in reversed(events[:options['limit']]):
+            spans.extend(tracing.Trace.from_event(event).zipkin())
+        body = json.dumps(spans)
+
+        if not options['post']:
+            self.stdout.write(body)
+            return
+        request = urllib.request.Request(
+            options['post'], data=body.encode('utf8'),
+            headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(request, timeout=30).close()
+        except OSError as e:
+            raise CommandError('Posting the spans failed: %s' % e)
+        self.stdout.write('%d spans posted' % len(spans))
@@ -0,0 +1,59 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from webhooks.libs import changelog
+
+
+class Command(BaseCommand):
+    help = ('Write the changelog records as JSON lines, starting after an '
+            'offset, optionally following new records.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--after', type=int, default=None,
+                            help='Start after this offset; by default after '
+                            'the one in --cursor-file, or from the start.')
+        parser.add_argument('--cursor-file',
+                            help='Read the offset to start after from this '
+                            'file, and store the offset of each record '
+                            'written in it.')
+        parser.add_argument('--follow', action='store_true',
+                            help='Wait for new records instead of exiting '
+                            'at the end of the log.')
+
+    def handle(self, *args, **options):
+        cursor_file = options['cursor_file']
+        after = options['after']
+        if after is None:
+            after = read_cursor(cursor_file) if cursor_file else 0
+
+        timeout = settings.CHANGELOG_MAX_WAIT if options['follow'] else 0
+        while True:
+            records = changelog.read(after, timeout=timeout)
+            if not records and not options['follow']:
+                break
+            for record in records:
+                self.stdout.write(json.dumps(changelog.as_dict(record),
+                                             sort_keys=True))
+            self.stdout.flush()
+            if records:
+                after = records[-1].id
+                if cursor_file:
+                    write_cursor(cursor_file, after)
+
+
+def read_cursor(path):
+    try:
+        with open(path) as cursor:
+            return int(cursor.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_cursor(path, offset):
+    # Replace the file atomically, so that it always holds an offset.
+    with open(path + '.tmp', 'w') as cursor:
+        cursor.write('%d\n' % offset)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,85 @@
+import base64
+import bisect
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webhooks.libs import spool, validate
+
+
+SPOOL_SUFFIXES = (spool.OPEN_SUFFIX, spool.SEALED_SUFFIX, spool.CLAIMED_SUFFIX)
+
+
+class Command(BaseCommand):
+    help = ('Verify the HMAC signatures of stored webhook payloads in '
+            'parallel, and list the payloads that fail.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path',
+                            help='Spool segments, or files of JSON lines '
+                            'with "body" (or base64 "body_base64"), "hmac" '
+                            'and "shop" keys.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Pool size; defaults to the number of CPUs.')
+        parser.add_argument('--processes', action='store_true',
+                            help='Use a process pool instead of threads.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--secrets',
+                            help='A JSON file of shared secrets by shop '
+                            'domain, for shops not using SHARED_SECRET.')
+
+    def handle(self, *args, **options):
+        secrets = {}
+        if options['secrets']:
+            with open(options['secrets']) as secrets_file:
+                secrets = json.load(secrets_file)
+
+        # The index of the first item of each path, to locate failures
+        starts = []
+        def items():
+            index = 0
+            for path in options['paths']:
+                starts.append(index)
+                for item in read_items(path):
+                    yield item
+                    index += 1
+
+        result = validate.verify_batch(
+            items(), secrets, options['workers'], options['processes'],
+            options['chunk_size'])
+
+        for index, shop in result['failures']:
+            source = bisect.bisect_right(starts, index) - 1
+            self.stdout.write('FAILED %s #%d %s' % (
+                options['paths'][source], index - starts[source], shop))
+        self.stdout.write('%d verified, %d failed in %.2fs (%.0f/s)' % (
+            result['verified'], len(result['failures']), result['elapsed'],
+            result['rate']))
+
+
+def read_items(path):
+    '''
+    Iterate over the (body, signature, shop) tuples stored in the spool
+    segment or JSON lines file at `path`.
+    '''
+    if path.endswith(SPOOL_SUFFIXES):
+        for metadata, body in spool.read_segment(path):
+            meta = metadata['meta']
+            yield (body, meta.get('HTTP_X_SHOPIFY_HMAC_SHA256', ''),
+                   meta.get('HTTP_X_SHOPIFY_SHOP_DOMAIN', ''))
+        return
+
+    with open(path, encoding='utf8') as lines:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if 'body_base64' in record:
+                    body = base64.b64decode(record['body_base64'])
+                else:
+                    body = record['body'].encode('utf8')
+                yield body, record['hmac'], record.get('shop', '')
+            except (ValueError, KeyError, AttributeError) as e:
+                raise CommandError('%s:%d: invalid record (%s)' %
+                                   (path, number, e))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0005_customer_last_order_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Product',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('published_at', models.DateTimeField(null=True)),
+                ('title', models.TextField(blank=True)),
+                ('body_html', models.TextField(blank=True)),
+                ('handle', models.TextField(blank=True)),
+                ('vendor', models.TextField(blank=True)),
+                ('product_type', models.TextField(blank=True)),
+                ('tags', models.TextField(blank=True)),
+                ('published_scope', models.CharField(max_length=20, blank=True)),
+                ('template_suffix', models.TextField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductImage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('position', models.IntegerField(default=1)),
+                ('src', models.TextField()),
+                ('product', models.ForeignKey(related_name='images', to='webhooks.Product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductVariant',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('title', models.TextField(blank=True)),
+                ('sku', models.TextField(blank=True)),
+                ('barcode', models.TextField(null=True)),
+                ('position', models.IntegerField(default=1)),
+                ('price', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('compare_at_price', models.DecimalField(null=True, max_digits=12, decimal_places=2)),
+                ('option1', models.TextField(null=True)),
+                ('option2', models.TextField(null=True)),
+                ('option3', models.TextField(null=True)),
+                ('image_id', models.BigIntegerField(null=True)),
+                ('inventory_quantity', models.IntegerField(default=0)),
+                ('inventory_management', models.TextField(null=True)),
+                ('inventory_policy', models.CharField(max_length=20, blank=True)),
+                ('fulfillment_service', models.TextField(blank=True)),
+                ('grams', models.IntegerField(default=0)),
+                ('weight', models.FloatField(null=True)),
+                ('weight_unit', models.CharField(max_length=5, blank=True)),
+                ('requires_shipping', models.BooleanField(default=True)),
+                ('taxable', models.BooleanField(default=True)),
+                ('product', models.ForeignKey(related_name='variants', to='webhooks.Product')),
+            ],
+        ),
+    ]
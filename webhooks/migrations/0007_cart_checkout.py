@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0006_product'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cart',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('token', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('note', models.TextField(null=True)),
+                ('line_items', models.TextField(default='[]')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Checkout',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('token', models.CharField(max_length=64, db_index=True)),
+                ('cart_token', models.CharField(max_length=64, null=True)),
+                ('created_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('completed_at', models.DateTimeField(null=True)),
+                ('email', models.EmailField(max_length=254, blank=True)),
+                ('customer_shopify_id', models.BigIntegerField(null=True)),
+                ('currency', models.CharField(max_length=3, blank=True)),
+                ('subtotal_price', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('total_price', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('line_items', models.TextField(default='[]')),
+            ],
+        ),
+    ]
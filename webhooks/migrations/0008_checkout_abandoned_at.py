@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0007_cart_checkout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkout',
+            name='abandoned_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='order_shopify_id',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from hashlib import sha256
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def hash_email(email):
+    # A copy of webhooks.models.hash_email as it was when this migration
+    # was written, so that later changes to it do not change this one.
+    email = (email or '').strip().lower()
+    if not email:
+        return ''
+    return sha256(email.encode('utf-8')).hexdigest()
+
+
+def backfill_email_hash(apps, schema_editor):
+    Customer = apps.get_model('webhooks', 'Customer')
+    customers = (Customer.objects.using(schema_editor.connection.alias)
+                 .exclude(email='').order_by('id'))
+    last = 0
+    while True:
+        batch = list(customers.filter(id__gt=last)
+                     .values_list('id', 'email')[:1000])
+        if not batch:
+            return
+        for pk, email in batch:
+            customers.filter(id=pk).update(email_hash=hash_email(email))
+        last = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0008_checkout_abandoned_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='canonical',
+            field=models.ForeignKey(blank=True, null=True, related_name='duplicates', on_delete=django.db.models.deletion.SET_NULL, to='webhooks.Customer'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='email_hash',
+            field=models.CharField(max_length=64, blank=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_email_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0009_customer_email_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='last_name',
+            field=models.TextField(blank=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='myshopify_domain',
+            field=models.TextField(blank=True, null=True, db_index=True),
+        ),
+    ]
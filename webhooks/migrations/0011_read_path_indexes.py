@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0010_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='checkout',
+            name='customer_shopify_id',
+            field=models.BigIntegerField(null=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='email',
+            field=models.EmailField(max_length=254, blank=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='last_order_id',
+            field=models.BigIntegerField(null=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(null=True, db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='checkout',
+            index_together=set([('completed_at', 'order_shopify_id', 'abandoned_at')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='customer',
+            index_together=set([('state', 'updated_at')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='customeraddress',
+            index_together=set([('country_code', 'province_code')]),
+        ),
+    ]
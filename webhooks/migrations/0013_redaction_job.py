@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0012_customer_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RedactionJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('kind', models.CharField(max_length=10, choices=[('customer', 'Customer'), ('shop', 'Shop')])),
+                ('siteid', models.CharField(max_length=64)),
+                ('shop_shopify_id', models.BigIntegerField()),
+                ('customer_shopify_id', models.BigIntegerField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True, db_index=True)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('redacted', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='siteid',
+            field=models.CharField(max_length=64, blank=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='customer',
+            index_together=set([('state', 'updated_at'), ('siteid', 'id')]),
+        ),
+    ]
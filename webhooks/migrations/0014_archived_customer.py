@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0013_redaction_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCustomer',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('siteid', models.CharField(max_length=64, blank=True, db_index=True)),
+                ('month', models.DateField(db_index=True)),
+                ('updated_at', models.DateTimeField(null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('data', models.TextField()),
+            ],
+        ),
+    ]
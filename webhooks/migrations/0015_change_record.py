@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0014_archived_customer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeRecord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('created_at', models.DateTimeField(db_index=True, auto_now_add=True)),
+                ('entity', models.CharField(max_length=32)),
+                ('key', models.BigIntegerField()),
+                ('op', models.CharField(max_length=10, choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')])),
+                ('data', models.TextField(default='{}')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='changerecord',
+            index_together=set([('entity', 'key')]),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0015_change_record'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trace_id', models.CharField(max_length=32)),
+                ('topic', models.CharField(max_length=255, db_index=True)),
+                ('shop', models.CharField(max_length=255, blank=True)),
+                ('status', models.IntegerField(null=True)),
+                ('duration', models.FloatField()),
+                ('stages', models.TextField(default='[]')),
+                ('payload', models.TextField(blank=True)),
+            ],
+        ),
+    ]
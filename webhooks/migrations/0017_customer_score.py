@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0016_slow_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerScore',
+            fields=[
+                ('customer', models.OneToOneField(primary_key=True, serialize=False, related_name='score', to='webhooks.Customer')),
+                ('recency', models.SmallIntegerField()),
+                ('frequency', models.SmallIntegerField()),
+                ('monetary', models.SmallIntegerField()),
+                ('segment', models.CharField(max_length=8, db_index=True)),
+                ('scored_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ScoringRun',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('since', models.DateTimeField(null=True)),
+                ('scored', models.IntegerField(default=0)),
+                ('breakpoints', models.TextField(default='{}')),
+            ],
+        ),
+    ]
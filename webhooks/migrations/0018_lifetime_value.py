@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0017_customer_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerLifetimeValue',
+            fields=[
+                ('customer_shopify_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('orders_count', models.IntegerField(default=0)),
+                ('gross', models.DecimalField(default=0, max_digits=14, decimal_places=2)),
+                ('refunds', models.DecimalField(default=0, max_digits=14, decimal_places=2)),
+                ('net', models.DecimalField(default=0, max_digits=14, decimal_places=2)),
+                ('first_order_at', models.DateTimeField(null=True)),
+                ('last_order_at', models.DateTimeField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('customer_shopify_id', models.BigIntegerField(null=True, db_index=True)),
+                ('total_price', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('currency', models.CharField(max_length=3, blank=True)),
+                ('processed_at', models.DateTimeField(null=True)),
+                ('paid_at', models.DateTimeField(null=True)),
+                ('cancelled_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('order_shopify_id', models.BigIntegerField(db_index=True)),
+                ('amount', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('created_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
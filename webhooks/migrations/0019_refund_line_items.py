@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_total_refunded(apps, schema_editor):
+    Order = apps.get_model('webhooks', 'Order')
+    Refund = apps.get_model('webhooks', 'Refund')
+    for order_shopify_id, amount in (
+            Refund.objects.values_list('order_shopify_id').order_by()
+            .annotate(amount=Sum('amount'))):
+        Order.objects.filter(shopify_id=order_shopify_id).update(
+            total_refunded=amount)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhooks', '0018_lifetime_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefundLineItem',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('shopify_id', models.BigIntegerField(unique=True)),
+                ('line_item_id', models.BigIntegerField(null=True)),
+                ('quantity', models.IntegerField(default=0)),
+                ('restock_type', models.CharField(max_length=20, blank=True)),
+                ('subtotal', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+                ('total_tax', models.DecimalField(default=0, max_digits=12, decimal_places=2)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_refunded',
+            field=models.DecimalField(default=0, max_digits=12, decimal_places=2),
+        ),
+        migrations.AddField(
+            model_name='refund',
+            name='note',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='refundlineitem',
+            name='refund',
+            field=models.ForeignKey(related_name='line_items', to='webhooks.Refund'),
+        ),
+        migrations.RunPython(backfill_total_refunded,
+                             migrations.RunPython.noop),
+    ]
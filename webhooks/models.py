@@ -1,22 +1,36 @@
+from decimal import Decimal
+from hashlib import sha256
+
 from django.db import models
 
+from webhooks.libs import cache, mapping
+
+
+def hash_email(email):
+    '''
+    Return the SHA-256 hex digest of an email address with surrounding
+    whitespace removed and case folded, or an empty string for an empty
+    address.
+    '''
+    email = (email or '').strip().lower()
+    if not email:
+        return ''
+    return sha256(email.encode('utf-8')).hexdigest()
+
 
-# class Order(models.Model):
-#     pass
-#
-#
-# class Product(models.Model):
-#     pass
-#
-#
-# class Cart(models.Model):
-#     pass
-#
-#
 # class Collection(models.Model):
 #     pass
 
 
+class LiveManager(models.Manager):
+    '''
+    A manager that leaves out tombstoned rows, those with `deleted_at`
+    set.
+    '''
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Customer(models.Model):
     DIRECT_COPY_FIELDS = [
         'accepts_marketing',
@@ -40,17 +54,20 @@ class Customer(models.Model):
     ]
 
     shopify_id = models.BigIntegerField(unique=True)
+    #: The site whose webhooks last wrote the customer; see
+    #: :class:`RedactionJob`
+    siteid = models.CharField(max_length=64, blank=True)
 
     created_at = models.DateTimeField(null=True)
-    updated_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True, db_index=True)
 
-    email = models.EmailField(blank=True)
+    email = models.EmailField(blank=True, db_index=True)
     verified_email = models.BooleanField(default=False)
     first_name = models.TextField(blank=True)
-    last_name = models.TextField(blank=True)
+    last_name = models.TextField(blank=True, db_index=True)
 
     note = models.TextField(blank=True)
-    last_order_id = models.BigIntegerField(null=True)
+    last_order_id = models.BigIntegerField(null=True, db_index=True)
     last_order_name = models.TextField(null=True)
     orders_count = models.IntegerField(default=0)
     total_spent = models.DecimalField(default=0, decimal_places=2, max_digits=9)
@@ -64,9 +81,303 @@ class Customer(models.Model):
 
     addresses = models.ManyToManyField('CustomerAddress')
 
+    #: See :func:`hash_email`; kept up to date by :meth:`save`
+    email_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    #: The customer this one duplicates, if any; set by
+    #: ``manage.py dedup_customers``
+    canonical = models.ForeignKey('self', null=True, blank=True,
+                                  related_name='duplicates',
+                                  on_delete=models.SET_NULL)
+    #: When Shopify deleted the customer. Deleted customers are hidden
+    #: from :attr:`objects` until ``manage.py purge_customers`` removes
+    #: them; :attr:`all_objects` includes them.
+    deleted_at = models.DateTimeField(null=True, db_index=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        # Customers in a state changed since a given time, and the
+        # customers of a site in ID ranges
+        index_together = [('state', 'updated_at'), ('siteid', 'id')]
+
     def __str__(self):
         return '%s %s' % (self.first_name, self.last_name)
 
+    def save(self, *args, **kwargs):
+        self.email_hash = hash_email(self.email)
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def find_by_email(cls, email):
+        '''
+        Find the canonical customer for an email address with a single
+        indexed query. Of several customers with the same normalised
+        address, the one marked canonical by ``manage.py dedup_customers``
+        is returned; before that has run, the oldest one is.
+
+        :param str email: The email address.
+        :returns: a :class:`Customer`, or `None` if no customer has the
+          address.
+        '''
+        email_hash = hash_email(email)
+        if not email_hash:
+            return None
+        customer = (cls.objects.filter(email_hash=email_hash)
+                    .select_related('canonical').order_by('id').first())
+        if customer is None:
+            return None
+        if customer.canonical and customer.canonical.deleted_at is None:
+            return customer.canonical
+        return customer
+
+
+class ArchivedCustomer(models.Model):
+    '''
+    A customer not updated for a long time, moved out of the customer
+    table by ``manage.py archive_customers`` together with its tags and
+    addresses; see :mod:`webhooks.libs.archive`.
+    '''
+    shopify_id = models.BigIntegerField(unique=True)
+    siteid = models.CharField(max_length=64, blank=True, db_index=True)
+    #: The first day of the month the customer was last updated in; the
+    #: archive is partitioned by it
+    month = models.DateField(db_index=True)
+    updated_at = models.DateTimeField(null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    #: The customer fields, tag names and addresses, JSON encoded
+    data = models.TextField()
+
+    def __str__(self):
+        return str(self.shopify_id)
+
+
+class CustomerScore(models.Model):
+    '''
+    The recency, frequency and monetary (RFM) scores of a customer, from
+    1 (lowest) to the number of bins of the run that computed them;
+    see :mod:`webhooks.libs.scoring`.
+    '''
+    customer = models.OneToOneField(Customer, primary_key=True,
+                                    related_name='score')
+    recency = models.SmallIntegerField()
+    frequency = models.SmallIntegerField()
+    monetary = models.SmallIntegerField()
+    #: The three scores as one string, such as ``'545'``
+    segment = models.CharField(max_length=8, db_index=True)
+    scored_at = models.DateTimeField()
+
+    def __str__(self):
+        return '%d: %s' % (self.customer_id, self.segment)
+
+
+class ScoringRun(models.Model):
+    '''
+    A run of ``manage.py score_customers``. Full runs compute the score
+    breakpoints from every customer; incremental runs reuse those of the
+    last full run to score the customers changed since the last run.
+    '''
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True)
+    full = models.BooleanField(default=False)
+    #: Incremental runs score the customers updated since this time
+    since = models.DateTimeField(null=True)
+    scored = models.IntegerField(default=0)
+    #: The breakpoints of each score, JSON encoded
+    breakpoints = models.TextField(default='{}')
+
+    def __str__(self):
+        return '%s scoring run at %s' % ('Full' if self.full else
+                                         'Incremental', self.started_at)
+
+
+class Order(models.Model):
+    '''
+    An order, with what the lifetime values of customers count; see
+    :mod:`webhooks.libs.lifetime`. An order counts once it is paid,
+    until it is cancelled.
+    '''
+    shopify_id = models.BigIntegerField(unique=True)
+    customer_shopify_id = models.BigIntegerField(null=True, db_index=True)
+    total_price = models.DecimalField(default=0, decimal_places=2,
+                                      max_digits=12)
+    currency = models.CharField(max_length=3, blank=True)
+    #: When the order was placed
+    processed_at = models.DateTimeField(null=True)
+    #: When the ``orders/paid`` webhook was received
+    paid_at = models.DateTimeField(null=True)
+    cancelled_at = models.DateTimeField(null=True)
+    #: The sum of the amounts of its refunds
+    total_refunded = models.DecimalField(default=0, decimal_places=2,
+                                         max_digits=12)
+
+    def __str__(self):
+        return str(self.shopify_id)
+
+
+class Refund(models.Model):
+    '''
+    A refund of an order; its amount is the sum of its successful refund
+    transactions.
+    '''
+    shopify_id = models.BigIntegerField(unique=True)
+    order_shopify_id = models.BigIntegerField(db_index=True)
+    amount = models.DecimalField(default=0, decimal_places=2, max_digits=12)
+    created_at = models.DateTimeField(null=True)
+    note = models.TextField(blank=True)
+
+    def __str__(self):
+        return str(self.shopify_id)
+
+
+class RefundLineItem(models.Model):
+    '''
+    A line item of an order returned by a :class:`Refund`.
+    '''
+    DIRECT_COPY_FIELDS = [
+        'line_item_id',
+        'quantity',
+        'restock_type',
+        'subtotal',
+        'total_tax',
+    ]
+
+    shopify_id = models.BigIntegerField(unique=True)
+    refund = models.ForeignKey(Refund, related_name='line_items')
+    line_item_id = models.BigIntegerField(null=True)
+    quantity = models.IntegerField(default=0)
+    #: ``no_restock``, ``cancel`` or ``return``
+    restock_type = models.CharField(max_length=20, blank=True)
+    subtotal = models.DecimalField(default=0, decimal_places=2,
+                                   max_digits=12)
+    total_tax = models.DecimalField(default=0, decimal_places=2,
+                                    max_digits=12)
+
+    def __str__(self):
+        return str(self.shopify_id)
+
+
+class CustomerLifetimeValue(models.Model):
+    '''
+    The totals of the counted orders of a customer and of their refunds,
+    kept up to date with additive updates by the order and refund
+    webhooks and checked by ``manage.py reconcile_lifetime_values``;
+    see :mod:`webhooks.libs.lifetime`. Customers are referred to by
+    Shopify ID, as orders may arrive before their customer, and outlive
+    it in the archive.
+    '''
+    customer_shopify_id = models.BigIntegerField(primary_key=True)
+    orders_count = models.IntegerField(default=0)
+    gross = models.DecimalField(default=0, decimal_places=2, max_digits=14)
+    refunds = models.DecimalField(default=0, decimal_places=2,
+                                  max_digits=14)
+    #: `gross` less `refunds`
+    net = models.DecimalField(default=0, decimal_places=2, max_digits=14)
+    first_order_at = models.DateTimeField(null=True)
+    last_order_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%d: %s' % (self.customer_shopify_id, self.net)
+
+    @property
+    def average_order_value(self):
+        '''
+        The net value per counted order, or ``None`` without orders.
+        '''
+        if not self.orders_count:
+            return None
+        return (self.net / self.orders_count).quantize(Decimal('0.01'))
+
+
+class ChangeRecord(models.Model):
+    '''
+    A write made by the webhook views, in the changelog read by
+    downstream consumers; see :mod:`webhooks.libs.changelog`. The ID is
+    the offset of the record in the changelog.
+    '''
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OP_CHOICES = (
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    #: The model name, such as ``customer``
+    entity = models.CharField(max_length=32)
+    #: The Shopify ID of the changed object
+    key = models.BigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    #: The changed fields and their new values, JSON encoded
+    data = models.TextField(default='{}')
+
+    class Meta:
+        # Compaction and redaction by entity key
+        index_together = [('entity', 'key')]
+
+    def __str__(self):
+        return '%d %s %s:%d' % (self.id, self.op, self.entity, self.key)
+
+
+class SlowEvent(models.Model):
+    '''
+    A webhook request that took at least
+    ``settings.TRACE_SLOW_THRESHOLD`` seconds, with the time spent in
+    each stage; see :mod:`webhooks.libs.tracing`. Only the latest
+    ``settings.TRACE_SLOW_EVENTS`` are kept.
+    '''
+    created_at = models.DateTimeField(auto_now_add=True)
+    #: The Zipkin trace ID
+    trace_id = models.CharField(max_length=32)
+    topic = models.CharField(max_length=255, db_index=True)
+    shop = models.CharField(max_length=255, blank=True)
+    #: The HTTP status of the response, if one was returned
+    status = models.IntegerField(null=True)
+    #: The duration of the request in seconds
+    duration = models.FloatField()
+    #: The stages, JSON encoded; see
+    #: :meth:`webhooks.libs.tracing.Trace.stages`
+    stages = models.TextField(default='[]')
+    #: The JSON payload with personal data redacted
+    payload = models.TextField(blank=True)
+
+    def __str__(self):
+        return '%s %.3fs' % (self.topic, self.duration)
+
+
+class RedactionJob(models.Model):
+    '''
+    A request to erase the data of a customer, or of all customers of a
+    shop, queued by the ``customers/redact`` and ``shop/redact`` webhooks
+    and carried out in chunks by ``manage.py redact``; see
+    :mod:`webhooks.libs.redaction`.
+    '''
+    CUSTOMER = 'customer'
+    SHOP = 'shop'
+    KIND_CHOICES = (
+        (CUSTOMER, 'Customer'),
+        (SHOP, 'Shop'),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    siteid = models.CharField(max_length=64)
+    shop_shopify_id = models.BigIntegerField()
+    #: The customer to redact, for customer jobs
+    customer_shopify_id = models.BigIntegerField(null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, db_index=True)
+    #: The ID of the last customer redacted; the next chunk starts after
+    #: it
+    cursor = models.BigIntegerField(default=0)
+    redacted = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '%s redaction for %s' % (self.kind, self.siteid)
+
 
 class CustomerTag(models.Model):
     name = models.CharField(max_length=255, unique=True)
@@ -113,15 +424,213 @@ class CustomerAddress(models.Model):
 
     phone = models.TextField(blank=True)
 
+    class Meta:
+        index_together = [('country_code', 'province_code')]
+
     def __str__(self):
         return '%s, %s, %s, "%s"' % (self.country_code, self.province_code,
                                      self.city, self.name)
 
 
-# class Checkout(models.Model):
-#     pass
-#
-#
+class Product(models.Model):
+    DIRECT_COPY_FIELDS = [
+        'body_html',
+        'created_at',
+        'handle',
+        # 'id',
+        # images
+        # options
+        'product_type',
+        'published_at',
+        'published_scope',
+        'tags',
+        'template_suffix',
+        'title',
+        'updated_at',
+        # variants
+        'vendor',
+    ]
+
+    shopify_id = models.BigIntegerField(unique=True)
+
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True)
+    published_at = models.DateTimeField(null=True)
+
+    title = models.TextField(blank=True)
+    body_html = models.TextField(blank=True)
+    handle = models.TextField(blank=True)
+    vendor = models.TextField(blank=True)
+    product_type = models.TextField(blank=True)
+    #: Comma separated, as sent by Shopify
+    tags = models.TextField(blank=True)
+    #: "web" or "global"
+    published_scope = models.CharField(max_length=20, blank=True)
+    template_suffix = models.TextField(null=True)
+
+    def __str__(self):
+        return self.title
+
+
+class ProductVariant(models.Model):
+    DIRECT_COPY_FIELDS = [
+        'barcode',
+        'compare_at_price',
+        'created_at',
+        'fulfillment_service',
+        'grams',
+        # 'id',
+        'image_id',
+        'inventory_management',
+        'inventory_policy',
+        'inventory_quantity',
+        'option1',
+        'option2',
+        'option3',
+        'position',
+        'price',
+        # product_id
+        'requires_shipping',
+        'sku',
+        'taxable',
+        'title',
+        'updated_at',
+        'weight',
+        'weight_unit',
+    ]
+
+    shopify_id = models.BigIntegerField(unique=True)
+    product = models.ForeignKey(Product, related_name='variants')
+
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True)
+
+    title = models.TextField(blank=True)
+    sku = models.TextField(blank=True)
+    barcode = models.TextField(null=True)
+    position = models.IntegerField(default=1)
+    price = models.DecimalField(default=0, decimal_places=2, max_digits=12)
+    compare_at_price = models.DecimalField(null=True, decimal_places=2,
+                                           max_digits=12)
+    option1 = models.TextField(null=True)
+    option2 = models.TextField(null=True)
+    option3 = models.TextField(null=True)
+    #: The Shopify ID of the image shown for this variant
+    image_id = models.BigIntegerField(null=True)
+
+    inventory_quantity = models.IntegerField(default=0)
+    inventory_management = models.TextField(null=True)
+    inventory_policy = models.CharField(max_length=20, blank=True)
+    fulfillment_service = models.TextField(blank=True)
+
+    grams = models.IntegerField(default=0)
+    weight = models.FloatField(null=True)
+    weight_unit = models.CharField(max_length=5, blank=True)
+    requires_shipping = models.BooleanField(default=True)
+    taxable = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.title
+
+
+class ProductImage(models.Model):
+    DIRECT_COPY_FIELDS = [
+        'created_at',
+        # 'id',
+        'position',
+        # product_id
+        'src',
+        'updated_at',
+        # variant_ids
+    ]
+
+    shopify_id = models.BigIntegerField(unique=True)
+    product = models.ForeignKey(Product, related_name='images')
+
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True)
+
+    position = models.IntegerField(default=1)
+    src = models.TextField()
+
+    def __str__(self):
+        return self.src
+
+
+class Cart(models.Model):
+    DIRECT_COPY_FIELDS = [
+        'created_at',
+        # 'id',
+        # line_items
+        'note',
+        'token',
+        'updated_at',
+    ]
+
+    token = models.CharField(max_length=64, unique=True)
+
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True)
+
+    note = models.TextField(null=True)
+    #: The line items as sent by Shopify, JSON encoded
+    line_items = models.TextField(default='[]')
+
+    def __str__(self):
+        return self.token
+
+
+class Checkout(models.Model):
+    DIRECT_COPY_FIELDS = [
+        'cart_token',
+        'completed_at',
+        'created_at',
+        'currency',
+        # customer
+        'email',
+        # 'id',
+        # line_items
+        'subtotal_price',
+        'token',
+        'total_price',
+        'updated_at',
+    ]
+
+    shopify_id = models.BigIntegerField(unique=True)
+    token = models.CharField(max_length=64, db_index=True)
+    cart_token = models.CharField(max_length=64, null=True)
+
+    created_at = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField(null=True)
+    completed_at = models.DateTimeField(null=True)
+
+    email = models.EmailField(blank=True)
+    #: The Shopify ID of the customer, if known
+    customer_shopify_id = models.BigIntegerField(null=True, db_index=True)
+
+    currency = models.CharField(max_length=3, blank=True)
+    subtotal_price = models.DecimalField(default=0, decimal_places=2,
+                                         max_digits=12)
+    total_price = models.DecimalField(default=0, decimal_places=2,
+                                      max_digits=12)
+    #: The line items as sent by Shopify, JSON encoded
+    line_items = models.TextField(default='[]')
+
+    #: The Shopify ID of the order placed from this checkout, if any
+    order_shopify_id = models.BigIntegerField(null=True)
+    #: When the checkout was found to have no order; see
+    #: :mod:`webhooks.libs.abandonment`
+    abandoned_at = models.DateTimeField(null=True)
+
+    class Meta:
+        # See webhooks.libs.abandonment.open_checkouts()
+        index_together = [('completed_at', 'order_shopify_id',
+                           'abandoned_at')]
+
+    def __str__(self):
+        return self.token
+
+
 # class Fulfillment(models.Model):
 #     pass
 #
@@ -176,7 +685,7 @@ class Shop(models.Model):
     # Basic data
     name = models.TextField(blank=True)
     has_storefront = models.BooleanField(default=False)
-    myshopify_domain = models.TextField(blank=True, null=True)
+    myshopify_domain = models.TextField(blank=True, null=True, db_index=True)
     created_at = models.TextField(null=True)
 
     #: The contact email address for the shop
@@ -232,3 +741,53 @@ class Shop(models.Model):
     # Other
     requires_extra_payments_agreement = models.BooleanField(default=False)
     eligible_for_payments = models.BooleanField(default=True)
+
+
+# Payload mappers, compiled once at import time; see
+# :func:`webhooks.libs.mapping.compile_mapper`.
+Customer.copy_payload = staticmethod(mapping.compile_mapper(
+    Customer,
+    Customer.DIRECT_COPY_FIELDS + ['created_at', 'updated_at', 'total_spent']))
+
+CustomerAddress.copy_payload = staticmethod(mapping.compile_mapper(
+    CustomerAddress,
+    ['id', 'default', 'name', 'first_name', 'last_name', 'company',
+     'address1', 'address2', 'city', 'country', 'country_code',
+     'country_name', 'province', 'province_code', 'zip', 'phone'],
+    renames={'id': 'shopify_id'}))
+
+Shop.copy_payload = staticmethod(mapping.compile_mapper(
+    Shop, Shop.DIRECT_COPY_FIELDS + ['created_at']))
+
+ProductVariant.copy_payload = staticmethod(mapping.compile_mapper(
+    ProductVariant, ProductVariant.DIRECT_COPY_FIELDS + ['id'],
+    renames={'id': 'shopify_id'}))
+
+ProductImage.copy_payload = staticmethod(mapping.compile_mapper(
+    ProductImage, ProductImage.DIRECT_COPY_FIELDS + ['id'],
+    renames={'id': 'shopify_id'}))
+
+Product.copy_payload = staticmethod(mapping.compile_mapper(
+    Product, Product.DIRECT_COPY_FIELDS,
+    nested={'variants': (ProductVariant, ProductVariant.copy_payload),
+            'images': (ProductImage, ProductImage.copy_payload)}))
+
+Cart.copy_payload = staticmethod(mapping.compile_mapper(
+    Cart, Cart.DIRECT_COPY_FIELDS))
+
+Checkout.copy_payload = staticmethod(mapping.compile_mapper(
+    Checkout, Checkout.DIRECT_COPY_FIELDS + ['id'],
+    renames={'id': 'shopify_id'}))
+
+RefundLineItem.copy_payload = staticmethod(mapping.compile_mapper(
+    RefundLineItem, RefundLineItem.DIRECT_COPY_FIELDS + ['id'],
+    renames={'id': 'shopify_id'}))
+
+Refund.copy_payload = staticmethod(mapping.compile_mapper(
+    Refund, ['id', 'order_id', 'created_at', 'note'],
+    renames={'id': 'shopify_id', 'order_id': 'order_shopify_id'},
+    nested={'refund_line_items': (RefundLineItem,
+                                  RefundLineItem.copy_payload)}))
+
+cache.track(Customer)
+cache.track(Shop)
@@ -0,0 +1,106 @@
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from webhooks import admin, models
+
+
+@override_settings(STATIC_URL='/static/')
+class TestAdmin(TestCase):
+    '''
+    Test that the changelists take a bounded number of queries and search
+    on indexed columns only.
+    '''
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.login(username='admin', password='secret')
+        self.tag = models.CustomerTag.objects.create(name='vip')
+
+    def create_customers(self, first, last):
+        for shopify_id in range(first, last):
+            address = models.CustomerAddress.objects.create(
+                shopify_id=shopify_id, city='Leeds')
+            customer = models.Customer.objects.create(
+                shopify_id=shopify_id, state='enabled',
+                email='customer%d@example.com' % shopify_id,
+                last_name='Last%d' % shopify_id)
+            customer.tags.add(self.tag)
+            customer.addresses.add(address)
+
+    def changelist(self, model, **params):
+        url = reverse('admin:webhooks_%s_changelist' % model._meta.model_name)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_queries_bounded(self):
+        self.create_customers(1, 3)
+        response, few = self.changelist(models.Customer)
+        self.assertContains(response, 'vip')
+
+        self.create_customers(3, 30)
+        response, many = self.changelist(models.Customer)
+        self.assertEqual(few, many,
+                         'The changelist queries grow with the rows shown')
+
+    def test_estimated_count(self):
+        self.create_customers(1, 6)
+        paginator = admin.EstimatedCountPaginator(
+            models.Customer.objects.all(), 2)
+        self.assertEqual(paginator.count, 5)
+
+        paginator.limit = 3
+        paginator._count = None
+        self.assertGreaterEqual(paginator.count, 5,
+                                'Large tables are not counted by estimate')
+
+        paginator = admin.EstimatedCountPaginator(
+            models.Customer.objects.filter(shopify_id__gt=1), 2)
+        paginator.limit = 3
+        self.assertEqual(paginator.count, 3,
+                         'Filtered counts are not bounded')
+
+    def test_search(self):
+        self.create_customers(1, 4)
+        response, queries = self.changelist(models.Customer,
+                                            q='Customer2@Example.com')
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertEqual(response.context['cl'].result_list[0].shopify_id, 2)
+
+        response, queries = self.changelist(models.Customer, q='3')
+        self.assertEqual(response.context['cl'].result_list[0].shopify_id, 3)
+
+        response, queries = self.changelist(models.Customer, q='Last1')
+        self.assertEqual(response.context['cl'].result_list[0].shopify_id, 1)
+
+        response, queries = self.changelist(models.Customer, q='Last')
+        self.assertEqual(response.context['cl'].result_count, 0,
+                         'Searches match substrings')
+
+    def test_state_filter(self):
+        self.create_customers(1, 3)
+        models.Customer.objects.filter(shopify_id=2).update(state='disabled')
+        response, queries = self.changelist(models.Customer, state='disabled')
+        self.assertEqual([customer.shopify_id for customer
+                          in response.context['cl'].result_list], [2])
+        with CaptureQueriesContext(connection) as queries:
+            self.changelist(models.Customer)
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'DISTINCT' in query['sql']],
+                         'The filter choices were read from the table')
+
+    def test_other_changelists(self):
+        self.create_customers(1, 3)
+        models.Shop.objects.create(shopify_id=1, name='Shop',
+                                   myshopify_domain='shop.myshopify.com')
+        for model in (models.CustomerAddress, models.CustomerTag, models.Shop):
+            self.changelist(model)
+
+        response, queries = self.changelist(models.CustomerTag, q='vip')
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response, queries = self.changelist(models.Shop,
+                                            q='shop.myshopify.com')
+        self.assertEqual(response.context['cl'].result_count, 1)
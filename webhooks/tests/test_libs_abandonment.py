@@ -0,0 +1,141 @@
+import datetime
+import time
+
+from unittest import mock
+
+import django.test
+from django.utils import timezone
+
+from webhooks import models, views
+from webhooks.libs import abandonment, metrics, worker
+from webhooks.tests import utils
+
+
+def checkout(shopify_id, updated_at, **kwargs):
+    return models.Checkout.objects.create(
+        shopify_id=shopify_id, token=str(shopify_id), updated_at=updated_at,
+        **kwargs)
+
+
+@django.test.override_settings(ABANDONED_CHECKOUT_TICK=0)
+class TestAbandonmentScheduler(django.test.TestCase):
+    '''
+    Test that expired timers mark open checkouts abandoned, and only
+    those.
+    '''
+    def setUp(self):
+        self.scheduler = abandonment.AbandonmentScheduler(delay=60)
+        self.now = time.time()
+        self.updated_at = timezone.now()
+
+    def test_fire(self):
+        self.scheduler.arm(checkout(1, self.updated_at))
+        self.scheduler.arm(checkout(2, self.updated_at))
+        self.assertEqual(self.scheduler.stats()['timers'], 2)
+
+        self.assertEqual(self.scheduler.tick(self.now + 30), 0)
+        self.assertEqual(self.scheduler.tick(self.now + 61), 2)
+        self.assertEqual(models.Checkout.objects.filter(
+            abandoned_at__isnull=False).count(), 2)
+        stats = self.scheduler.stats()
+        self.assertEqual(stats['timers'], 0)
+        self.assertEqual(stats['fired'], 2)
+        self.assertGreater(stats['firing_rate'], 0)
+
+    def test_cancel(self):
+        self.scheduler.arm(checkout(1, self.updated_at))
+        self.scheduler.cancel(1)
+        self.assertEqual(self.scheduler.tick(self.now + 61), 0)
+        self.assertEqual(self.scheduler.fired, 0)
+
+    def test_closed_and_updated_checkouts_are_kept(self):
+        ordered = checkout(1, self.updated_at, order_shopify_id=10)
+        later = checkout(2, self.updated_at + datetime.timedelta(seconds=30))
+        # Timers armed from states older than those in the database
+        ordered.updated_at = later.updated_at = self.updated_at
+        self.scheduler.arm(ordered)
+        self.scheduler.arm(later)
+
+        self.assertEqual(self.scheduler.tick(self.now + 61), 0)
+        self.assertEqual(self.scheduler.fired, 2)
+        self.assertFalse(models.Checkout.objects.filter(
+            abandoned_at__isnull=False).exists())
+
+    def test_rebuild(self):
+        checkout(1, self.updated_at)
+        checkout(2, self.updated_at - datetime.timedelta(hours=1))
+        checkout(3, self.updated_at, order_shopify_id=10)
+        checkout(4, self.updated_at, abandoned_at=self.updated_at)
+
+        self.assertEqual(self.scheduler.rebuild(), 2)
+        self.assertEqual(self.scheduler.tick(self.now + 1), 1)
+        self.assertEqual(self.scheduler.tick(self.now + 61), 1)
+
+
+@django.test.override_settings(WRITE_BEHIND_FLUSH_INTERVAL=0,
+                               ABANDONED_CHECKOUT_TICK=0)
+class TestAbandonmentViews(django.test.TestCase):
+    '''
+    Test that checkout webhooks arm timers and orders cancel them.
+    '''
+    siteid = 'abcd'
+
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        abandonment.scheduler.wheel.cancel(450789469)
+        metrics.reset()
+
+    def tearDown(self):
+        views.checkout_buffer.flush()
+
+    def test_order_cancels_timer(self):
+        path = '/webhooks/shopify/%s/checkout_update' % self.siteid
+        data = {"id": 450789469,
+                "token": "2a1ace52255252df566af0faaedfbfa7",
+                "updated_at": "2015-05-27T19:12:19+01:00",
+                "completed_at": None}
+        request = self.factory.checkout_update(path, data)
+        response = views.shopify_checkout_update(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(450789469, abandonment.scheduler.wheel)
+        views.checkout_buffer.flush()
+
+        path = '/webhooks/shopify/%s/order_create' % self.siteid
+        request = self.factory.order_create(
+            path, {"id": 820982911946154508, "checkout_id": 450789469})
+        response = views.shopify_order_create(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertNotIn(450789469, abandonment.scheduler.wheel)
+        self.assertEqual(metrics.get('abandonment.cancelled'), 1)
+        checkout = models.Checkout.objects.get(shopify_id=450789469)
+        self.assertEqual(checkout.order_shopify_id, 820982911946154508)
+
+    def test_order_of_a_buffered_checkout(self):
+        path = '/webhooks/shopify/%s/checkout_update' % self.siteid
+        data = {"id": 450789469,
+                "token": "2a1ace52255252df566af0faaedfbfa7",
+                "updated_at": "2015-05-27T19:12:19+01:00",
+                "completed_at": None}
+        request = self.factory.checkout_update(path, data)
+        views.shopify_checkout_update(request, self.siteid)
+
+        path = '/webhooks/shopify/%s/order_create' % self.siteid
+        request = self.factory.order_create(
+            path, {"id": 820982911946154508, "checkout_id": 450789469,
+                   "checkout_token": "2a1ace52255252df566af0faaedfbfa7"})
+        response = views.shopify_order_create(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        views.checkout_buffer.flush()
+
+        checkout = models.Checkout.objects.get(shopify_id=450789469)
+        self.assertEqual(checkout.order_shopify_id, 820982911946154508)
+        self.assertEqual(checkout.updated_at.year, 2015,
+                         'The buffered state was not written')
+        self.assertFalse(abandonment.open_checkouts().exists())
+
+    def test_worker_start(self):
+        with mock.patch.object(abandonment.scheduler, 'start') as start, \
+                mock.patch('webhooks.libs.writebehind.exit_on_signals'):
+            worker.start()
+        start.assert_called_once_with()
@@ -0,0 +1,155 @@
+import django.http
+import django.test
+from django.core.cache import caches
+
+from webhooks import models, views
+from webhooks.libs import admission, metrics, validate
+from webhooks.tests import utils
+
+
+class TestTokenBucket(django.test.SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_take(self):
+        for i in range(3):
+            self.assertEqual(admission.take('bucket', 2, 3, now=100), 0)
+        self.assertAlmostEqual(admission.take('bucket', 2, 3, now=100), 0.5)
+        self.assertAlmostEqual(admission.take('bucket', 2, 3, now=100.25), 0.25)
+        self.assertEqual(admission.take('bucket', 2, 3, now=100.5), 0)
+
+    def test_refill_is_capped(self):
+        admission.take('bucket', 2, 3, now=100)
+        for i in range(3):
+            self.assertEqual(admission.take('bucket', 2, 3, now=1000), 0)
+        self.assertGreater(admission.take('bucket', 2, 3, now=1000), 0,
+                           'An idle bucket filled beyond its burst')
+
+
+@django.test.override_settings(ADMISSION_SHOP_BUCKET=(0.001, 3),
+                               ADMISSION_TOPIC_BUCKET=(0.001, 2),
+                               ADMISSION_TOPIC_BUCKETS={})
+class TestAdmission(django.test.SimpleTestCase):
+    '''
+    Test that the validation decorator sheds requests beyond the budgets.
+    '''
+    path = '/webhooks/shopify/abcd/customer_update'
+
+    def setUp(self):
+        caches['default'].clear()
+        metrics.reset()
+
+        @validate.ValidateShopifyWebhookRequest
+        def view(request, siteid):
+            self.in_flight = admission.in_flight()
+            return django.http.HttpResponse()
+
+        self.view = view
+        self.factory = utils.ShopifyRequestFactory()
+        self.bucket = admission.shop_bucket('example.myshopify.com')
+
+    def post(self, topic):
+        request = self.factory.create_shopify_webhook_request(
+            self.path, {'id': 1}, topic)
+        return self.view(request, 'abcd')
+
+    def test_budgets(self):
+        self.assertEqual(self.post('customers/update').status_code, 200)
+        self.assertEqual(self.post('customers/update').status_code, 200)
+        response = self.post('customers/update')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(metrics.get('webhooks.shed', 'topic', self.bucket),
+                         1)
+
+        # The topic refusal did not use up the shop's budget
+        self.assertEqual(self.post('customers/create').status_code, 200)
+        self.assertEqual(self.post('customers/create').status_code, 429)
+        self.assertEqual(metrics.get('webhooks.shed', 'shop', self.bucket), 1)
+
+    def test_in_flight(self):
+        self.assertEqual(self.post('customers/update').status_code, 200)
+        self.assertEqual(self.in_flight, 1)
+        self.assertEqual(admission.in_flight(), 0)
+
+        with self.settings(ADMISSION_MAX_IN_FLIGHT=0):
+            response = self.post('customers/update')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(admission.in_flight(), 0)
+        self.assertEqual(metrics.get('webhooks.shed', 'overload',
+                                     self.bucket), 1)
+
+    def test_prevalidated_requests_are_shed(self):
+        # As the ASGI front end hands them over
+        statuses = []
+        for i in range(3):
+            request = self.factory.create_shopify_webhook_request(
+                self.path, {'id': 1}, 'customers/update')
+            request.META[validate.PREVALIDATED_ENVIRON_KEY] = True
+            statuses.append(self.view(request, 'abcd').status_code)
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_replayed_requests_are_not_shed(self):
+        for i in range(3):
+            request = self.factory.create_shopify_webhook_request(
+                self.path, {'id': 1}, 'customers/update')
+            request.META[validate.PREVALIDATED_ENVIRON_KEY] = True
+            request.META[validate.ADMITTED_ENVIRON_KEY] = True
+            self.assertEqual(self.view(request, 'abcd').status_code, 200)
+        self.assertEqual(admission.in_flight(), 0)
+
+
+@django.test.override_settings(ADMISSION_MAX_IN_FLIGHT=1)
+class TestFallbackToCreate(django.test.TestCase):
+    '''
+    Test that a customer view falling back to create admits the request
+    once.
+    '''
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_update_of_a_new_customer(self):
+        factory = utils.ShopifyRequestFactory()
+        request = factory.customer_update(
+            '/webhooks/shopify/abcd/customer_update',
+            {'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+             'updated_at': '2015-05-27T19:12:19+01:00'})
+        response = views.shopify_customer_update(request, 'abcd')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(models.Customer.objects.filter(shopify_id=1).exists())
+        self.assertEqual(admission.in_flight(), 0)
+
+
+@django.test.override_settings(ADMISSION_MAX_IN_FLIGHT=2)
+class TestInFlight(django.test.SimpleTestCase):
+    '''
+    Test the windowed in-flight counters.
+    '''
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_windows(self):
+        window = admission.IN_FLIGHT_WINDOW
+        first = {admission.LEASE_ENVIRON_KEY: admission._enter(now=10)}
+        second = {admission.LEASE_ENVIRON_KEY: admission._enter(now=window)}
+        self.assertEqual(admission.in_flight(now=window), 2)
+        self.assertIsNone(admission._enter(now=window),
+                          'A request of the previous window was not counted')
+
+        # Released in a later window, from the window it was counted in
+        admission.release(first)
+        self.assertEqual(admission.in_flight(now=window), 1)
+        self.assertEqual(admission.in_flight(now=3 * window), 0)
+
+        caches['default'].delete(second[admission.LEASE_ENVIRON_KEY])
+        admission.release(second)
+        self.assertEqual(admission.in_flight(now=window), 0,
+                         'A forgotten counter went negative')
+
+    def test_keys_and_labels(self):
+        shop = 'shop with spaces \u2603.myshopify.com'
+        self.assertRegex(admission.digest(shop), r'^[0-9a-f]{32}$')
+        labels = set(admission.shop_bucket('%d.myshopify.com' % n)
+                     for n in range(1000))
+        self.assertLessEqual(len(labels), admission.SHOP_BUCKETS)
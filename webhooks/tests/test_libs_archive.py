@@ -0,0 +1,112 @@
+import datetime
+import json
+from decimal import Decimal
+
+import django.test
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from webhooks import models, views
+from webhooks.libs import archive, cache, redaction
+from webhooks.tests import utils
+
+
+class TestArchive(django.test.TestCase):
+    '''
+    Test that old customers are archived, found in the archive and
+    restored by updates.
+    '''
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        self.siteid = 'abcd'
+        self.old = timezone.now() - datetime.timedelta(days=1000)
+
+    def customer(self, shopify_id, updated_at):
+        customer = models.Customer.objects.create(
+            shopify_id=shopify_id, siteid=self.siteid, state='enabled',
+            email='customer%d@example.com' % shopify_id, first_name='First',
+            total_spent=Decimal('12.50'), accepts_marketing=True,
+            updated_at=updated_at)
+        customer.tags.add(models.CustomerTag.get_or_create('vip'))
+        customer.addresses.add(models.CustomerAddress.objects.create(
+            shopify_id=shopify_id, city='Leeds', country_code='GB'))
+        return customer
+
+    def test_archive_and_restore(self):
+        old = self.customer(1, self.old)
+        recent = self.customer(2, timezone.now())
+        cache.get(models.Customer, 1)  # Cached before archiving
+
+        call_command('archive_customers', pause=0, stdout=StringIO())
+        self.assertEqual(list(models.Customer.objects.all()), [recent])
+        self.assertEqual(models.CustomerAddress.objects.count(), 1)
+        archived = models.ArchivedCustomer.objects.get()
+        self.assertEqual(archived.shopify_id, 1)
+        self.assertEqual(archived.month,
+                         datetime.date(self.old.year, self.old.month, 1))
+
+        found = archive.lookup(1)
+        self.assertIsNone(found.pk)
+        self.assertEqual(found.email, old.email)
+        self.assertEqual(found.total_spent, Decimal('12.50'))
+        self.assertEqual(found.updated_at, old.updated_at)
+        with self.assertRaises(models.Customer.DoesNotExist):
+            archive.lookup(3)
+
+        restored = archive.restore(1)
+        self.assertEqual(restored.email_hash, old.email_hash)
+        self.assertTrue(restored.accepts_marketing)
+        self.assertEqual([tag.name for tag in restored.tags.all()], ['vip'])
+        self.assertEqual(restored.addresses.get().city, 'Leeds')
+        self.assertFalse(models.ArchivedCustomer.objects.exists())
+        self.assertIsNone(archive.restore(1))
+
+        record = models.ChangeRecord.objects.get(entity='customer', key=1)
+        self.assertEqual(record.op, models.ChangeRecord.CREATE)
+        data = json.loads(record.data)
+        self.assertEqual(data['email'], old.email)
+        self.assertEqual(data['tags'], 'vip')
+
+    def test_update_restores(self):
+        self.customer(1, self.old)
+        archive.archive_batch(timezone.now(), 10)
+
+        path = '/webhooks/shopify/%s/customer_disable' % self.siteid
+        data = {'id': 1, 'updated_at': '2015-05-27T19:12:19+01:00'}
+        request = self.factory.customer_disable(path, data)
+        response = views.shopify_customer_disable(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+
+        customer = models.Customer.objects.get(shopify_id=1)
+        self.assertEqual(customer.state, 'disabled')
+        self.assertEqual(customer.tags.count(), 1)
+        self.assertFalse(models.ArchivedCustomer.objects.exists())
+
+    def test_create_and_delete_archived(self):
+        self.customer(1, self.old)
+        archive.archive_batch(timezone.now(), 10)
+
+        path = '/webhooks/shopify/%s/customer_create' % self.siteid
+        data = {'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+                'updated_at': '2015-05-27T19:12:19+01:00'}
+        request = self.factory.customer_create(path, data)
+        views.shopify_customer_create(request, self.siteid)
+        self.assertFalse(models.Customer.all_objects.exists(),
+                         'An archived customer was created again')
+
+        path = '/webhooks/shopify/%s/customer_delete' % self.siteid
+        request = self.factory.customer_delete(path, {'id': 1})
+        views.shopify_customer_delete(request, self.siteid)
+        self.assertFalse(models.ArchivedCustomer.objects.exists())
+
+    def test_redaction(self):
+        self.customer(1, self.old)
+        self.customer(2, self.old)
+        self.customer(3, timezone.now())
+        archive.archive_batch(timezone.now() - datetime.timedelta(days=1), 10)
+
+        job = redaction.enqueue(models.RedactionJob.SHOP, self.siteid, 10)
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (2, False))
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (1, True))
+        self.assertFalse(models.ArchivedCustomer.objects.exists())
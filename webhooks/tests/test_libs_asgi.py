@@ -0,0 +1,128 @@
+import asyncio
+import json
+import unittest
+
+import django.test
+
+from webhooks.libs import validate
+from webhooks.libs.asgi import WebhookASGIHandler
+from webhooks.management.commands import compare_frontends
+
+
+class TestWebhookASGIHandler(unittest.TestCase):
+    '''
+    Test that the ASGI handler validates webhooks on the event loop and
+    only hands valid requests to the WSGI application.
+    '''
+    path = '/webhooks/shopify/abcd/customer_create'
+
+    def setUp(self):
+        self.environs = []
+
+        def wsgi_application(environ, start_response):
+            self.environs.append(environ)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'view ', b'output']
+
+        self.handler = WebhookASGIHandler(wsgi_application, max_workers=2)
+
+    def tearDown(self):
+        self.handler.executor.shutdown(wait=True)
+
+    def request(self, path, body=b'', method='POST', headers=None):
+        '''
+        Run the handler for a single request and return the status and
+        body of the response.
+        '''
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'headers': headers or []}
+        received = [{'type': 'http.request', 'body': body[:2],
+                     'more_body': True},
+                    {'type': 'http.request', 'body': body[2:]}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.handler(scope, receive, send))
+        finally:
+            loop.close()
+
+        return sent[0]['status'], sent[1]['body']
+
+    def webhook_headers(self, body, hmac_value=None):
+        if hmac_value is None:
+            hmac_value = validate.compute_hmac(body)
+        return [(b'x-shopify-shop-domain', b'example.myshopify.com'),
+                (b'x-request-id', b'1234'),
+                (b'x-shopify-topic', b'customers/create'),
+                (b'x-shopify-hmac-sha256', hmac_value.encode('latin1')),
+                (b'content-type', b'application/json')]
+
+    def test_valid_request(self):
+        body = json.dumps({'id': None}).encode('utf8')
+        status, content = self.request(self.path, body,
+                                       headers=self.webhook_headers(body))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(content, b'view output')
+        self.assertEqual(len(self.environs), 1)
+        environ = self.environs[0]
+        self.assertTrue(environ[validate.PREVALIDATED_ENVIRON_KEY])
+        self.assertEqual(environ['wsgi.input'].read(), body)
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['HTTP_X_SHOPIFY_TOPIC'], 'customers/create')
+
+    def test_invalid_hmac(self):
+        body = b'{"id": 1}'
+        headers = self.webhook_headers(body, hmac_value='0' * 43 + '=')
+        status, content = self.request(self.path, body, headers=headers)
+
+        self.assertEqual(status, 403)
+        self.assertEqual(self.environs, [],
+                         'Invalid request reached the WSGI application')
+
+    @django.test.override_settings(WEBHOOK_MAX_BODY_SIZE=4,
+                                   WEBHOOK_MAX_BODY_SIZES={})
+    def test_too_large(self):
+        body = b'{"id": 1}'
+        headers = self.webhook_headers(body)
+        status, content = self.request(self.path, body, headers=headers)
+        self.assertEqual(status, 413)
+
+        headers.append((b'content-length', str(len(body)).encode('latin1')))
+        status, content = self.request(self.path, body, headers=headers)
+        self.assertEqual(status, 413)
+        self.assertEqual(self.environs, [])
+
+    def test_get_request(self):
+        status, content = self.request(self.path, method='GET')
+
+        self.assertEqual(status, 405)
+        self.assertEqual(self.environs, [])
+
+    def test_other_paths_pass_through(self):
+        status, content = self.request('/admin/', method='GET')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(len(self.environs), 1)
+        self.assertNotIn(validate.PREVALIDATED_ENVIRON_KEY, self.environs[0])
+
+
+class TestCompareFrontends(unittest.TestCase):
+    '''
+    Test that the front end comparison serves the same requests through
+    both front ends.
+    '''
+    def test_measure(self):
+        options = {'requests': 10, 'concurrency': 4, 'workers': 2,
+                   'body_delay': 0, 'view_time': 0, 'invalid': 0.2}
+        for frontend in ('wsgi', 'asgi'):
+            result = compare_frontends.measure(dict(options,
+                                                    frontend=frontend))
+            self.assertEqual(result['statuses'], {200: 8, 403: 2}, frontend)
@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+import unittest
+
+import django.test
+from django.core.signals import request_finished
+from django.db import transaction
+
+from webhooks import models, views
+from webhooks.libs import cache, metrics, redaction
+from webhooks.tests import utils
+
+
+class TestLRU(unittest.TestCase):
+    def test_eviction(self):
+        lru = cache.LRU(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertIsNone(lru.get('b'), 'The least recently used entry was kept')
+        self.assertEqual(len(lru), 2)
+
+    def test_expiry(self):
+        lru = cache.LRU(2, 0)
+        lru.set('a', 1)
+        time.sleep(0.001)
+        self.assertIsNone(lru.get('a'))
+
+
+class TestObjectCache(django.test.TransactionTestCase):
+    '''
+    Test the cache outside transactions, as the webhook views use it.
+    '''
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.customer = models.Customer(shopify_id=1, first_name='Bob',
+                                        state='enabled')
+        self.customer.save()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            customer = cache.get(models.Customer, 1)
+        self.assertEqual(customer.first_name, 'Bob')
+        with self.assertNumQueries(0):
+            cache.get(models.Customer, 1)
+        cache.local().clear()
+        with self.assertNumQueries(0):
+            cache.get(models.Customer, 1)
+
+        self.assertEqual(metrics.get('cache.hit', 'customer', 'local'), 1)
+        self.assertEqual(metrics.get('cache.hit', 'customer', 'shared'), 1)
+        self.assertEqual(metrics.get('cache.miss', 'customer'), 1)
+        self.assertEqual(cache.hit_ratios()['customer'],
+                         {'local': 1 / 3, 'shared': 1 / 3})
+
+    def test_missing(self):
+        for count in (1, 0):
+            with self.assertNumQueries(count):
+                with self.assertRaises(models.Customer.DoesNotExist):
+                    cache.get(models.Customer, 2)
+
+        self.assertIsNone(cache.local().get(
+            cache.make_key(models.Customer, 2)),
+            'An unknown ID was kept in the LRU of the process')
+
+        models.Customer(shopify_id=2, state='enabled').save()
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(models.Customer, 2).shopify_id, 2)
+
+    def test_write_paths(self):
+        customer = cache.get(models.Customer, 1)
+        customer.first_name = 'Robert'
+        customer.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(models.Customer, 1).first_name,
+                             'Robert')
+
+        customer.delete()
+        with self.assertRaises(models.Customer.DoesNotExist):
+            cache.get(models.Customer, 1)
+
+    def test_copies(self):
+        cache.get(models.Customer, 1).first_name = 'Changed'
+        self.assertEqual(cache.get(models.Customer, 1).first_name, 'Bob',
+                         'An unsaved change leaked into the cache')
+
+    def test_stampede(self):
+        '''
+        Lookups wait for the process already loading the entry.
+        '''
+        key = cache.make_key(models.Customer, 1)
+        value = cache._fetch(models.Customer, 1)
+        cache.backend().add(key + ':lock', 1)
+        timer = threading.Timer(0.05, cache.backend().set, (key, value))
+        timer.start()
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(models.Customer, 1).first_name, 'Bob')
+        timer.join()
+
+    def test_transaction(self):
+        with transaction.atomic():
+            cache.get(models.Customer, 1)
+        self.assertIsNone(cache.backend().get(
+            cache.make_key(models.Customer, 1)),
+            'An entry read inside a transaction was stored')
+
+    def test_read_before_commit(self):
+        key = cache.make_key(models.Customer, 1)
+        with transaction.atomic():
+            stale = cache._fetch(models.Customer, 1)
+            customer = models.Customer.objects.get(shopify_id=1)
+            customer.first_name = 'Robert'
+            customer.save()
+            # Another process reads the row before the commit
+            cache.backend().set(key, stale)
+
+        self.assertEqual(cache.get(models.Customer, 1).first_name, 'Robert',
+                         'The state from before the commit was cached')
+
+    def test_dropped_when_the_request_finishes(self):
+        key = cache.make_key(models.Customer, 1)
+        with transaction.atomic():
+            cache.invalidate(models.Customer, 1)
+            cache.backend().set(key, cache._fetch(models.Customer, 1))
+        request_finished.send(sender=self.__class__)
+        self.assertIsNone(cache.backend().get(key))
+
+
+class TestStaleCopies(django.test.TransactionTestCase):
+    '''
+    Test that the customer views do not write back the copy of a
+    customer that the LRU of another process still holds after a
+    set-based write.
+    '''
+    def setUp(self):
+        cache.clear()
+        self.factory = utils.ShopifyRequestFactory()
+        models.Customer(shopify_id=1, first_name='Bob', email='b@example.com',
+                        state='enabled', siteid='abcd').save()
+        self.key = cache.make_key(models.Customer, 1)
+        self.stale = cache._fetch(models.Customer, 1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def post(self, view, data):
+        path = '/webhooks/shopify/abcd/%s' % view
+        request = getattr(self.factory, view)(path, data)
+        response = getattr(views, 'shopify_' + view)(request, 'abcd')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def other_process_copy(self):
+        # What another process kept in its LRU before the write
+        cache.local().set(self.key, self.stale)
+
+    def test_tombstone(self):
+        self.post('customer_delete', {'id': 1})
+        self.other_process_copy()
+        self.post('customer_disable', {
+            'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+            'updated_at': '2015-05-27T19:12:19+01:00'})
+        customer = models.Customer.all_objects.get(shopify_id=1)
+        self.assertIsNotNone(customer.deleted_at,
+                             'A deleted customer was brought back')
+        self.assertEqual(customer.state, 'enabled')
+
+    def test_redaction(self):
+        job = redaction.enqueue(models.RedactionJob.CUSTOMER, 'abcd', 7, 1)
+        redaction.redact_chunk(job.id, 10)
+        self.other_process_copy()
+        self.post('customer_update', {
+            'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+            'updated_at': '2015-05-27T19:12:19+01:00', 'note': 'Called'})
+        customer = models.Customer.all_objects.get(shopify_id=1)
+        self.assertEqual(customer.email, '', 'Redacted data was restored')
+
+    def test_update_fields(self):
+        self.other_process_copy()
+        models.Customer.objects.filter(shopify_id=1).update(
+            first_name='Robert')
+        self.post('customer_update', {
+            'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+            'updated_at': '2015-05-27T19:12:19+01:00', 'note': 'Called'})
+        customer = models.Customer.objects.get(shopify_id=1)
+        self.assertEqual(customer.note, 'Called')
+        self.assertEqual(customer.first_name, 'Robert',
+                         'A stale copy overwrote a field the update left')
+
+    def test_shop_update(self):
+        models.Shop(shopify_id=2, name='Old', email='s@example.com').save()
+        cache.local().set(cache.make_key(models.Shop, 2),
+                          cache._fetch(models.Shop, 2))
+        models.Shop.objects.filter(shopify_id=2).update(city='Ottawa')
+
+        path = '/webhooks/shopify/abcd/shop_update'
+        request = self.factory.shop_update(path, {'id': 2, 'name': 'New'})
+        response = views.shopify_shop_update(request, 'abcd')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        shop = models.Shop.objects.get(shopify_id=2)
+        self.assertEqual(shop.name, 'New')
+        self.assertEqual(shop.city, 'Ottawa',
+                         'A stale copy overwrote a field the update left')
+        record = models.ChangeRecord.objects.filter(entity='shop').last()
+        self.assertEqual(json.loads(record.data), {'name': 'New'})
@@ -0,0 +1,154 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import django.test
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from webhooks import models, views
+from webhooks.libs import changelog
+from webhooks.tests import utils
+
+
+CUSTOMER = {
+    'id': 1,
+    'created_at': '2015-05-27T19:12:18+01:00',
+    'updated_at': '2015-05-27T19:12:19+01:00',
+    'email': 'bob@example.com',
+    'first_name': 'Bob',
+    'state': 'enabled',
+    'tags': 'vip',
+}
+
+
+@django.test.override_settings(CHANGELOG_SETTLE=0, CHANGELOG_POLL_INTERVAL=0.01)
+class TestChangelog(django.test.TestCase):
+    '''
+    Test that the webhook views record their writes and that consumers
+    can read them from an offset.
+    '''
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        self.siteid = 'abcd'
+
+    def post(self, view, method, data):
+        path = '/webhooks/shopify/%s/%s' % (self.siteid, view)
+        request = getattr(self.factory, method)(path, data)
+        response = getattr(views, 'shopify_' + view)(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+
+    def records(self):
+        return [changelog.as_dict(record) for record in changelog.read(0)]
+
+    def test_views(self):
+        self.post('customer_create', 'customer_create', CUSTOMER)
+        self.post('customer_update', 'customer_update',
+                  dict(CUSTOMER, first_name='Robert'))
+        self.post('customer_update', 'customer_update',
+                  dict(CUSTOMER, first_name='Robert'))  # Unchanged
+        self.post('customer_disable', 'customer_disable',
+                  {'id': 1, 'updated_at': '2015-05-28T10:00:00+01:00'})
+        self.post('customer_delete', 'customer_delete', {'id': 1})
+        self.post('customer_delete', 'customer_delete', {'id': 2})
+
+        records = self.records()
+        self.assertEqual([(record['op'], record['key']) for record in records],
+                         [('create', 1), ('update', 1), ('update', 1),
+                          ('delete', 1)])
+        self.assertEqual(records[0]['data']['email'], 'bob@example.com')
+        self.assertEqual(records[0]['data']['tags'], 'vip')
+        self.assertNotIn('email_hash', records[0]['data'])
+        self.assertEqual(records[1]['data'], {'first_name': 'Robert'})
+        self.assertEqual(sorted(records[2]['data']), ['state', 'updated_at'])
+        offsets = [record['offset'] for record in records]
+        self.assertEqual(offsets, sorted(offsets))
+
+    def test_endpoint(self):
+        self.post('customer_create', 'customer_create', CUSTOMER)
+        self.post('shop_update', 'shop_update', {'id': 5, 'name': 'Shop'})
+        client = django.test.Client()
+
+        response = client.get('/webhooks/changes', {'limit': 1})
+        body = json.loads(response.content.decode('utf8'))
+        self.assertEqual([change['entity'] for change in body['changes']],
+                         ['customer'])
+
+        response = client.get('/webhooks/changes', {'after': body['next']})
+        body = json.loads(response.content.decode('utf8'))
+        self.assertEqual([change['entity'] for change in body['changes']],
+                         ['shop'])
+
+        start = time.time()
+        response = client.get('/webhooks/changes',
+                              {'after': body['next'], 'wait': 0.1})
+        self.assertGreaterEqual(time.time() - start, 0.1,
+                                'The request did not wait for changes')
+        self.assertEqual(json.loads(response.content.decode('utf8')),
+                         {'changes': [], 'next': body['next']})
+
+        response = client.get('/webhooks/changes', {'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+        for wait in ('nan', 'inf'):
+            response = client.get('/webhooks/changes', {'wait': wait})
+            self.assertEqual(response.status_code, 400)
+        response = client.get('/webhooks/changes', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_written_with_the_change(self):
+        path = '/webhooks/shopify/%s/customer_create' % self.siteid
+        request = self.factory.customer_create(path, CUSTOMER)
+        with mock.patch.object(changelog, 'append',
+                               side_effect=RuntimeError('crashed')):
+            with self.assertRaises(RuntimeError):
+                views.shopify_customer_create(request, self.siteid)
+        self.assertFalse(models.Customer.objects.exists(),
+                         'A change was committed without its record')
+
+    @django.test.override_settings(CHANGELOG_SETTLE=60)
+    def test_unsettled_records_are_held_back(self):
+        self.post('customer_create', 'customer_create', CUSTOMER)
+        self.assertEqual(changelog.read(0), [])
+
+    def test_compact(self):
+        self.post('customer_create', 'customer_create', CUSTOMER)
+        for name in ('Rob', 'Robert'):
+            self.post('customer_update', 'customer_update',
+                      dict(CUSTOMER, first_name=name))
+        self.post('shop_update', 'shop_update', {'id': 5, 'name': 'Shop'})
+        self.post('customer_create', 'customer_create', dict(CUSTOMER, id=2))
+        self.post('customer_delete', 'customer_delete', {'id': 2})
+        latest = [record.id for record in changelog.read(0)]
+
+        call_command('compact_changelog', upto=latest[-1], stdout=StringIO())
+        records = self.records()
+        self.assertEqual(
+            [(record['offset'], record['op'], record['key'])
+             for record in records],
+            [(latest[2], 'create', 1), (latest[3], 'create', 5),
+             (latest[5], 'delete', 2)])
+        self.assertEqual(records[0]['data']['first_name'], 'Robert')
+        self.assertEqual(records[0]['data']['email'], 'bob@example.com')
+        self.assertEqual(records[2]['data'], {})
+
+    def test_tail(self):
+        self.post('customer_create', 'customer_create', CUSTOMER)
+        self.post('customer_create', 'customer_create', dict(CUSTOMER, id=2))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cursor = os.path.join(directory, 'cursor')
+
+        out = StringIO()
+        call_command('tail_changelog', cursor_file=cursor, stdout=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['key'] for line in lines], [1, 2])
+
+        self.post('customer_create', 'customer_create', dict(CUSTOMER, id=3))
+        out = StringIO()
+        call_command('tail_changelog', cursor_file=cursor, stdout=out)
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([line['key'] for line in lines], [3],
+                         'The tail did not resume from the cursor')
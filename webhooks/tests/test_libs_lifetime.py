@@ -0,0 +1,167 @@
+import datetime
+from decimal import Decimal
+
+import django.test
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from webhooks import models, views
+from webhooks.tests import utils
+
+
+def order(shopify_id, total, day, customer=7):
+    return {
+        'id': shopify_id,
+        'customer': {'id': customer} if customer else None,
+        'total_price': total,
+        'currency': 'GBP',
+        'processed_at': '2015-06-%02dT10:00:00+00:00' % day,
+    }
+
+
+def refund(shopify_id, order_id, *amounts):
+    return {
+        'id': shopify_id,
+        'order_id': order_id,
+        'transactions': [{'id': index, 'kind': 'refund',
+                          'status': 'success', 'amount': amount}
+                         for index, amount in enumerate(amounts)] +
+                        [{'id': 99, 'kind': 'refund', 'status': 'failure',
+                          'amount': '99.00'}],
+    }
+
+
+class TestLifetimeValues(django.test.TestCase):
+    '''
+    Test that the order and refund webhooks keep the lifetime values of
+    customers up to date, and that reconciliation finds and fixes those
+    that drift.
+    '''
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        self.siteid = 'abcd'
+
+    def post(self, view, data, status=200):
+        path = '/webhooks/shopify/%s/%s' % (self.siteid, view)
+        request = getattr(self.factory, view)(path, data)
+        response = getattr(views, 'shopify_' + view)(request, self.siteid)
+        self.assertEqual(response.status_code, status)
+
+    def value(self, customer=7):
+        return models.CustomerLifetimeValue.objects.get(
+            customer_shopify_id=customer)
+
+    def test_orders_and_refunds(self):
+        self.post('order_paid', order(1, '20.00', 3))
+        self.post('order_paid', order(1, '20.00', 3))  # Redelivered
+        self.post('order_paid', order(2, '10.50', 1))
+        self.post('refund_create', refund(10, 1, '5.00', '1.25'))
+        self.post('refund_create', refund(10, 1, '5.00', '1.25'))
+
+        value = self.value()
+        self.assertEqual(value.orders_count, 2)
+        self.assertEqual(value.gross, Decimal('30.50'))
+        self.assertEqual(value.refunds, Decimal('6.25'))
+        self.assertEqual(value.net, Decimal('24.25'))
+        self.assertEqual(value.average_order_value, Decimal('12.12'))
+        self.assertEqual(value.first_order_at.day, 1)
+        self.assertEqual(value.last_order_at.day, 3)
+
+        self.post('order_cancelled', order(1, '20.00', 3))
+        self.post('order_cancelled', order(1, '20.00', 3))
+        value = self.value()
+        self.assertEqual(value.orders_count, 1)
+        self.assertEqual(value.gross, Decimal('10.50'))
+        self.assertEqual(value.refunds, Decimal('0.00'))
+        self.assertEqual(value.net, Decimal('10.50'))
+        self.assertEqual(value.last_order_at.day, 1)
+
+        # A refund of a cancelled order does not count
+        self.post('refund_create', refund(11, 1, '2.00'))
+        self.assertEqual(self.value().refunds, Decimal('0.00'))
+
+    def test_out_of_order(self):
+        self.post('refund_create', refund(10, 1, '4.00'))
+        self.post('order_paid', order(1, '20.00', 3))
+        self.assertEqual(self.value().net, Decimal('16.00'),
+                         'An earlier refund was not counted')
+
+        self.post('order_cancelled', order(2, '5.00', 4))
+        self.post('order_paid', order(2, '5.00', 4))
+        self.assertEqual(self.value().orders_count, 1,
+                         'A cancelled order was counted when paid')
+
+    def test_guest_and_invalid_orders(self):
+        self.post('order_paid', order(1, '20.00', 3, customer=None))
+        self.assertFalse(models.CustomerLifetimeValue.objects.exists())
+        self.assertTrue(models.Order.objects.get(shopify_id=1).paid_at)
+
+        self.post('order_paid', dict(order(2, '1.00', 3),
+                                     customer={'id': 'x'}), status=400)
+        self.post('refund_create', {'id': 3}, status=400)
+
+    def test_refund_line_items(self):
+        self.post('order_paid', order(1, '20.00', 3))
+        data = dict(refund(10, 1, '6.00'), note='Damaged', refund_line_items=[
+            {'id': 100, 'line_item_id': 5, 'quantity': 2,
+             'restock_type': 'return', 'subtotal': '5.00',
+             'total_tax': '1.00'},
+            {'id': 101, 'line_item_id': 6, 'quantity': 1}])
+        self.post('refund_create', data)
+        self.post('refund_create', data)  # Redelivered
+        self.post('refund_create', refund(11, 1, '1.50'))
+
+        refund_10 = models.Refund.objects.get(shopify_id=10)
+        self.assertEqual(refund_10.note, 'Damaged')
+        line_items = list(refund_10.line_items.order_by('shopify_id'))
+        self.assertEqual([(item.line_item_id, item.quantity, item.subtotal)
+                          for item in line_items],
+                         [(5, 2, Decimal('5.00')), (6, 1, Decimal('0.00'))])
+        self.assertEqual(line_items[0].restock_type, 'return')
+        self.assertEqual(models.RefundLineItem.objects.count(), 2)
+        self.assertEqual(models.Order.objects.get(shopify_id=1).total_refunded,
+                         Decimal('7.50'))
+        self.assertEqual(self.value().refunds, Decimal('7.50'))
+
+        data = dict(refund(12, 1, '1.00'), refund_line_items=[
+            {'id': 102, 'quantity': 'two'}])
+        self.post('refund_create', data, status=400)
+        self.post('refund_create', dict(data, refund_line_items=[{}]),
+                  status=400)
+        self.assertFalse(models.Refund.objects.filter(shopify_id=12).exists())
+
+    def test_reconcile(self):
+        self.post('order_paid', order(1, '20.00', 3))
+        self.post('order_paid', order(2, '10.00', 4, customer=8))
+        self.post('refund_create', refund(10, 2, '3.00'))
+        models.CustomerLifetimeValue.objects.filter(
+            customer_shopify_id=8).update(net=Decimal('1.00'),
+                                          orders_count=5)
+        models.CustomerLifetimeValue.objects.create(customer_shopify_id=9,
+                                                    gross=Decimal('4.00'))
+        models.Order.objects.filter(shopify_id=2).update(
+            total_refunded=Decimal('2.00'))
+
+        out = StringIO()
+        call_command('reconcile_lifetime_values', batch_size=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines, [
+            'order 2: total_refunded 2.00 != 3.00',
+            '1 order totals differ',
+            'customer 8: orders_count 5 != 1, net 1.00 != 7.00',
+            'customer 9: gross 4.00 != 0.00',
+            '2 lifetime values differ',
+        ])
+
+        call_command('reconcile_lifetime_values', fix=True, stdout=out)
+        out = StringIO()
+        call_command('reconcile_lifetime_values', stdout=out)
+        self.assertEqual(out.getvalue(), '0 order totals differ\n'
+                         '0 lifetime values differ\n')
+        self.assertEqual(models.Order.objects.get(shopify_id=2).total_refunded,
+                         Decimal('3.00'))
+        self.assertEqual(self.value(8).net, Decimal('7.00'))
+        self.assertEqual(self.value(8).first_order_at,
+                         datetime.datetime(2015, 6, 4, 10,
+                                           tzinfo=timezone.utc))
@@ -0,0 +1,112 @@
+import collections
+import http.server
+import json
+import random
+import socketserver
+import threading
+import unittest
+
+from django.core import urlresolvers
+
+from webhooks.libs import ingress, loadgen, schema, validate
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(loadgen.parse_mix('customers/create=2, carts/update'),
+                         [('customers/create', 2.0), ('carts/update', 1.0)])
+        for value in ('customers/nope=1', 'carts/update=x',
+                      'carts/update=0', 'carts/update=-1'):
+            with self.assertRaises(ValueError):
+                loadgen.parse_mix(value)
+
+    def test_payloads(self):
+        '''
+        Test that every generated payload is signed and passes the
+        schema of its topic.
+        '''
+        rng = random.Random(0)
+        for topic in loadgen.TOPICS:
+            mix = [(topic, 1)]
+            _, path, headers, body = loadgen.build_request(rng, mix, 'abc', 10)
+            self.assertEqual(headers['X-Shopify-Topic'], topic)
+            self.assertTrue(path.startswith('/webhooks/shopify/abc/'))
+            self.assertTrue(validate.verify_hmac(
+                body, headers['X-Shopify-Hmac-Sha256']))
+            self.assertIsNone(schema.CHECKS[topic](json.loads(body.decode())),
+                              'Invalid %s payload' % topic)
+
+    def test_summarise(self):
+        result = {'latencies': [i / 1000 for i in range(1, 101)],
+                  'statuses': collections.Counter({200: 98, 503: 2}),
+                  'failures': collections.Counter(), 'elapsed': 4}
+        summary = loadgen.summarise(result, duration=2, target_rate=50)
+        self.assertEqual(summary['throughput'], 25)
+        self.assertEqual(summary['p50'], 0.051)
+        self.assertEqual(summary['p99'], 0.1)
+        self.assertEqual(summary['error_rate'], 0.02)
+
+        self.assertTrue(loadgen.saturated(summary, max_p99=1),
+                        'Falling behind the target rate is saturation')
+        result['elapsed'] = 2.1
+        summary = loadgen.summarise(result, duration=2, target_rate=50)
+        self.assertTrue(loadgen.saturated(summary, max_p99=0.05))
+        self.assertTrue(loadgen.saturated(summary, max_p99=1))
+        summary['error_rate'] = 0
+        self.assertFalse(loadgen.saturated(summary, max_p99=1))
+
+
+class WebhookHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Check generated requests the way the webhook stack would, without a
+    database: route, headers, HMAC and payload schema.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        topic = self.headers['X-Shopify-Topic']
+        meta = ingress.parse_headers('%s: %s' % header
+                                     for header in self.headers.items())
+        try:
+            urlresolvers.resolve(self.path)
+            valid = (validate.check_shopify_webhook_request('POST', meta) is None and
+                     validate.verify_hmac(
+                         body, self.headers['X-Shopify-Hmac-Sha256']) and
+                     schema.CHECKS[topic](json.loads(body.decode())) is None)
+        except urlresolvers.Resolver404:
+            valid = False
+        self.server.connections.add(self.client_address)
+        self.send_response(200 if valid else 400)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLoadGeneratorLive(unittest.TestCase):
+    '''
+    Post every topic to a local server over one keep-alive connection.
+    '''
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      WebhookHandler)
+        self.server.daemon_threads = True
+        self.server.connections = set()
+        threading.Thread(target=self.server.serve_forever).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_connection(self):
+        mix = [(topic, 1) for topic in loadgen.TOPICS]
+        url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+        result = loadgen.run_connection(url, 'abc', mix, rate=200,
+                                        open_loop=True, duration=0.3,
+                                        keyspace=20, seed=0)
+        self.assertGreater(len(result['latencies']), 10)
+        self.assertEqual(result['failures'], collections.Counter())
+        self.assertEqual(len(self.server.connections), 1,
+                         'The connection was not kept alive')
@@ -0,0 +1,76 @@
+import datetime
+from decimal import Decimal
+import unittest
+
+from webhooks import models
+from webhooks.libs import mapping
+
+
+class TestCompileMapper(unittest.TestCase):
+    '''
+    Test the functions built by compile_mapper.
+    '''
+    def test_coercion(self):
+        customer = models.Customer()
+        models.Customer.copy_payload(customer, {
+            'email': 'testme@example.com',
+            'orders_count': '3',
+            'total_spent': '12.50',
+            'created_at': '2015-05-27T19:12:18+01:00',
+            'verified_email': 1,
+        })
+
+        self.assertEqual(customer.email, 'testme@example.com')
+        self.assertEqual(customer.orders_count, 3)
+        self.assertEqual(customer.total_spent, Decimal('12.50'))
+        self.assertEqual(customer.created_at,
+                         datetime.datetime(2015, 5, 27, 18, 12, 18,
+                                           tzinfo=datetime.timezone.utc))
+        self.assertIs(customer.verified_email, True)
+
+    def test_booleans(self):
+        customer = models.Customer()
+        models.Customer.copy_payload(customer, {'verified_email': 'false',
+                                                'tax_exempt': 'true',
+                                                'accepts_marketing': False})
+        self.assertIs(customer.verified_email, False)
+        self.assertIs(customer.tax_exempt, True)
+        self.assertIs(customer.accepts_marketing, False)
+
+        shop = models.Shop()
+        models.Shop.copy_payload(shop, {'taxes_included': 'false'})
+        self.assertIs(shop.taxes_included, False)
+
+        for value in ('no', 'False', 2, [], {}):
+            with self.assertRaises(ValueError):
+                models.Customer.copy_payload(customer,
+                                             {'verified_email': value})
+
+    def test_missing_and_null_values(self):
+        customer = models.Customer(note='keep me', last_order_id=5)
+        models.Customer.copy_payload(customer, {'note': None,
+                                                'last_order_id': None})
+
+        self.assertEqual(customer.note, 'keep me',
+                         'None was copied to a non-nullable field')
+        self.assertIsNone(customer.last_order_id,
+                          'None was not copied to a nullable field')
+        self.assertEqual(customer.state, '',
+                         'A missing key changed the field')
+
+    def test_renames_and_nested(self):
+        copy = mapping.compile_mapper(
+            models.Customer, ['email'],
+            nested={'addresses': (models.CustomerAddress,
+                                  models.CustomerAddress.copy_payload)})
+        customer = models.Customer()
+        children = copy(customer, {
+            'email': 'testme@example.com',
+            'addresses': [{'id': 638359939, 'country_code': 'US'},
+                          {'id': 638359940, 'country_code': 'CA'}]})
+
+        addresses = children['addresses']
+        self.assertEqual([a.shopify_id for a in addresses],
+                         [638359939, 638359940])
+        self.assertEqual([a.country_code for a in addresses], ['US', 'CA'])
+        self.assertEqual(copy(customer, {}), {})
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+
+import django.http
+import django.test
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from webhooks.libs import profiling
+from webhooks.libs.validate import ValidateShopifyWebhookRequest
+from webhooks.tests import utils
+
+
+@ValidateShopifyWebhookRequest
+def dummy_view(request, siteid):
+    return django.http.HttpResponse()
+
+
+class TestProfiling(django.test.SimpleTestCase):
+    '''
+    Test that sampled and flagged webhook requests are profiled per
+    topic, and that the profiles can be reported.
+    '''
+    path = '/webhooks/shopify/abcd/customer_create'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = django.test.override_settings(
+            PROFILE_DIR=self.directory, PROFILE_SAMPLE_RATE=0,
+            PROFILE_SECRET='s3cret')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def request(self, topic, token=None):
+        override = {}
+        if token is not None:
+            override[profiling.HEADER] = token
+        factory = utils.ShopifyRequestFactory(override=override)
+        request = factory.create_shopify_webhook_request(
+            self.path, {'id': 1}, topic)
+        self.assertEqual(dummy_view(request, 'abcd').status_code, 200)
+
+    def test_header(self):
+        self.request('customers/create')
+        self.request('customers/create', 'wrong')
+        self.assertEqual(profiling.profiles(), {})
+
+        self.request('customers/create', 's3cret')
+        self.request('customers/create', 's3cret')
+        self.request('orders/paid', 's3cret')
+        found = profiling.profiles()
+        self.assertEqual(sorted(found), ['customers_create', 'orders_paid'])
+        self.assertEqual(len(found['customers_create']), 2)
+
+    @django.test.override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_sampling(self):
+        self.request('customers/create')
+        self.assertEqual(len(profiling.profiles()['customers_create']), 1)
+
+    @django.test.override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_report(self):
+        self.request('customers/create')
+        self.request('customers/create')
+        self.request('orders/paid')
+
+        out = StringIO()
+        call_command('profile_report', topic=['customers/create'],
+                     delete=True, stdout=out)
+        report = out.getvalue()
+        self.assertIn('=== customers_create: 2 profiles ===', report)
+        self.assertIn('(dummy_view)', report)
+        self.assertNotIn('orders_paid', report)
+        self.assertEqual(sorted(profiling.profiles()), ['orders_paid'])
+
+    @django.test.override_settings(PROFILE_SAMPLE_RATE=1)
+    def test_forged_and_unknown_requests(self):
+        factory = utils.ShopifyRequestFactory()
+        request = factory.create_shopify_webhook_request(
+            self.path, {'id': 1}, 'customers/create')
+        request.META['HTTP_X_SHOPIFY_HMAC_SHA256'] = '0' * 43 + '='
+        self.assertEqual(dummy_view(request, 'abcd').status_code, 403)
+        self.request('made/up')
+        self.request('../../etc')
+        self.assertEqual(profiling.profiles(), {})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_unwritable_directory(self):
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        with self.settings(PROFILE_DIR=path):
+            self.request('customers/create', 's3cret')
@@ -0,0 +1,123 @@
+import django.test
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from webhooks import models, views
+from webhooks.libs import cache, changelog, redaction
+from webhooks.tests import utils
+
+
+def customer(shopify_id, siteid='abcd', **kwargs):
+    customer = models.Customer.objects.create(
+        shopify_id=shopify_id, siteid=siteid, state='enabled',
+        email='customer%d@example.com' % shopify_id,
+        first_name='First', last_name='Last', **kwargs)
+    customer.tags.add(models.CustomerTag.get_or_create('vip'))
+    customer.addresses.add(models.CustomerAddress.objects.create(
+        shopify_id=shopify_id, name='Home'))
+    models.Checkout.objects.create(
+        shopify_id=shopify_id, token=str(shopify_id),
+        customer_shopify_id=shopify_id, email=customer.email)
+    return customer
+
+
+class TestRedaction(django.test.TestCase):
+    '''
+    Test that the redact webhooks queue jobs and that the jobs erase the
+    right customers in chunks.
+    '''
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        self.siteid = 'abcd'
+
+    def assertRedacted(self, shopify_id):
+        redacted = models.Customer.all_objects.get(shopify_id=shopify_id)
+        self.assertEqual(redacted.email, '')
+        self.assertEqual(redacted.last_name, '')
+        self.assertIsNotNone(redacted.deleted_at)
+        self.assertFalse(redacted.tags.exists())
+        self.assertFalse(models.CustomerAddress.objects.filter(
+            shopify_id=shopify_id).exists())
+        self.assertEqual(
+            models.Checkout.objects.get(shopify_id=shopify_id).email, '')
+
+    def test_customers_redact(self):
+        changelog.created(customer(1))
+        kept = customer(2)
+        changelog.created(kept)
+        path = '/webhooks/shopify/%s/customers_redact' % self.siteid
+        data = {'shop_id': 10, 'shop_domain': 'abcd.myshopify.com',
+                'customer': {'id': 1, 'email': 'customer1@example.com'},
+                'orders_to_redact': []}
+        request = self.factory.customers_redact(path, data)
+        response = views.shopify_customers_redact(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Customer.objects.count(), 2,
+                         'The customer was redacted in the request')
+
+        for payload in ('{"id": 1, "tags": ""}', '{"id": 12}',
+                        '{"customer_id": 1}', '{"note": "x", "id": 1'):
+            models.SlowEvent.objects.create(topic='customers/update',
+                                            duration=1, payload=payload)
+
+        call_command('redact', stdout=StringIO())
+        self.assertRedacted(1)
+        self.assertEqual(list(models.SlowEvent.objects.values_list(
+            'payload', flat=True)), ['{"id": 12}'],
+            'The slow events of the customer were kept')
+        self.assertEqual(list(models.Customer.objects.all()), [kept])
+        self.assertEqual(kept.tags.count(), 1)
+        self.assertFalse(redaction.pending().exists())
+        self.assertEqual(
+            list(models.ChangeRecord.objects.values_list('key', flat=True)),
+            [2], 'The changelog still holds the redacted customer')
+
+    def test_shop_redact(self):
+        for shopify_id in range(1, 6):
+            customer(shopify_id)
+        customer(6, siteid='other')
+        models.Shop.objects.create(shopify_id=10, name='Shop',
+                                   myshopify_domain='abcd.myshopify.com')
+        for shop in ('abcd.myshopify.com', 'other.myshopify.com'):
+            models.SlowEvent.objects.create(topic='carts/update', shop=shop,
+                                            duration=1)
+        cache.get(models.Customer, 1)  # Cached before the redaction
+
+        path = '/webhooks/shopify/%s/shop_redact' % self.siteid
+        data = {'shop_id': 10, 'shop_domain': 'abcd.myshopify.com'}
+        request = self.factory.shop_redact(path, data)
+        response = views.shopify_shop_redact(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+
+        job = redaction.pending().get()
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (2, False))
+        job.refresh_from_db()
+        self.assertEqual(job.cursor,
+                         models.Customer.all_objects.get(shopify_id=2).pk)
+        self.assertTrue(models.Shop.objects.exists())
+
+        # Resume where the last chunk stopped
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (2, False))
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (1, True))
+        self.assertEqual(redaction.redact_chunk(job.pk, 2), (0, True))
+        for shopify_id in range(1, 6):
+            self.assertRedacted(shopify_id)
+        self.assertEqual(models.Customer.objects.get().shopify_id, 6)
+        self.assertFalse(models.Shop.objects.exists())
+        self.assertEqual(models.SlowEvent.objects.get().shop,
+                         'other.myshopify.com')
+        with self.assertRaises(models.Customer.DoesNotExist):
+            cache.get(models.Customer, 1)
+
+    def test_invalid_payload(self):
+        path = '/webhooks/shopify/%s/customers_redact' % self.siteid
+        data = {'shop_id': 10, 'customer': {}}
+        request = self.factory.customers_redact(path, data)
+        response = views.shopify_customers_redact(request, self.siteid)
+        self.assertEqual(response.status_code, 400)
+
+        data = {'shop_id': None}
+        request = self.factory.customers_redact(path, data)
+        response = views.shopify_customers_redact(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(redaction.pending().exists())
@@ -0,0 +1,122 @@
+import unittest
+
+import django.test
+
+from webhooks import views
+from webhooks.libs import metrics, schema
+from webhooks.tests import utils
+
+
+class TestCompileSchema(unittest.TestCase):
+    '''
+    Test the checks built by compile_schema.
+    '''
+    def setUp(self):
+        self.check = schema.compile_schema({
+            'id': schema.Field(schema.INTEGER, required=True, null=False),
+            'updated_at': schema.Field(schema.TIMESTAMP, required=True,
+                                       null=False),
+            'total_spent': schema.Field(schema.DECIMAL),
+            'email': schema.Field(schema.STRING),
+        })
+        self.valid = {'id': 1, 'updated_at': '2015-05-27T19:12:19+01:00',
+                      'total_spent': '10.00', 'email': None}
+
+    def test_valid(self):
+        self.assertIsNone(self.check(self.valid))
+        self.assertIsNone(self.check({'id': None}),
+                          'Test requests should only need an id')
+
+    def test_invalid(self):
+        cases = [
+            ([], 'not_object'),
+            ({}, 'missing:id'),
+            ({'id': '1'}, 'type:id'),
+            ({'id': True}, 'type:id'),
+            ({'id': 1}, 'missing:updated_at'),
+            (dict(self.valid, updated_at=None), 'null:updated_at'),
+            (dict(self.valid, updated_at='yesterday'), 'type:updated_at'),
+            (dict(self.valid, total_spent='ten'), 'type:total_spent'),
+            (dict(self.valid, email=5), 'type:email'),
+        ]
+        for data, reason in cases:
+            self.assertEqual(self.check(data), reason, data)
+
+
+class TestParsePayload(django.test.TestCase):
+    '''
+    Test that views reject malformed payloads before touching the
+    database and count the rejections.
+    '''
+    path = '/webhooks/shopify/abcd/customer_update'
+
+    def setUp(self):
+        metrics.reset()
+        self.factory = utils.ShopifyRequestFactory()
+
+    def test_rejected_before_queries(self):
+        data = {'id': 553412611, 'created_at': '2015-05-27T19:12:18+01:00'}
+        request = self.factory.customer_update(self.path, data)
+
+        with self.assertNumQueries(0):
+            response = views.shopify_customer_update(request, 'abcd')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(metrics.get('webhooks.rejected', 'customers/update',
+                                     'missing:updated_at'), 1)
+
+    def test_invalid_items(self):
+        path = '/webhooks/shopify/abcd/product_create'
+        product = {'id': 1, 'variants': [{'id': 2, 'price': '1.00'}],
+                   'images': [{'id': 3, 'src': 'a.jpg'}]}
+        cases = [
+            ([{'id': 2, 'price': 'free'}], [], 'type:variants.price'),
+            ([{'price': '1.00'}], [], 'missing:variants.id'),
+            ([{'id': 2, 'taxable': 'false'}], [], 'type:variants.taxable'),
+            ([], [{'id': None}], 'null:images.id'),
+            ([], ['a.jpg'], 'type:images'),
+            ([{'id': 2}, {'id': 4}, {'id': 2}], [], 'duplicate:variants.id'),
+        ]
+        for variants, images, reason in cases:
+            data = dict(product, variants=variants, images=images)
+            request = self.factory.product_create(path, data)
+            with self.assertNumQueries(0):
+                response = views.shopify_product_create(request, 'abcd')
+            self.assertEqual(response.status_code, 400, data)
+            self.assertEqual(response.content.decode(), reason)
+
+        request = self.factory.product_create(path, product)
+        response = views.shopify_product_create(request, 'abcd')
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_shop_booleans(self):
+        path = '/webhooks/shopify/abcd/shop_update'
+        request = self.factory.shop_update(path, {'id': 1,
+                                                  'taxes_included': '1'})
+        with self.assertNumQueries(0):
+            response = views.shopify_shop_update(request, 'abcd')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(metrics.get('webhooks.rejected', 'shop/update',
+                                     'type:taxes_included'), 1)
+
+    def test_invalid_json(self):
+        request = self.factory.factory.post(self.path, '{"id": ',
+                                            content_type='application/json')
+        data, response = schema.parse_payload(request, 'customers/update')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(data)
+        self.assertEqual(metrics.get('webhooks.rejected', 'customers/update',
+                                     'invalid_json'), 1)
+
+    def test_metrics_view(self):
+        metrics.incr('webhooks.rejected', 'customers/update', 'missing:id')
+        client = django.test.Client()
+        response = client.get('/webhooks/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'missing:id', response.content)
+
+        response = client.get('/webhooks/metrics', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
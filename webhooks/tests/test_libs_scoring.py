@@ -0,0 +1,91 @@
+import datetime
+import unittest
+from decimal import Decimal
+
+import django.test
+from django.core.management import call_command
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from webhooks import models
+from webhooks.libs import redaction, scoring
+
+
+@unittest.skipUnless(scoring.numpy, 'NumPy is not installed')
+class TestScoring(django.test.TestCase):
+    '''
+    Test the RFM scores of customers, in full and incremental runs.
+    '''
+    def setUp(self):
+        now = timezone.now()
+        # Customer n ordered n times, spent 10 * n and last ordered n
+        # days ago; customer 10 never ordered.
+        for n in range(10):
+            models.Customer.objects.create(
+                shopify_id=n, orders_count=n, total_spent=Decimal(10 * n),
+                last_order_id=n or None,
+                updated_at=now - datetime.timedelta(days=n, hours=1))
+
+    def segments(self):
+        return dict(models.CustomerScore.objects.values_list(
+            'customer__shopify_id', 'segment'))
+
+    def test_score(self):
+        numpy = scoring.numpy
+        values = numpy.array([0, 0, 0, 0, 1, 2, 3, 4.0])
+        breaks = scoring.breakpoints(values, 4)
+        self.assertEqual(scoring.score(values, breaks, 4).tolist(),
+                         [1, 1, 1, 1, 3, 3, 4, 4])
+        days = numpy.array([1, 2, 3, numpy.inf])
+        self.assertEqual(
+            scoring.score(days, scoring.breakpoints(days, 3), 3,
+                          reverse=True).tolist(),
+            [3, 2, 1, 1])
+        self.assertEqual(scoring.breakpoints(numpy.array([numpy.inf]), 5),
+                         [])
+
+    def test_full_run(self):
+        out = StringIO()
+        call_command('score_customers', bins=5, chunk_size=3, stdout=out)
+        self.assertIn('Full run: 10 customers scored', out.getvalue())
+
+        segments = self.segments()
+        self.assertEqual(len(segments), 10)
+        self.assertEqual(segments[0], '111')
+        self.assertEqual(segments[1], '511')
+        self.assertEqual(segments[9], '155')
+        self.assertEqual([segments[n][1] for n in range(10)],
+                         list('1122334455'))
+
+    def test_incremental_run(self):
+        first = scoring.run(bins=5, chunk_size=4)
+        self.assertTrue(first.full)
+
+        customer = models.Customer.objects.get(shopify_id=0)
+        customer.orders_count = 100
+        customer.total_spent = Decimal(1000)
+        customer.last_order_id = 100
+        customer.updated_at = timezone.now()
+        customer.save()
+        models.Customer.objects.filter(shopify_id=1).update(
+            updated_at=first.started_at - datetime.timedelta(days=3),
+            orders_count=50)
+
+        second = scoring.run(chunk_size=4,
+                             overlap=datetime.timedelta(hours=1))
+        self.assertFalse(second.full)
+        self.assertEqual(second.scored, 1)
+        segments = self.segments()
+        self.assertEqual(segments[0], '555')
+        self.assertEqual(segments[1], '511',
+                         'A customer not updated since the run was scored')
+
+        third = scoring.run(full=True, bins=3)
+        self.assertEqual(third.scored, 10)
+        self.assertEqual(self.segments()[1][1], '3')
+
+    def test_purged_customers_lose_their_scores(self):
+        scoring.run()
+        customer = models.Customer.objects.get(shopify_id=5)
+        redaction.delete_links([customer.id])
+        self.assertEqual(models.CustomerScore.objects.count(), 9)
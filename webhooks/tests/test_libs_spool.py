@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import django.test
+from django.utils.six import StringIO
+
+from webhooks import models
+from webhooks.libs import ingress, spool, validate
+from webhooks.management.commands import consume_spool
+
+
+class TestSpool(unittest.TestCase):
+    '''
+    Test writing, claiming and reading spool segments.
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        writer = spool.SpoolWriter(self.directory, 2 ** 20)
+        writer.append({'path': '/a'}, b'first')
+        writer.append({'path': '/b'}, b'second')
+        writer.sync()
+
+        self.assertIsNone(spool.claim_segment(self.directory),
+                          'An open segment was handed to a consumer')
+
+        writer.seal()
+        path = spool.claim_segment(self.directory)
+        self.assertIsNotNone(path)
+        self.assertIsNone(spool.claim_segment(self.directory),
+                          'A segment was claimed twice')
+        self.assertEqual(list(spool.read_segment(path)),
+                         [({'path': '/a'}, b'first'),
+                          ({'path': '/b'}, b'second')])
+
+    def test_truncated_record_ignored(self):
+        writer = spool.SpoolWriter(self.directory, 2 ** 20)
+        writer.append({'path': '/a'}, b'first')
+        writer.append({'path': '/b'}, b'second')
+        writer.seal()
+
+        path = spool.claim_segment(self.directory)
+        with open(path, 'r+b') as segment:
+            segment.truncate(os.path.getsize(path) - 1)
+        self.assertEqual(list(spool.read_segment(path)),
+                         [({'path': '/a'}, b'first')])
+
+    def test_full(self):
+        writer = spool.SpoolWriter(self.directory, 100)
+        writer.append({}, b'x' * 100)
+        with self.assertRaises(spool.SpoolFullError):
+            writer.append({}, b'x')
+
+    def test_recover(self):
+        writer = spool.SpoolWriter(self.directory, 2 ** 20)
+        writer.append({}, b'x')
+        writer.seal()
+        spool.claim_segment(self.directory)
+
+        spool.release_claims(self.directory)
+        self.assertIsNotNone(spool.claim_segment(self.directory))
+
+
+class TestIngress(django.test.TestCase):
+    '''
+    Test the ingress server over a real connection, then replay the
+    spool through the views.
+    '''
+    path = '/webhooks/shopify/abcd/customer_create'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = spool.SpoolWriter(self.directory, 2 ** 20)
+        self.server = ingress.IngressServer(self.writer)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def send(self, requests):
+        '''
+        Send raw HTTP requests over one connection and return the
+        status codes of the responses.
+        '''
+        loop = asyncio.new_event_loop()
+
+        async def exchange():
+            listener = await asyncio.start_server(
+                self.server.handle_connection, '127.0.0.1', 0, loop=loop)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', port, loop=loop)
+            statuses = []
+            for request in requests:
+                writer.write(request)
+                head = await reader.readuntil(b'\r\n\r\n')
+                statuses.append(int(head.split(b' ')[1]))
+                length = int(head.lower().split(b'content-length: ')[1]
+                             .split(b'\r\n')[0])
+                await reader.readexactly(length)
+            writer.close()
+            # Let the server notice that the connection was closed
+            await asyncio.sleep(0.01, loop=loop)
+            listener.close()
+            await listener.wait_closed()
+            return statuses
+
+        try:
+            return loop.run_until_complete(exchange())
+        finally:
+            loop.close()
+
+    def webhook(self, data, hmac_value=None):
+        body = json.dumps(data).encode('utf8')
+        if hmac_value is None:
+            hmac_value = validate.compute_hmac(body)
+        head = ('POST %s HTTP/1.1\r\n'
+                'Host: localhost\r\n'
+                'Content-Type: application/json\r\n'
+                'Content-Length: %d\r\n'
+                'X-Shopify-Shop-Domain: example.myshopify.com\r\n'
+                'X-Request-Id: 1234\r\n'
+                'X-Shopify-Topic: customers/create\r\n'
+                'X-Shopify-Hmac-Sha256: %s\r\n\r\n' %
+                (self.path, len(body), hmac_value))
+        return head.encode('latin1') + body
+
+    def test_accept_and_replay(self):
+        data = {'id': 553412611,
+                'created_at': '2015-05-27T19:12:18+01:00',
+                'updated_at': '2015-05-27T19:12:19+01:00',
+                'email': 'testme@example.com',
+                'first_name': 'Test',
+                'last_name': 'Customer',
+                'state': 'disabled',
+                'total_spent': '0.00',
+                'tags': ''}
+        statuses = self.send([self.webhook(data),
+                              self.webhook(data, hmac_value='0' * 43 + '=')])
+        self.assertEqual(statuses, [200, 403])
+        self.assertEqual(self.server.accepted, 1)
+        self.assertEqual(models.Customer.objects.count(), 0,
+                         'The ingress server wrote to the database')
+
+        self.writer.seal()
+        self.consume()
+
+        self.assertEqual(models.Customer.objects.count(), 1)
+        self.assertEqual(os.listdir(self.directory), [],
+                         'The processed segment was not removed')
+
+    def consume(self, requeue_dead=False):
+        self.errors = StringIO()
+        command = consume_spool.Command()
+        command.execute(spool_dir=self.directory, once=True,
+                        poll_interval=0, recover=False,
+                        requeue_dead=requeue_dead, verbosity=0,
+                        stdout=StringIO(), stderr=self.errors)
+
+    def test_dead_letters(self):
+        valid = {'id': 1, 'created_at': '2015-05-27T19:12:18+01:00',
+                 'updated_at': '2015-05-27T19:12:19+01:00'}
+        invalid = dict(valid, id='x')
+        metadata = {'path': self.path, 'meta': {
+            'CONTENT_TYPE': 'application/json',
+            'HTTP_X_SHOPIFY_TOPIC': 'customers/create',
+            'HTTP_X_SHOPIFY_SHOP_DOMAIN': 'example.myshopify.com',
+            'HTTP_X_REQUEST_ID': '1234',
+            # Checked by the ingress server
+            'HTTP_X_SHOPIFY_HMAC_SHA256': ''}}
+        for data in (valid, invalid):
+            self.writer.append(metadata, json.dumps(data).encode('utf8'))
+        self.writer.seal()
+
+        self.consume()
+        self.assertEqual(models.Customer.objects.count(), 1,
+                         self.errors.getvalue())
+        entries = os.listdir(self.directory)
+        self.assertEqual(len(entries), 1)
+        self.assertTrue(entries[0].endswith(spool.DEAD_SUFFIX))
+        records = list(spool.read_segment(
+            os.path.join(self.directory, entries[0])))
+        self.assertEqual([json.loads(body.decode('utf8'))['id']
+                          for metadata, body in records], ['x'])
+
+        self.consume()
+        self.assertEqual(os.listdir(self.directory), entries,
+                         'A dead-letter segment was retried unasked')
+        self.consume(requeue_dead=True)
+        self.assertEqual(len(os.listdir(self.directory)), 1,
+                         'A failed record was lost on retry')
+
+    @django.test.override_settings(WEBHOOK_MAX_BODY_SIZE=2 ** 16,
+                                   WEBHOOK_MAX_BODY_SIZES={})
+    def test_too_large(self):
+        request = self.webhook({'id': None, 'note': 'x' * 2 ** 16})
+        self.assertEqual(self.send([request]), [413])
+
+    def test_spool_full(self):
+        self.writer.max_bytes = 0
+        self.assertEqual(self.send([self.webhook({'id': None})]), [503])
+        self.assertEqual(self.server.shed, 1)
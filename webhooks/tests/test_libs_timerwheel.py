@@ -0,0 +1,67 @@
+import random
+import unittest
+
+from webhooks.libs.timerwheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    '''
+    Test that timers expire on the tick of their deadline, across
+    cascades between the wheels.
+    '''
+    def test_expiry(self):
+        wheel = TimerWheel(now=1000, wheel_size=4, levels=3)
+        wheel.schedule('a', 1001)
+        wheel.schedule('b', 1010)
+        wheel.schedule('c', 1050)
+        self.assertEqual(len(wheel), 3)
+
+        self.assertEqual(wheel.advance(1000), [])
+        self.assertEqual(wheel.advance(1001), ['a'])
+        self.assertEqual(wheel.advance(1009), [])
+        self.assertEqual(wheel.advance(1010), ['b'])
+        self.assertEqual(wheel.advance(1100), ['c'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel_and_reschedule(self):
+        wheel = TimerWheel(now=0, wheel_size=4, levels=2)
+        wheel.schedule('a', 5)
+        wheel.schedule('b', 5)
+        self.assertTrue(wheel.cancel('a'))
+        self.assertFalse(wheel.cancel('a'))
+        wheel.schedule('b', 9)
+
+        self.assertEqual(wheel.advance(8), [])
+        self.assertEqual(wheel.advance(9), ['b'])
+
+    def test_past_deadline(self):
+        wheel = TimerWheel(now=100)
+        wheel.schedule('a', 50)
+        self.assertEqual(wheel.advance(101), ['a'])
+
+    def test_beyond_range(self):
+        # The wheels cover 4 ** 2 = 16 ticks
+        wheel = TimerWheel(now=0, wheel_size=4, levels=2)
+        wheel.schedule('a', 100)
+        self.assertEqual(wheel.advance(99), [])
+        self.assertEqual(wheel.advance(100), ['a'])
+
+    def test_random(self):
+        rng = random.Random(1)
+        wheel = TimerWheel(now=0, wheel_size=8, levels=3)
+        deadlines = {}
+        for key in range(500):
+            deadlines[key] = rng.randint(1, 2000)
+            wheel.schedule(key, deadlines[key])
+        for key in range(0, 500, 7):
+            wheel.cancel(key)
+            del deadlines[key]
+
+        now = 0
+        while now < 2000:
+            now += rng.randint(1, 30)
+            for key in wheel.advance(now):
+                self.assertLessEqual(deadlines[key], now)
+                self.assertGreater(deadlines[key], now - 30)
+                del deadlines[key]
+        self.assertEqual(deadlines, {})
@@ -0,0 +1,145 @@
+import http.server
+import json
+import socketserver
+import threading
+import time
+
+import django.test
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from webhooks import models, views
+from webhooks.libs import tracing
+from webhooks.tests import utils
+
+
+CUSTOMER = {
+    'id': 1,
+    'created_at': '2015-05-27T19:12:18+01:00',
+    'updated_at': '2015-05-27T19:12:19+01:00',
+    'email': 'bob@example.com',
+    'first_name': 'Bob',
+    'tags': 'vip',
+    'default_address': {'address1': '1 Main Street', 'city': 'Leeds',
+                        'name': 'Bob Smith', 'country': 'GB'},
+}
+
+
+class CollectorHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Accept spans like a Zipkin collector, keeping them on the server.
+    '''
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.spans.extend(json.loads(body.decode('utf8')))
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTracing(django.test.TestCase):
+    '''
+    Test that the stages of webhook requests are traced, that slow
+    requests are kept in a bounded table, and that traces are exported
+    as Zipkin spans.
+    '''
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+        self.siteid = 'abcd'
+
+    def create(self, **data):
+        path = '/webhooks/shopify/%s/customer_create' % self.siteid
+        request = self.factory.customer_create(path, dict(CUSTOMER, **data))
+        response = views.shopify_customer_create(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+
+    def test_fast_requests_are_not_stored(self):
+        self.create()
+        self.assertFalse(models.SlowEvent.objects.exists())
+        self.assertIsNone(tracing.current(), 'The trace was left running')
+
+    @django.test.override_settings(TRACE_SLOW_THRESHOLD=0,
+                                   TRACE_SLOW_EVENTS=2)
+    def test_slow_events(self):
+        for shopify_id in (1, 2, 3):
+            self.create(id=shopify_id)
+
+        events = list(models.SlowEvent.objects.order_by('id'))
+        self.assertEqual([json.loads(event.payload)['id']
+                          for event in events], [2, 3],
+                         'The oldest event was not dropped')
+        event = events[-1]
+        self.assertEqual(event.topic, 'customers/create')
+        self.assertEqual(event.status, 200)
+        stages = [stage['name'] for stage in json.loads(event.stages)]
+        for name in ('headers', 'body_read', 'hmac', 'json', 'schema',
+                     'lookup', 'timestamps', 'save', 'tags'):
+            self.assertIn(name, stages)
+
+        payload = json.loads(event.payload)
+        self.assertEqual(payload['email'], tracing.REDACTED)
+        self.assertEqual(payload['first_name'], tracing.REDACTED)
+        self.assertEqual(payload['default_address'],
+                         {'address1': tracing.REDACTED,
+                          'city': tracing.REDACTED,
+                          'name': tracing.REDACTED, 'country': 'GB'})
+        self.assertEqual(payload['tags'], 'vip')
+
+    @django.test.override_settings(TRACE_SLOW_THRESHOLD=0)
+    def test_forged_requests_are_not_stored(self):
+        path = '/webhooks/shopify/%s/customer_create' % self.siteid
+        request = self.factory.customer_create(path, CUSTOMER)
+        request.META['HTTP_X_SHOPIFY_HMAC_SHA256'] = '0' * 43 + '='
+        response = views.shopify_customer_create(request, self.siteid)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(models.SlowEvent.objects.exists())
+
+    @django.test.override_settings(TRACE_ENABLED=False,
+                                   TRACE_SLOW_THRESHOLD=0)
+    def test_disabled(self):
+        self.create()
+        self.assertFalse(models.SlowEvent.objects.exists())
+        with tracing.span('save') as span:
+            self.assertIs(span, tracing._NO_SPAN)
+
+    @django.test.override_settings(TRACE_SLOW_THRESHOLD=0)
+    def test_zipkin(self):
+        self.create()
+        out = StringIO()
+        call_command('slow_events', stdout=out)
+        spans = json.loads(out.getvalue())
+
+        root = spans[0]
+        self.assertEqual(root['name'], 'customers/create')
+        self.assertEqual(root['tags']['http.status_code'], '200')
+        self.assertEqual(set(span['traceId'] for span in spans),
+                         {root['traceId']})
+        for span in spans[1:]:
+            self.assertEqual(span['parentId'], root['id'])
+            self.assertGreaterEqual(span['timestamp'], root['timestamp'])
+            self.assertLessEqual(span['timestamp'] + span['duration'],
+                                 root['timestamp'] + root['duration'] + 1)
+
+    def test_export(self):
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                                 CollectorHandler)
+        server.daemon_threads = True
+        server.spans = []
+        threading.Thread(target=server.serve_forever).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        url = 'http://127.0.0.1:%d/api/v2/spans' % server.server_address[1]
+        with self.settings(TRACE_ZIPKIN_URL=url):
+            self.create()
+            tracing.exporter.flush()
+        # The exporter thread may have taken the spans first
+        deadline = time.time() + 5
+        while not server.spans and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(server.spans[0]['name'], 'customers/create')
+        self.assertEqual(server.spans[0]['localEndpoint'],
+                         {'serviceName': tracing.SERVICE_NAME})
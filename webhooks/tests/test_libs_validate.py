@@ -1,5 +1,13 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
+import django.http
 import django.test
+from django.core.management import call_command
+from django.utils.six import StringIO
+from webhooks.libs import validate
 from webhooks.libs.validate import ValidateShopifyWebhookRequest
 from webhooks.tests import utils
 
@@ -94,4 +102,114 @@ class TestValidateShopifyWebhookRequestInvalidData(unittest.TestCase):
             response = self.view(request, self.siteid)
             
             self.assertEqual(response.status_code, 403,
-                             'Bad HMAC did not result in forbidden response')
\ No newline at end of file
+                             'Bad HMAC did not result in forbidden response')
+
+class TestValidateShopifyWebhookRequestBody(django.test.SimpleTestCase):
+    '''
+    Test that the ValidateShopifyWebhookRequest decorator streams the
+    body through the HMAC and enforces the body size limits.
+    '''
+    siteid = 'abcd'
+    path = '/webhooks/shopify/abcd/product_create'
+
+    def setUp(self):
+        self.bodies = []
+
+        @ValidateShopifyWebhookRequest
+        def dummy_view(request, siteid):
+            self.bodies.append(request.body)
+            return django.http.HttpResponse()
+
+        self.view = dummy_view
+        self.factory = utils.ShopifyRequestFactory()
+
+    def test_large_body(self):
+        '''
+        Check that a body spanning several chunks is verified and passed
+        to the view intact.
+        '''
+        data = {'body_html': 'x' * (3 * validate.BODY_CHUNK_SIZE + 7)}
+        request = self.factory.create_shopify_webhook_request(
+            self.path, data, 'products/create')
+        response = self.view(request, self.siteid)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(self.bodies[0].decode('utf8')), data)
+
+    @django.test.override_settings(WEBHOOK_MAX_BODY_SIZE=100,
+                                   WEBHOOK_MAX_BODY_SIZES={
+                                       'products/create': 1000})
+    def test_body_size_limit(self):
+        '''
+        Check that bodies over the limit for their topic are rejected
+        with 413 before they are read.
+        '''
+        data = {'body_html': 'x' * 500}
+        request = self.factory.create_shopify_webhook_request(
+            self.path, data, 'products/create')
+        self.assertEqual(self.view(request, self.siteid).status_code, 200)
+
+        request = self.factory.create_shopify_webhook_request(
+            self.path, data, 'customers/create')
+        response = self.view(request, self.siteid)
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(request._read_started,
+                         'The oversized body was read')
+        self.assertEqual(len(self.bodies), 1)
+
+
+class TestVerifyBatch(django.test.SimpleTestCase):
+    '''
+    Test the parallel verification of stored payloads.
+    '''
+    def items(self):
+        items = []
+        for index in range(50):
+            body = json.dumps({'id': index}).encode('utf8')
+            shop, secret = 'a.myshopify.com', None
+            if index % 10 == 0:
+                shop, secret = 'other.myshopify.com', 'other'
+            signature = validate.compute_hmac(body, secret)
+            if index in (7, 33):
+                signature = signature[::-1]
+            items.append((body, signature, shop))
+        return items
+
+    def test_threads(self):
+        result = validate.verify_batch(
+            iter(self.items()), {'other.myshopify.com': 'other'}, workers=3,
+            chunk_size=4)
+        self.assertEqual(result['verified'], 50)
+        self.assertEqual(result['failures'], [(7, 'a.myshopify.com'),
+                                              (33, 'a.myshopify.com')])
+        self.assertGreater(result['rate'], 0)
+
+        result = validate.verify_batch(self.items(), workers=2)
+        self.assertEqual(len(result['failures']), 7,
+                         'Signatures checked with the wrong secret')
+
+    def test_processes(self):
+        result = validate.verify_batch(
+            self.items(), {'other.myshopify.com': 'other'}, workers=2,
+            processes=True, chunk_size=8)
+        self.assertEqual([index for index, shop in result['failures']],
+                         [7, 33])
+
+    def test_non_ascii_signature(self):
+        self.assertFalse(validate.verify_hmac(b'{}', '\xe9' * 44))
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'payloads.jsonl')
+        with open(path, 'w') as lines:
+            for body, signature, shop in self.items()[:10]:
+                lines.write(json.dumps({'body': body.decode('utf8'),
+                                        'hmac': signature,
+                                        'shop': shop}) + '\n')
+
+        out = StringIO()
+        call_command('verify_hmacs', path, workers=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('FAILED %s #7 a.myshopify.com' % path, output)
+        self.assertIn('10 verified, 2 failed', output)
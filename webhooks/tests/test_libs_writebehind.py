@@ -0,0 +1,252 @@
+import datetime
+import signal
+from unittest import mock
+
+import django.test
+from django.db import DataError
+from django.utils import timezone
+
+from webhooks import models, views
+from webhooks.libs import writebehind
+from webhooks.tests import utils
+
+
+@django.test.override_settings(WRITE_BEHIND_FLUSH_INTERVAL=0,
+                               WRITE_BEHIND_MAX_SIZE=3)
+class TestWriteBehindBuffer(django.test.TestCase):
+    '''
+    Test that the buffer coalesces updates and writes them in bulk.
+    '''
+    def setUp(self):
+        self.buffer = writebehind.WriteBehindBuffer(
+            models.Cart, 'token', ['note', 'line_items'])
+
+    def test_coalescing(self):
+        for note in ('one', 'two', 'three'):
+            self.buffer.put(models.Cart(token='a', note=note))
+        self.buffer.put(models.Cart(token='b', note='other'))
+
+        self.assertEqual(models.Cart.objects.count(), 0,
+                         'The buffer wrote before being flushed')
+        # One locking lookup and one insert (inside a savepoint) for four
+        # updates
+        with self.assertNumQueries(4):
+            self.buffer.flush()
+
+        self.assertEqual(models.Cart.objects.get(token='a').note, 'three')
+        self.assertEqual(models.Cart.objects.count(), 2)
+        self.assertEqual(self.buffer.coalescing_ratio(), 2)
+
+        # Updates of existing rows and deletes
+        self.buffer.put(models.Cart(token='a', note='four'))
+        self.buffer.delete('b')
+        self.buffer.flush()
+        self.assertEqual(models.Cart.objects.get(token='a').note, 'four')
+        self.assertFalse(models.Cart.objects.filter(token='b').exists())
+
+    def test_flush_when_full(self):
+        for token in ('a', 'b'):
+            self.buffer.put(models.Cart(token=token))
+        self.assertEqual(models.Cart.objects.count(), 0)
+
+        self.buffer.put(models.Cart(token='c'))
+        self.assertEqual(models.Cart.objects.count(), 3,
+                         'A full buffer was not flushed')
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_rejected_rows(self):
+        write = self.buffer._write
+
+        def rejecting_write(batch):
+            if 'bad' in batch:
+                raise DataError('value too long for type character varying')
+            write(batch)
+
+        self.buffer.put(models.Cart(token='a'))
+        self.buffer.put(models.Cart(token='bad'))
+        with mock.patch.object(self.buffer, '_write', rejecting_write), \
+                self.assertLogs(writebehind.logger, 'ERROR'):
+            self.buffer.put(models.Cart(token='c'))
+
+        self.assertEqual(set(models.Cart.objects.values_list('token',
+                                                             flat=True)),
+                         {'a', 'c'}, 'The valid rows were not written')
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual([key for key, value in self.buffer.dead_letters],
+                         ['bad'])
+
+    def test_shedding(self):
+        def failing_write(batch):
+            raise RuntimeError('database unavailable')
+
+        with mock.patch.object(self.buffer, '_write', failing_write), \
+                self.assertLogs(writebehind.logger, 'ERROR'):
+            for token in ('a', 'b', 'c'):
+                self.assertTrue(self.buffer.put(models.Cart(token=token)))
+            self.assertFalse(self.buffer.put(models.Cart(token='d')),
+                             'A full buffer grew')
+            self.assertTrue(self.buffer.put(models.Cart(token='a')),
+                            'An update of a buffered key was refused')
+        self.assertEqual(len(self.buffer), 3)
+
+        self.buffer.flush()
+        self.assertEqual(models.Cart.objects.count(), 3)
+
+    def test_failed_flush_keeps_newer_state(self):
+        self.buffer.put(models.Cart(token='a', note='old'))
+        self.buffer.put(models.Cart(token='b', note='old'))
+
+        def failing_write(batch):
+            self.buffer.put(models.Cart(token='a', note='new'))
+            raise RuntimeError('database unavailable')
+
+        with mock.patch.object(self.buffer, '_write', failing_write), \
+                self.assertLogs(writebehind.logger, 'WARNING'):
+            with self.assertRaises(RuntimeError):
+                self.buffer.flush()
+
+        self.buffer.flush()
+        self.assertEqual(models.Cart.objects.get(token='a').note, 'new')
+        self.assertEqual(models.Cart.objects.get(token='b').note, 'old')
+
+
+
+@django.test.override_settings(WRITE_BEHIND_FLUSH_INTERVAL=0,
+                               WRITE_BEHIND_MAX_SIZE=3)
+class TestSeveralProcesses(django.test.TestCase):
+    '''
+    Test that buffers of several processes do not undo each other's
+    writes.
+    '''
+    def setUp(self):
+        self.buffer = writebehind.WriteBehindBuffer(
+            models.Cart, 'token', ['note', 'updated_at'],
+            version='updated_at')
+
+    def cart(self, note, hour):
+        return models.Cart(token='a', note=note,
+                           updated_at=datetime.datetime(
+                               2015, 5, 27, hour, tzinfo=timezone.utc))
+
+    def test_older_state_is_not_written(self):
+        self.cart('new', 12).save()
+        self.buffer.put(self.cart('old', 11))
+        self.buffer.flush()
+        self.assertEqual(models.Cart.objects.get().note, 'new')
+
+        self.buffer.put(self.cart('newer', 13))
+        self.buffer.flush()
+        self.assertEqual(models.Cart.objects.get().note, 'newer')
+
+    def test_row_inserted_by_another_process(self):
+        lock_rows = self.buffer._lock_rows
+        calls = []
+
+        def racing_lock_rows(keys):
+            if not calls:
+                # Another process inserts the row after the lookup
+                calls.append(keys)
+                self.cart('theirs', 11).save()
+                return {}
+            return lock_rows(keys)
+
+        self.buffer.put(self.cart('ours', 12))
+        with mock.patch.object(self.buffer, '_lock_rows', racing_lock_rows), \
+                self.assertLogs(writebehind.logger, 'WARNING'):
+            self.buffer.flush()
+
+        self.assertEqual(models.Cart.objects.get().note, 'ours')
+        self.assertEqual(len(self.buffer.dead_letters), 0)
+
+
+class TestShutdown(django.test.SimpleTestCase):
+    '''
+    Test that SIGTERM runs the exit handlers that flush the buffers.
+    '''
+    def setUp(self):
+        self.previous = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, self.previous)
+
+    def test_exit_on_signals(self):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        writebehind.exit_on_signals()
+        handler = signal.getsignal(signal.SIGTERM)
+        with self.assertRaises(SystemExit):
+            handler(signal.SIGTERM, None)
+
+    def test_handled_signals_are_kept(self):
+        def handler(signum, frame):
+            pass
+
+        signal.signal(signal.SIGTERM, handler)
+        writebehind.exit_on_signals()
+        self.assertIs(signal.getsignal(signal.SIGTERM), handler)
+
+    def test_flush_all(self):
+        buffer = writebehind.WriteBehindBuffer(models.Cart, 'token', [])
+        with mock.patch.object(buffer, 'flush') as flush:
+            writebehind.flush_all()
+        flush.assert_called_once_with()
+
+
+@django.test.override_settings(WRITE_BEHIND_FLUSH_INTERVAL=0,
+                               ABANDONED_CHECKOUT_TICK=0)
+class TestShopifyCartCheckoutViews(django.test.TestCase):
+    '''
+    Test the cart and checkout views, which write through the buffers.
+    '''
+    siteid = 'abcd'
+
+    def setUp(self):
+        self.factory = utils.ShopifyRequestFactory()
+
+    def tearDown(self):
+        views.cart_buffer.flush()
+        views.checkout_buffer.flush()
+
+    def test_cart(self):
+        path = '/webhooks/shopify/%s/cart_update' % self.siteid
+        for quantity in (1, 2, 3):
+            data = {"id": "eeafa272cebfd4b22385bc4b645e762c",
+                    "token": "eeafa272cebfd4b22385bc4b645e762c",
+                    "note": None,
+                    "created_at": "2015-05-27T19:12:18+01:00",
+                    "updated_at": "2015-05-27T19:12:19+01:00",
+                    "line_items": [{"id": 39072856, "quantity": quantity}]}
+            request = self.factory.cart_update(path, data)
+            response = views.shopify_cart_update(request, self.siteid)
+            self.assertEqual(response.status_code, 200)
+
+        views.cart_buffer.flush()
+        cart = models.Cart.objects.get(token=data['token'])
+        self.assertIn('"quantity": 3', cart.line_items)
+
+    def test_checkout(self):
+        path = '/webhooks/shopify/%s/checkout_create' % self.siteid
+        data = {"id": 450789469,
+                "token": "2a1ace52255252df566af0faaedfbfa7",
+                "cart_token": "68778783ad298f1c80c3bafcddeea02f",
+                "email": "bob.norman@example.com",
+                "created_at": "2015-05-27T19:12:18+01:00",
+                "updated_at": "2015-05-27T19:12:19+01:00",
+                "completed_at": None,
+                "currency": "USD",
+                "subtotal_price": "398.00",
+                "total_price": "409.94",
+                "customer": {"id": 207119551},
+                "line_items": []}
+        request = self.factory.checkout_create(path, data)
+        response = views.shopify_checkout_create(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        views.checkout_buffer.flush()
+
+        checkout = models.Checkout.objects.get(shopify_id=450789469)
+        self.assertEqual(checkout.customer_shopify_id, 207119551)
+        self.assertEqual(str(checkout.total_price), '409.94')
+
+        path = '/webhooks/shopify/%s/checkout_delete' % self.siteid
+        request = self.factory.checkout_delete(path, {"id": 450789469})
+        response = views.shopify_checkout_delete(request, self.siteid)
+        self.assertEqual(response.status_code, 200)
+        views.checkout_buffer.flush()
+        self.assertEqual(models.Checkout.objects.count(), 0)
@@ -1,4 +1,7 @@
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
 from webhooks import models
 
 
@@ -16,6 +19,47 @@ class TestCustomer(TestCase):
         self.assertIn('Jim', str(customer),
                       'The __str__ method does not contain the first name')
 
+    def create(self, shopify_id, email):
+        customer = models.Customer(shopify_id=shopify_id, email=email,
+                                   state='enabled')
+        customer.save()
+        return customer
+
+    def test_email_hash(self):
+        customer = self.create(1, ' Bob@Example.com')
+        self.assertEqual(customer.email_hash,
+                         models.hash_email('bob@example.com'))
+        self.assertEqual(self.create(2, '').email_hash, '')
+
+    def test_dedup(self):
+        first = self.create(1, 'bob@example.com')
+        second = self.create(2, 'BOB@example.com ')
+        other = self.create(3, 'alice@example.com')
+        self.create(4, '')
+        self.create(5, '')
+
+        self.assertEqual(models.Customer.find_by_email('Bob@example.com'),
+                         first)
+        call_command('dedup_customers', stdout=StringIO())
+
+        second.refresh_from_db()
+        self.assertEqual(second.canonical, first)
+        self.assertEqual(
+            models.Customer.objects.filter(canonical__isnull=False).count(), 1,
+            'Customers without an address or duplicate were linked')
+        self.assertEqual(models.Customer.find_by_email('alice@example.com'),
+                         other)
+        self.assertIsNone(models.Customer.find_by_email('carol@example.com'))
+        self.assertIsNone(models.Customer.find_by_email(''))
+
+        # Once the canonical customer is gone, the next oldest takes over
+        first.delete()
+        call_command('dedup_customers', stdout=StringIO())
+        second.refresh_from_db()
+        self.assertIsNone(second.canonical)
+        self.assertEqual(models.Customer.find_by_email('bob@example.com'),
+                         second)
+
 class TestCustomerTag(TestCase):
     '''
     Test the methods of the CustomerTag class.
@@ -31,3 +75,42 @@ class TestCustomerTag(TestCase):
         tag = models.CustomerTag.get_or_create('hello')
         self.assertIn('hello', str(tag),
                       'The __str__ method does not contain the tag name')
+
+
+class TestPurgeCustomers(TestCase):
+    '''
+    Test that manage.py purge_customers removes deleted customers only.
+    '''
+    def create(self, shopify_id, deleted=False):
+        customer = models.Customer.objects.create(
+            shopify_id=shopify_id, state='enabled',
+            deleted_at=timezone.now() if deleted else None)
+        customer.tags.add(models.CustomerTag.get_or_create('vip'))
+        customer.addresses.add(models.CustomerAddress.objects.create(
+            shopify_id=shopify_id))
+        return customer
+
+    def test_purge(self):
+        live = self.create(1)
+        duplicate = self.create(2)
+        for shopify_id in range(3, 8):
+            deleted = self.create(shopify_id, deleted=True)
+        duplicate.canonical = deleted
+        duplicate.save()
+
+        self.assertEqual(models.Customer.objects.count(), 2)
+        self.assertEqual(models.Customer.all_objects.count(), 7)
+        call_command('purge_customers', batch_size=2, pause=0,
+                     stdout=StringIO())
+
+        self.assertEqual(list(models.Customer.all_objects.order_by('id')),
+                         [live, duplicate])
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.canonical)
+        self.assertEqual(models.Customer.tags.through.objects.count(), 2)
+        self.assertEqual(
+            sorted(models.CustomerAddress.objects.values_list('shopify_id',
+                                                              flat=True)),
+            [1, 2])
+        self.assertEqual(models.CustomerTag.objects.count(), 1,
+                         'Tags were removed')
@@ -0,0 +1,82 @@
+import datetime
+import unittest
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from webhooks import models
+from webhooks.libs import abandonment, queryplan
+
+
+@unittest.skipUnless(connection.vendor in ('sqlite', 'postgresql'),
+                     'Query plans are only checked on SQLite and PostgreSQL')
+class TestQueryPlans(TestCase):
+    '''
+    Test that the read paths of the webhook models use indexes on a
+    dataset large enough for the planner to prefer them.
+    '''
+    ROWS = 5000
+    COUNTRIES = ['C%d' % index for index in range(50)]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = now = timezone.now()
+        models.Customer.objects.bulk_create(
+            models.Customer(shopify_id=index,
+                            email='customer%d@example.com' % index,
+                            email_hash=models.hash_email(
+                                'customer%d@example.com' % index),
+                            last_name='Last%d' % index,
+                            last_order_id=index * 10,
+                            state='disabled' if index % 100 == 0 else 'enabled',
+                            updated_at=now - datetime.timedelta(minutes=index))
+            for index in range(cls.ROWS))
+        models.CustomerAddress.objects.bulk_create(
+            models.CustomerAddress(
+                shopify_id=index,
+                country_code=cls.COUNTRIES[index % len(cls.COUNTRIES)],
+                province_code='P%d' % (index % 20))
+            for index in range(cls.ROWS))
+        models.Checkout.objects.bulk_create(
+            models.Checkout(shopify_id=index, token='%032x' % index,
+                            customer_shopify_id=index,
+                            completed_at=None if index % 100 == 0 else
+                            now - datetime.timedelta(minutes=index))
+            for index in range(cls.ROWS))
+        queryplan.analyze()
+
+    def assertIndexed(self, queryset):
+        self.assertEqual(queryplan.full_scans(queryset), [],
+                         'Full scan for %s:\n%s' % (
+                             queryset.query,
+                             '\n'.join(queryplan.explain(queryset))))
+
+    def test_customer(self):
+        since = self.now - datetime.timedelta(minutes=10)
+        customers = models.Customer.objects
+        self.assertIndexed(customers.filter(shopify_id=42))
+        self.assertIndexed(customers.filter(email='customer42@example.com'))
+        self.assertIndexed(customers.filter(
+            email_hash=models.hash_email('customer42@example.com')))
+        self.assertIndexed(customers.filter(last_name='Last42'))
+        self.assertIndexed(customers.filter(last_order_id=420))
+        self.assertIndexed(customers.filter(updated_at__gte=since))
+        self.assertIndexed(customers.filter(state='disabled',
+                                            updated_at__gte=since))
+
+    def test_customer_address(self):
+        addresses = models.CustomerAddress.objects
+        self.assertIndexed(addresses.filter(country_code='C7'))
+        self.assertIndexed(addresses.filter(country_code='C7',
+                                            province_code='P7'))
+
+    def test_checkout(self):
+        self.assertIndexed(abandonment.open_checkouts())
+        self.assertIndexed(models.Checkout.objects.filter(
+            customer_shopify_id=42))
+
+    def test_detects_full_scan(self):
+        queryset = models.Customer.objects.filter(first_name='First42')
+        self.assertEqual(queryplan.full_scans(queryset),
+                         [models.Customer._meta.db_table])
@@ -1,6 +1,8 @@
 import json
 from decimal import Decimal
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from webhooks import views, models
 from webhooks.tests import utils
 
@@ -662,6 +664,9 @@ class TestShopifyCustomerDelete(ShopifyViewTest):
                          'View returned an HTTP error code')
         self.assertEqual(models.Customer.objects.count(), 0,
                          'Customer not correctly deleted')
+        self.assertIsNotNone(
+            models.Customer.all_objects.get(shopify_id=534645123).deleted_at,
+            'Customer not marked deleted')
 
         # Reply the delete to test when customer does not exist
         response = views.shopify_customer_delete(request, self.siteid)
@@ -671,6 +676,18 @@ class TestShopifyCustomerDelete(ShopifyViewTest):
         self.assertEqual(models.Customer.objects.count(), 0,
                          'The last object should have been deleted')
 
+        # A late create for the deleted customer is ignored
+        path = '/webhooks/shopify/%s/customer_create' % self.siteid
+        data = {'id': customer.shopify_id,
+                'created_at': '2015-05-27T19:12:18+01:00',
+                'updated_at': '2015-05-27T19:12:19+01:00'}
+        request = self.factory.customer_create(path, data)
+        response = views.shopify_customer_create(request, self.siteid)
+        self.assertEqual(response.status_code, 200,
+                         'View returned an HTTP error code')
+        self.assertEqual(models.Customer.objects.count(), 0,
+                         'The deleted customer was recreated')
+
 
 class TestShopifyShopUpdate(ShopifyViewTest):
     '''
@@ -810,3 +827,152 @@ class TestShopifyShopUpdate(ShopifyViewTest):
                          'Created shop has an incorrect shopify_id')
         self._check_copy_field_validity(shop, data)
 
+
+
+class TestShopifyProduct(ShopifyViewTest):
+    '''
+    Test that the product views save products with their variants and
+    images.
+    '''
+    def _product_data(self, variant_ids, image_ids=(), title='Ice Cream'):
+        variants = []
+        for position, variant_id in enumerate(variant_ids, 1):
+            variants.append({
+                "id": variant_id,
+                "product_id": 632910392,
+                "title": "Flavor %d" % variant_id,
+                "price": "%d.99" % position,
+                "sku": "IC-%d" % variant_id,
+                "position": position,
+                "compare_at_price": None,
+                "option1": "Flavor %d" % variant_id,
+                "option2": None,
+                "option3": None,
+                "created_at": "2015-05-27T19:12:18+01:00",
+                "updated_at": "2015-05-27T19:12:19+01:00",
+                "taxable": True,
+                "barcode": None,
+                "grams": 200,
+                "image_id": None,
+                "inventory_quantity": 10,
+                "weight": 0.2,
+                "weight_unit": "kg",
+                "requires_shipping": True})
+        images = [{"id": image_id,
+                   "product_id": 632910392,
+                   "position": position,
+                   "created_at": "2015-05-27T19:12:18+01:00",
+                   "updated_at": "2015-05-27T19:12:19+01:00",
+                   "src": "https://cdn.shopify.com/%d.jpg" % image_id,
+                   "variant_ids": []}
+                  for position, image_id in enumerate(image_ids, 1)]
+        return {"id": 632910392,
+                "title": title,
+                "body_html": "<p>Cold</p>",
+                "vendor": "Dairy",
+                "product_type": "Frozen",
+                "created_at": "2015-05-27T19:12:18+01:00",
+                "updated_at": "2015-05-27T19:12:19+01:00",
+                "published_at": "2015-05-27T19:12:19+01:00",
+                "handle": "ice-cream",
+                "tags": "cold, sweet",
+                "published_scope": "global",
+                "template_suffix": None,
+                "variants": variants,
+                "images": images,
+                "options": []}
+
+    def _send(self, view, data):
+        path = '/webhooks/shopify/%s/product_update' % self.siteid
+        request = self.factory.product_update(path, data)
+        response = view(request, self.siteid)
+        self.assertEqual(response.status_code, 200,
+                         'View returned an HTTP error code')
+
+    def test_with_test_data(self):
+        data = self._product_data([1, 2])
+        data['id'] = None
+        self._send(views.shopify_product_create, data)
+        self.assertEqual(models.Product.objects.count(), 0,
+                         'Test requests should not be added')
+
+    def test_create_and_update(self):
+        self._send(views.shopify_product_create,
+                   self._product_data([11, 12, 13], [21, 22]))
+
+        product = models.Product.objects.get(shopify_id=632910392)
+        self.assertEqual(product.title, 'Ice Cream')
+        self.assertEqual(product.variants.count(), 3)
+        self.assertEqual(product.images.count(), 2)
+        variant = product.variants.get(shopify_id=12)
+        self.assertEqual(variant.price, Decimal('2.99'))
+        self.assertEqual(variant.sku, 'IC-12')
+
+        # Drop variant 11, add variant 14 and change the others
+        data = self._product_data([13, 12, 14], [22], title='Gelato')
+        self._send(views.shopify_product_update, data)
+
+        product = models.Product.objects.get(shopify_id=632910392)
+        self.assertEqual(product.title, 'Gelato')
+        self.assertEqual(
+            sorted(product.variants.values_list('shopify_id', flat=True)),
+            [12, 13, 14])
+        self.assertEqual(
+            list(product.images.values_list('shopify_id', flat=True)), [22])
+        self.assertEqual(product.variants.get(shopify_id=13).position, 1)
+        self.assertEqual(product.variants.get(shopify_id=12).price,
+                         Decimal('2.99'))
+        self.assertEqual(product.variants.get(shopify_id=13).price,
+                         Decimal('1.99'))
+        self.assertEqual(models.ProductVariant.objects.count(), 3)
+
+    def test_query_count_independent_of_variants(self):
+        '''
+        Check that saving a product takes as many queries with 20
+        variants as with 2. (On SQLite, updates of more variants are
+        split into batches to respect its limit on query parameters.)
+        '''
+        small = self._product_data([1, 2], [101])
+        self._send(views.shopify_product_create, small)
+        models.Product.objects.all().delete()
+        large = self._product_data(range(1, 21), range(101, 121))
+
+        counts = []
+        for data in (small, large):
+            with CaptureQueriesContext(connection) as queries:
+                self._send(views.shopify_product_create, data)
+            creates = len(queries)
+            with CaptureQueriesContext(connection) as queries:
+                self._send(views.shopify_product_update, data)
+            counts.append((creates, len(queries)))
+            models.Product.objects.all().delete()
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_many_variants(self):
+        '''
+        Check that products with more variants than SQLite accepts query
+        parameters are saved, and trimmed.
+        '''
+        self._send(views.shopify_product_create,
+                   self._product_data(range(1, 1201)))
+        self._send(views.shopify_product_update,
+                   self._product_data(range(1, 1201)))
+        self.assertEqual(models.ProductVariant.objects.count(), 1200)
+
+        self._send(views.shopify_product_update, self._product_data([5]))
+        self.assertEqual(
+            list(models.ProductVariant.objects.values_list('shopify_id',
+                                                           flat=True)), [5])
+
+    def test_delete(self):
+        self._send(views.shopify_product_create,
+                   self._product_data([11, 12], [21]))
+        path = '/webhooks/shopify/%s/product_delete' % self.siteid
+        request = self.factory.product_delete(path, {"id": 632910392})
+        response = views.shopify_product_delete(request, self.siteid)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Product.objects.count(), 0)
+        self.assertEqual(models.ProductVariant.objects.count(), 0)
+        self.assertEqual(models.ProductImage.objects.count(), 0)
@@ -19,4 +19,24 @@ class TestUrls(django.test.TestCase):
         '''
         client = django.test.Client()
         response = client.get('/webhooks/this_should_404')
-        self.assertEqual(response.status_code, 404)
\ No newline at end of file
+        self.assertEqual(response.status_code, 404)
+
+@django.test.override_settings(ROOT_URLCONF='logify.urls_webhooks',
+                               MIDDLEWARE_CLASSES=(
+                                   'django.middleware.common.CommonMiddleware',))
+class TestWebhookOnlyUrls(django.test.TestCase):
+    '''
+    Test the URLconf used by the webhook-only deployment.
+    '''
+
+    def test_shopify_customer_create(self):
+        client = django.test.Client()
+        response = client.get('/webhooks/shopify/123/customer_create')
+        self.assertEqual(response.status_code, 405)
+        response = client.post('/webhooks/shopify/123/customer_create')
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_not_routed(self):
+        client = django.test.Client()
+        response = client.get('/admin/')
+        self.assertEqual(response.status_code, 404)
@@ -109,3 +109,59 @@ class ShopifyRequestFactory():
     def shop_update(self, path, data):
         topic = 'shop/update'
         return self.create_shopify_webhook_request(path, data, topic)
+
+    def product_create(self, path, data):
+        topic = 'products/create'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def product_update(self, path, data):
+        topic = 'products/update'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def product_delete(self, path, data):
+        topic = 'products/delete'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def cart_create(self, path, data):
+        topic = 'carts/create'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def cart_update(self, path, data):
+        topic = 'carts/update'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def checkout_create(self, path, data):
+        topic = 'checkouts/create'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def checkout_update(self, path, data):
+        topic = 'checkouts/update'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def checkout_delete(self, path, data):
+        topic = 'checkouts/delete'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def order_create(self, path, data):
+        topic = 'orders/create'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def order_paid(self, path, data):
+        topic = 'orders/paid'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def order_cancelled(self, path, data):
+        topic = 'orders/cancelled'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def refund_create(self, path, data):
+        topic = 'refunds/create'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def customers_redact(self, path, data):
+        topic = 'customers/redact'
+        return self.create_shopify_webhook_request(path, data, topic)
+
+    def shop_redact(self, path, data):
+        topic = 'shop/redact'
+        return self.create_shopify_webhook_request(path, data, topic)
@@ -1,5 +1,26 @@
 from django.conf.urls import patterns, url
 
 urlpatterns = patterns('webhooks.views',
-    url(r'^shopify/(?P<siteid>[\w]+)/customer_create', 'shopify_customer_create')
+    url(r'^shopify/(?P<siteid>[\w]+)/order_create', 'shopify_order_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/order_paid', 'shopify_order_paid'),
+    url(r'^shopify/(?P<siteid>[\w]+)/order_cancelled', 'shopify_order_cancelled'),
+    url(r'^shopify/(?P<siteid>[\w]+)/refund_create', 'shopify_refund_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customer_create', 'shopify_customer_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customer_update', 'shopify_customer_update'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customer_enable', 'shopify_customer_enable'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customer_disable', 'shopify_customer_disable'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customer_delete', 'shopify_customer_delete'),
+    url(r'^shopify/(?P<siteid>[\w]+)/shop_update', 'shopify_shop_update'),
+    url(r'^shopify/(?P<siteid>[\w]+)/customers_redact', 'shopify_customers_redact'),
+    url(r'^shopify/(?P<siteid>[\w]+)/shop_redact', 'shopify_shop_redact'),
+    url(r'^shopify/(?P<siteid>[\w]+)/product_create', 'shopify_product_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/product_update', 'shopify_product_update'),
+    url(r'^shopify/(?P<siteid>[\w]+)/product_delete', 'shopify_product_delete'),
+    url(r'^shopify/(?P<siteid>[\w]+)/cart_create', 'shopify_cart_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/cart_update', 'shopify_cart_update'),
+    url(r'^shopify/(?P<siteid>[\w]+)/checkout_create', 'shopify_checkout_create'),
+    url(r'^shopify/(?P<siteid>[\w]+)/checkout_update', 'shopify_checkout_update'),
+    url(r'^shopify/(?P<siteid>[\w]+)/checkout_delete', 'shopify_checkout_delete'),
+    url(r'^metrics$', 'metrics_snapshot'),
+    url(r'^changes$', 'changes'),
 )
@@ -1,18 +1,70 @@
 import json
-from decimal import Decimal
+import math
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.shortcuts import render
 import django.http
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-import dateutil.parser
 
 from webhooks.models import *
-from webhooks.libs import validate
+from webhooks.libs import (abandonment, archive, bulk, cache, changelog,
+                           lifetime, mapping, metrics, redaction, schema,
+                           tracing, validate, writebehind)
+
+#: Carts and checkouts change on every add-to-cart, so their latest
+#: states are buffered and written in bulk; see
+#: :class:`webhooks.libs.writebehind.WriteBehindBuffer`.
+cart_buffer = writebehind.WriteBehindBuffer(
+    Cart, 'token', Cart.DIRECT_COPY_FIELDS + ['line_items'],
+    version='updated_at')
+checkout_buffer = writebehind.WriteBehindBuffer(
+    Checkout, 'shopify_id',
+    Checkout.DIRECT_COPY_FIELDS + ['customer_shopify_id', 'line_items',
+                                   'abandoned_at'],
+    version='updated_at')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_order_create(request, siteid):
-    pass
+    '''
+    Link the order to the checkout it was placed from, which stops the
+    checkout from being marked abandoned.
+    '''
+    data, response = schema.parse_payload(request, 'orders/create')
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    checkout_id = data.get('checkout_id')
+    if checkout_id is not None:
+        with transaction.atomic():
+            _link_order(checkout_id, data)
+        abandonment.scheduler.cancel(checkout_id)
+
+    return django.http.HttpResponse()
+
+def _link_order(checkout_id, data):
+    '''
+    Record the order in `data` on the checkout with `checkout_id`. The
+    checkout has no row yet while its state is held in a write-behind
+    buffer, here or in another process: a row holding the link is
+    created, which the buffered state then updates without touching the
+    link (see :data:`checkout_buffer`).
+    '''
+    checkouts = Checkout.objects.filter(shopify_id=checkout_id)
+    if checkouts.update(order_shopify_id=data['id']):
+        return
+    try:
+        with transaction.atomic():
+            Checkout.objects.create(
+                shopify_id=checkout_id, order_shopify_id=data['id'],
+                token=(data.get('checkout_token') or '')[:64])
+    except IntegrityError:
+        # Written by a buffer in the meantime
+        checkouts.update(order_shopify_id=data['id'])
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
@@ -22,12 +74,35 @@ def shopify_order_updated(request, siteid):
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_order_paid(request, siteid):
-    pass
+    '''
+    Count the order in the lifetime value of its customer; see
+    :mod:`webhooks.libs.lifetime`.
+    '''
+    return _update_lifetime_value(request, 'orders/paid', lifetime.paid)
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_order_cancelled(request, siteid):
-    pass
+    '''
+    Take the order out of the lifetime value of its customer; see
+    :mod:`webhooks.libs.lifetime`.
+    '''
+    return _update_lifetime_value(request, 'orders/cancelled',
+                                  lifetime.cancelled)
+
+def _update_lifetime_value(request, topic, apply):
+    data, response = schema.parse_payload(request, topic)
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    customer_id = lifetime.customer_id(data)
+    if customer_id is not None and customer_id.__class__ is not int:
+        return django.http.HttpResponseBadRequest('type:customer.id')
+    with tracing.span('save'):
+        apply(data)
+    return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
@@ -42,27 +117,109 @@ def shopify_order_delete(request, siteid):
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_product_create(request, siteid):
-    pass
+    '''
+    Create the product, or update it if it already exists, along with
+    its variants and images.
+    '''
+    return _save_product(request, 'products/create')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_product_update(request, siteid):
-    pass
+    '''
+    Update the product, or create it if it does not exist, along with
+    its variants and images.
+    '''
+    return _save_product(request, 'products/update')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_product_delete(request, siteid):
-    pass
+    '''
+    Delete the product and its variants and images. If it cannot be
+    found, do nothing.
+    '''
+    data, response = schema.parse_payload(request, 'products/delete')
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    Product.objects.filter(shopify_id=data['id']).delete()
+    return django.http.HttpResponse()
+
+def _save_product(request, topic):
+    '''
+    Save the product in the payload of `request`. Variants and images
+    are written with :func:`webhooks.libs.bulk.sync_children`, so the
+    number of queries does not depend on how many there are. Variants
+    and images missing from the payload are deleted.
+    '''
+    data, response = schema.parse_payload(request, topic)
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    with transaction.atomic():
+        try:
+            product = Product.objects.get(shopify_id=data['id'])
+        except Product.DoesNotExist:
+            product = Product(shopify_id=data['id'])
+
+        children = Product.copy_payload(product, data)
+        product.save()
+
+        if 'variants' in data:
+            bulk.sync_children(ProductVariant, 'product', product,
+                               children.get('variants', []),
+                               ProductVariant.DIRECT_COPY_FIELDS)
+        if 'images' in data:
+            bulk.sync_children(ProductImage, 'product', product,
+                               children.get('images', []),
+                               ProductImage.DIRECT_COPY_FIELDS)
+
+    return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_cart_create(request, siteid):
-    pass
+    '''
+    Buffer the state of the cart; see :data:`cart_buffer`.
+    '''
+    return _buffer_cart(request, 'carts/create')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_cart_update(request, siteid):
-    pass
+    '''
+    Buffer the state of the cart; see :data:`cart_buffer`.
+    '''
+    return _buffer_cart(request, 'carts/update')
+
+def _buffer_cart(request, topic):
+    data, response = schema.parse_payload(request, topic)
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    cart = Cart(token=data['id'])
+    Cart.copy_payload(cart, data)
+    cart.line_items = json.dumps(data.get('line_items') or [])
+    if not cart_buffer.put(cart):
+        return _buffer_full()
+
+    return django.http.HttpResponse()
+
+def _buffer_full():
+    '''
+    Ask Shopify to resend a webhook that a full write-behind buffer
+    could not take.
+    '''
+    response = django.http.HttpResponse('Buffer full', status=503)
+    response['Retry-After'] = '1'
+    return response
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
@@ -97,17 +254,55 @@ def shopify_customer_group_delete(request, siteid):
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_checkout_create(request, siteid):
-    pass
+    '''
+    Buffer the state of the checkout; see :data:`checkout_buffer`, and
+    arm its abandonment timer.
+    '''
+    return _buffer_checkout(request, 'checkouts/create')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_checkout_update(request, siteid):
-    pass
+    '''
+    Buffer the state of the checkout; see :data:`checkout_buffer`, and
+    rearm its abandonment timer.
+    '''
+    return _buffer_checkout(request, 'checkouts/update')
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_checkout_delete(request, siteid):
-    pass
+    '''
+    Buffer the deletion of the checkout; see :data:`checkout_buffer`.
+    '''
+    data, response = schema.parse_payload(request, 'checkouts/delete')
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    if not checkout_buffer.delete(data['id']):
+        return _buffer_full()
+    abandonment.scheduler.cancel(data['id'])
+    return django.http.HttpResponse()
+
+def _buffer_checkout(request, topic):
+    data, response = schema.parse_payload(request, topic)
+    if response is not None:
+        return response
+    if data['id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    checkout = Checkout()
+    Checkout.copy_payload(checkout, data)
+    if data.get('customer'):
+        checkout.customer_shopify_id = data['customer'].get('id')
+    checkout.line_items = json.dumps(data.get('line_items') or [])
+    if not checkout_buffer.put(checkout):
+        return _buffer_full()
+    abandonment.scheduler.arm(checkout)
+
+    return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
@@ -126,13 +321,24 @@ def shopify_customer_create(request, siteid):
     Test if a customer with the same shopify_id already exists. If one
     does, then return a 200 response. If one does not, then create it.
     '''
-    data = json.loads(request.body.decode('utf8'))
+    return _create_customer(request, siteid)
+
+def _create_customer(request, siteid):
+    '''
+    The body of :func:`shopify_customer_create`, which the other customer
+    views fall back to. It is not wrapped in the validation decorator, so
+    a request is admitted, and its HMAC checked, only once.
+    '''
+    data, response = schema.parse_payload(request, 'customers/create')
+    if response is not None:
+        return response
     if data['id'] == None:  # Test request
         return django.http.HttpResponse()
 
-    # Test if customer already exists
+    # Test if customer already exists, possibly archived
     try:
-        customer = Customer.objects.get(shopify_id=data['id'])
+        with tracing.span('lookup'):
+            customer = archive.lookup(data['id'])
         return django.http.HttpResponse()
     except Customer.DoesNotExist:
         pass
@@ -140,29 +346,64 @@ def shopify_customer_create(request, siteid):
     # Create a new customer
     customer = Customer()
     customer.shopify_id = data['id']
+    customer.siteid = siteid
 
-    for fieldname in Customer.DIRECT_COPY_FIELDS:
-        if fieldname in data:
-            setattr(customer, fieldname, data[fieldname])
-
-    customer.created_at = dateutil.parser.parse(data['created_at'])
-    customer.updated_at = dateutil.parser.parse(data['updated_at'])
-
-    if 'total_spent' in data:
-        customer.total_spent = Decimal(data['total_spent'])
+    Customer.copy_payload(customer, data)
 
     # TODO: handle addresses
 
-    customer.save()  # Customer must be saved before using ManyToMany fields
-
-    if 'tags' in data and data['tags']:
-        tags = data['tags'].split(', ')
-        for tag in tags:
-            customer.tags.add(CustomerTag.get_or_create(tag))
-        customer.save()
-
+    # The customer and its changelog record are written together
+    with transaction.atomic():
+        try:
+            # Customer must be saved before using ManyToMany fields
+            with tracing.span('save'), transaction.atomic():
+                customer.save()
+        except IntegrityError:
+            # The customer was created concurrently, or deleted already
+            # and this is a late delivery.
+            return django.http.HttpResponse()
+
+        if 'tags' in data and data['tags']:
+            with tracing.span('tags'):
+                tags = data['tags'].split(', ')
+                for tag in tags:
+                    customer.tags.add(CustomerTag.get_or_create(tag))
+
+        changelog.created(customer, tags=data.get('tags') or '')
     return django.http.HttpResponse()
 
+def _live_customer(shopify_id):
+    '''
+    Return the customer with `shopify_id` as it is in the database,
+    restored from the archive if needed and locked until the end of the
+    transaction, or `None` if there is none. Writes must not start from
+    a cached copy: it may predate a deletion, redaction or archive made
+    by another process, which saving it would undo.
+    '''
+    with tracing.span('lookup'):
+        customer = (Customer.objects.select_for_update()
+                    .filter(shopify_id=shopify_id).first())
+        if customer is None:
+            customer = archive.restore(shopify_id)
+            if customer is not None:
+                customer = Customer.objects.select_for_update().get(
+                    pk=customer.pk)
+    return customer
+
+def _save_changes(instance, before):
+    '''
+    Save the fields of `instance`, a customer or a shop, that differ from
+    the :func:`webhooks.libs.changelog.snapshot` `before`, and only
+    those.
+    '''
+    fields = [name for name, value in changelog.snapshot(instance).items()
+              if before.get(name) != value]
+    if 'email' in fields and isinstance(instance, Customer):
+        fields.append('email_hash')
+    if fields:
+        with tracing.span('save'):
+            instance.save(update_fields=fields)
+
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_customer_enable(request, siteid):
@@ -171,18 +412,21 @@ def shopify_customer_enable(request, siteid):
     object. If the ID does not exist, then create a new customer
     object with the given data.
     '''
-    data = json.loads(request.body.decode('utf8'))
+    data, response = schema.parse_payload(request, 'customers/enable')
+    if response is not None:
+        return response
     if data['id'] == None:  # Test request
         return django.http.HttpResponse()
 
-    try:
-        customer = Customer.objects.get(shopify_id=data['id'])
-    except Customer.DoesNotExist:
-        return shopify_customer_create(request, siteid)
-
-    customer.state = 'enabled'
-    customer.updated_at = dateutil.parser.parse(data['updated_at'])
-    customer.save()
+    with transaction.atomic():
+        customer = _live_customer(data['id'])
+        if customer is None:
+            return _create_customer(request, siteid)
+        before = changelog.snapshot(customer)
+        customer.state = 'enabled'
+        customer.updated_at = mapping.parse_datetime(data['updated_at'])
+        _save_changes(customer, before)
+        changelog.updated(customer, before)
 
     return django.http.HttpResponse()
 
@@ -195,18 +439,21 @@ def shopify_customer_disable(request, siteid):
     object with the given data.
     '''
 
-    data = json.loads(request.body.decode('utf8'))
+    data, response = schema.parse_payload(request, 'customers/disable')
+    if response is not None:
+        return response
     if data['id'] == None:  # Test request
         return django.http.HttpResponse()
 
-    try:
-        customer = Customer.objects.get(shopify_id=data['id'])
-    except Customer.DoesNotExist:
-        return shopify_customer_create(request, siteid)
-
-    customer.state = 'disabled'
-    customer.updated_at = dateutil.parser.parse(data['updated_at'])
-    customer.save()
+    with transaction.atomic():
+        customer = _live_customer(data['id'])
+        if customer is None:
+            return _create_customer(request, siteid)
+        before = changelog.snapshot(customer)
+        customer.state = 'disabled'
+        customer.updated_at = mapping.parse_datetime(data['updated_at'])
+        _save_changes(customer, before)
+        changelog.updated(customer, before)
 
     return django.http.HttpResponse()
 
@@ -219,81 +466,181 @@ def shopify_customer_update(request, siteid):
     new customer object with the given data.
     '''
 
-    data = json.loads(request.body.decode('utf8'))
+    data, response = schema.parse_payload(request, 'customers/update')
+    if response is not None:
+        return response
     if data['id'] == None:  # Test request
         return django.http.HttpResponse()
 
-    try:
-        customer = Customer.objects.get(shopify_id=data['id'])
-    except Customer.DoesNotExist:
-        return shopify_customer_create(request, siteid)
-
-    for fieldname in Customer.DIRECT_COPY_FIELDS:
-        if fieldname in data:
-            setattr(customer, fieldname, data[fieldname])
-
-    customer.created_at = dateutil.parser.parse(data['created_at'])
-    customer.updated_at = dateutil.parser.parse(data['updated_at'])
-
-    if 'total_spent' in data:
-        customer.total_spent = Decimal(data['total_spent'])
-
-    # TODO: handle addresses
-
-    customer.save()
-
-    if 'tags' in data and data['tags']:
-        customer.tags.clear()
-        tags = data['tags'].split(', ')
-        for tag in tags:
-            customer.tags.add(CustomerTag.get_or_create(tag))
-        customer.save()
-
+    with transaction.atomic():
+        customer = _live_customer(data['id'])
+        if customer is None:
+            return _create_customer(request, siteid)
+        before = changelog.snapshot(customer)
+        Customer.copy_payload(customer, data)
+        customer.siteid = siteid
+
+        # TODO: handle addresses
+
+        _save_changes(customer, before)
+
+        changed = {}
+        if 'tags' in data and data['tags']:
+            with tracing.span('tags'):
+                old_tags = set(customer.tags.values_list('name', flat=True))
+                customer.tags.clear()
+                tags = data['tags'].split(', ')
+                for tag in tags:
+                    customer.tags.add(CustomerTag.get_or_create(tag))
+            if set(tags) != old_tags:
+                changed['tags'] = data['tags']
+
+        changelog.updated(customer, before, **changed)
     return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_customer_delete(request, siteid):
     '''
-    If the given customer ID already exists, delete it. If it cannot be
-    found, do nothing.
+    If the given customer ID already exists, mark it deleted with a
+    single UPDATE. If it cannot be found, do nothing. The customer, its
+    tags and its addresses are removed later by
+    ``manage.py purge_customers``.
     '''
-    data = json.loads(request.body.decode('utf8'))
+    data, response = schema.parse_payload(request, 'customers/delete')
+    if response is not None:
+        return response
     if data['id'] == None:  # Test request
         return django.http.HttpResponse()
 
-    try:
-        customer = Customer.objects.get(shopify_id=data['id'])
-        customer.delete()
-    except Customer.DoesNotExist:
-        pass
+    with transaction.atomic():
+        with tracing.span('save'):
+            deleted = Customer.objects.filter(shopify_id=data['id']).update(
+                deleted_at=timezone.now())
+        archived = ArchivedCustomer.objects.filter(shopify_id=data['id'])
+        if not deleted and archived.exists():
+            archived.delete()
+            deleted = True
+        if deleted:
+            changelog.deleted(Customer, data['id'])
+    cache.invalidate(Customer, data['id'])
 
     return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_shop_update(request, siteid):
-
-    data = json.loads(request.body.decode('utf8'))
+    '''
+    Update the shop from the locked row in the database, saving only the
+    fields that changed, or create it if it does not exist.
+    '''
+    data, response = schema.parse_payload(request, 'shop/update')
+    if response is not None:
+        return response
     if data['id'] is None:  # Test request
         return django.http.HttpResponse()
 
-    try:
-        shop = Shop.objects.get(shopify_id=data['id'])
-    except Shop.DoesNotExist:
-        shop = Shop()
-        shop.shopify_id = data['id']
+    with transaction.atomic():
+        with tracing.span('lookup'):
+            shop = (Shop.objects.select_for_update()
+                    .filter(shopify_id=data['id']).first())
+        if shop is None:
+            shop = Shop(shopify_id=data['id'])
+            Shop.copy_payload(shop, data)
+            with tracing.span('save'):
+                shop.save()
+            changelog.created(shop)
+        else:
+            before = changelog.snapshot(shop)
+            Shop.copy_payload(shop, data)
+            _save_changes(shop, before)
+            changelog.updated(shop, before)
+    return django.http.HttpResponse()
 
-    for fieldname in Shop.DIRECT_COPY_FIELDS:
-        if fieldname in data:
-            setattr(shop, fieldname, data[fieldname])
+@csrf_exempt
+@validate.ValidateShopifyWebhookRequest
+def shopify_customers_redact(request, siteid):
+    '''
+    Queue the erasure of a customer; see :mod:`webhooks.libs.redaction`.
+    '''
+    data, response = schema.parse_payload(request, 'customers/redact')
+    if response is not None:
+        return response
+    if data['shop_id'] is None:  # Test request
+        return django.http.HttpResponse()
 
-    shop.created_at = dateutil.parser.parse(data['created_at'])
+    customer_id = data['customer'].get('id')
+    if customer_id.__class__ is not int:
+        return django.http.HttpResponseBadRequest('type:customer.id')
+    redaction.enqueue(RedactionJob.CUSTOMER, siteid, data['shop_id'],
+                      customer_id)
+    return django.http.HttpResponse()
 
-    shop.save()
+@csrf_exempt
+@validate.ValidateShopifyWebhookRequest
+def shopify_shop_redact(request, siteid):
+    '''
+    Queue the erasure of all customers of the shop; see
+    :mod:`webhooks.libs.redaction`.
+    '''
+    data, response = schema.parse_payload(request, 'shop/redact')
+    if response is not None:
+        return response
+    if data['shop_id'] is None:  # Test request
+        return django.http.HttpResponse()
+
+    redaction.enqueue(RedactionJob.SHOP, siteid, data['shop_id'])
     return django.http.HttpResponse()
 
 @csrf_exempt
 @validate.ValidateShopifyWebhookRequest
 def shopify_refund_create(request, siteid):
-    pass
+    '''
+    Record the refund and add it to the lifetime value of the customer;
+    see :mod:`webhooks.libs.lifetime`.
+    '''
+    return _update_lifetime_value(request, 'refunds/create',
+                                  lifetime.refund_created)
+
+
+def metrics_snapshot(request):
+    '''
+    Return the counters of this process as JSON. Only clients listed in
+    ``settings.INTERNAL_IPS`` may read them.
+    '''
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return django.http.HttpResponseForbidden()
+    counters = metrics.snapshot()
+    counters['cache.hit_ratio'] = cache.hit_ratios()
+    return django.http.HttpResponse(json.dumps(counters),
+                                    content_type='application/json')
+
+
+def changes(request):
+    '''
+    Return the changelog records after the offset given as ``after``,
+    waiting up to ``wait`` seconds (at most
+    ``settings.CHANGELOG_MAX_WAIT``) for one to appear, as JSON with the
+    offset to resume from as ``next``. Only clients listed in
+    ``settings.INTERNAL_IPS`` may read them.
+    '''
+    if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return django.http.HttpResponseForbidden()
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', settings.CHANGELOG_PAGE_SIZE))
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return django.http.HttpResponseBadRequest('Invalid parameter')
+    if not math.isfinite(wait):
+        return django.http.HttpResponseBadRequest('Invalid parameter')
+    limit = min(max(limit, 1), settings.CHANGELOG_PAGE_SIZE)
+    wait = min(max(wait, 0), settings.CHANGELOG_MAX_WAIT)
+
+    records = changelog.read(after, limit, wait)
+    body = {
+        'changes': [changelog.as_dict(record) for record in records],
+        'next': records[-1].id if records else after,
+    }
+    return django.http.HttpResponse(json.dumps(body),
+                                    content_type='application/json')